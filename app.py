@@ -1,35 +1,79 @@
 import os
-import uuid
-from flask import Flask, request, jsonify, render_template, session as session_data
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-import re
-from datetime import datetime
-from collections import defaultdict
-import random
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context, session as session_data
 import logging
-import copy
 import json
-from utils.constants import AB_TEST_ENABLED
-from utils.firebase import seed_initial_products, save_session_to_firestore
-from utils.llm import call_gemini_api, call_openrouter_api, get_base_system_prompt, build_llm_prompt_context_instruction
+import sys
+import time
+import click
+from utils.constants import AB_TEST_ENABLED, STREAMING_ENABLED, LOG_LEVEL, HEDGED_REQUESTS_ENABLED
+from utils.llm import (
+    call_gemini_api, call_openrouter_api, stream_gemini_api, stream_openrouter_api,
+    get_base_system_prompt, build_llm_prompt_context_instruction
+)
+from utils.chat import start_new_session, restart_lost_session, validate_customer_input, build_gemini_history, apply_llm_response, discard_user_turn
+from utils.context import prepare_llm_context
+from utils.stream_parser import RespostaStreamExtractor
+from utils.session_store import create_session_store, ServerSideSessionInterface
+from utils.dashboard import load_dashboard_data, list_dashboard_models, backfill_rollups
+from utils.write_behind import queue_session_save
+from utils.catalog import get_catalog
+from utils import response_cache
+from utils.cart import get_product_index, reprice_cart
+from utils.checkout import answer_locally
+from utils.hedging import call_llm_hedged
+from utils.export import EXPORT_FORMATS, export_sessions, parse_export_date
+from utils.tracing import span, trace_turn, log_turn
+from utils.metrics import render_prometheus
+from utils.lifecycle import get_firestore_client, warm_up, readiness, liveness
+from utils.admission import AdmissionRejected, Slot, admit, busy_reply, turn_model
+
+if LOG_LEVEL:
+    logging.basicConfig(level=LOG_LEVEL)
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dapojNDOUIANIKDAHIODHAKMsdnawuiohqSJ213141SAMjmopdja")
 
-try:
-    cred = credentials.ApplicationDefault()
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    logging.info("Firebase Admin SDK inicializado com sucesso.")
-except Exception as e:
-    logging.error(f"ERRO CRÍTICO: Falha ao inicializar o Firebase Admin SDK: {e}")
-    db = None
+session_store = create_session_store()
+if session_store is not None:
+    app.session_interface = ServerSideSessionInterface(session_store)
+
+# Criado sob demanda em cada processo (ver get_db): importar o app não toca no Firebase,
+# o que permite o preload_app do gunicorn sem compartilhar conexões gRPC entre workers.
+db = None
+
+def get_db():
+    """Cliente do Firestore deste processo, inicializado na primeira chamada."""
+    global db
+    if db is None:
+        db = get_firestore_client()
+    return db
+
+@app.before_request
+def ensure_db():
+    if request.endpoint not in ('healthz', 'metrics_endpoint'):
+        get_db()
+
+def warm_up_app():
+    """Aquece este worker: Firestore, catálogo, prompt, conexões com os LLMs e templates."""
+    templates = ("index.html", "dashboard.html")
+    return warm_up(get_db(), extra_steps=[("templates", lambda: [app.jinja_env.get_template(name) for name in templates])])
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: o processo responde, sem depender do Firestore nem dos provedores."""
+    return jsonify(liveness())
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 só depois do aquecimento deste worker (feito aqui se ainda não rodou)."""
+    state = readiness()
+    if state["phase"] == "cold":
+        state = warm_up_app()
+    return jsonify(state), 200 if state["ready"] else 503
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', streaming_enabled=STREAMING_ENABLED)
 
 @app.route('/dash')
 def dashboard():
@@ -38,13 +82,11 @@ def dashboard():
 
 @app.route('/list_models')
 def list_models():
-    """Busca e retorna uma lista de nomes de modelos únicos da coleção de sessões."""
+    """Retorna a lista de modelos únicos, lida do índice mantido em dashboard_meta/models."""
     if not db:
         return jsonify({"error": "Firestore não está disponível"}), 500
     try:
-        sessions_ref = db.collection('sessions').select(['model_used']).stream()
-        unique_models = set(session.get('model_used') for session in sessions_ref if session.get('model_used'))
-        return jsonify(sorted(list(unique_models)))
+        return jsonify(list_dashboard_models(db))
     except Exception as e:
         logging.error(f"Erro ao listar modelos: {e}")
         return jsonify({"error": "Falha ao buscar lista de modelos"}), 500
@@ -52,117 +94,106 @@ def list_models():
 
 @app.route('/dashboard_data')
 def dashboard_data():
-    """Fornece os dados processados para os gráficos do dashboard, com filtro opcional por modelo."""
+    """Fornece os dados dos gráficos do dashboard a partir dos contadores pré-agregados, com filtro opcional por modelo."""
     if not db:
         return jsonify({"error": "Firestore não está disponível"}), 500
 
     try:
         selected_model = request.args.get('model')
-        
-        query = db.collection('sessions')
         if selected_model:
             logging.info(f"Filtrando dados do dashboard para o modelo: {selected_model}")
-            query = query.where('model_used', '==', selected_model)
-        
-        sessions = [doc.to_dict() for doc in query.stream()]
-
-        # Processamento para o gráfico de barras
-        states_by_model = defaultdict(lambda: defaultdict(int))
-        all_states = set()
-        model_labels = set()
-
-        for session in sessions:
-            model = session.get('model_used', 'Desconhecido')
-            state = session.get('final_state', 'UNKNOWN')
-            states_by_model[model][state] += 1
-            all_states.add(state)
-            model_labels.add(model)
-        
-        sorted_states = sorted(list(all_states))
-        bar_chart_datasets = []
-        for model_label in sorted(list(model_labels)):
-            bar_chart_datasets.append({
-                "label": model_label,
-                "data": [states_by_model[model_label].get(state, 0) for state in sorted_states]
-            })
-
-        bar_chart_data = {"labels": sorted_states, "datasets": bar_chart_datasets}
-
-
-        # Processamento para o gráfico de série temporal
-        time_series_by_model = defaultdict(lambda: defaultdict(lambda: {'total': 0, 'finalized': 0}))
-        for session in sessions:
-            model = session.get('model_used', 'Desconhecido')
-            timestamp = session.get('timestamp_utc')
-            if not isinstance(timestamp, datetime): continue 
-
-            date_str = timestamp.strftime('%Y-%m-%d')
-            time_series_by_model[model][date_str]['total'] += 1
-            if session.get('final_state') == 'proposta_final':
-                time_series_by_model[model][date_str]['finalized'] += 1
-        
-        time_series_datasets = []
-        for model_label, date_data in time_series_by_model.items():
-            dataset = {"label": model_label, "data": []}
-            for date_str in sorted(date_data.keys()):
-                daily_data = date_data[date_str]
-                rate = (daily_data['finalized'] / daily_data['total'] * 100) if daily_data['total'] > 0 else 0
-                dataset["data"].append({"x": date_str, "y": round(rate, 2)})
-            time_series_datasets.append(dataset)
-        
-        time_series_data = {"datasets": time_series_datasets}
-
-        return jsonify({
-            "bar_chart_data": bar_chart_data,
-            "time_series_data": time_series_data
-        })
+        return jsonify(load_dashboard_data(db, selected_model))
 
     except Exception as e:
         logging.error(f"Erro ao buscar dados do dashboard: {e}")
         return jsonify({"error": "Falha ao processar dados do dashboard"}), 500
 
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Soma aos contadores do dashboard as sessões gravadas antes deles (pode rodar com o app no ar)."""
+    if not get_db():
+        logging.error("ERRO CRÍTICO: Firestore não inicializado.")
+        return
+    result = backfill_rollups(db)
+    print(f"{result['sessions']} sessões lidas, {result['counted']} somadas aos contadores, modelos: {', '.join(result['models'])}")
+
+@app.route('/export/sessions')
+def export_sessions_endpoint():
+    """Exporta as sessões (uma linha por sessão) em CSV ou Parquet, em streaming, com filtros por data e modelo."""
+    if not db:
+        return jsonify({"error": "Firestore não está disponível"}), 500
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Formato inválido: {export_format} (use csv ou parquet)"}), 400
+    try:
+        start = parse_export_date(request.args.get('start'))
+        end = parse_export_date(request.args.get('end'), end=True)
+        chunks = export_sessions(db, export_format, start, end, request.args.get('model'))
+    except ValueError:
+        return jsonify({"error": "Datas devem estar no formato AAAA-MM-DD"}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=sessions.{extension}"})
+
+@app.cli.command('export-sessions')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--start', help="Primeiro dia (AAAA-MM-DD, UTC).")
+@click.option('--end', help="Último dia, inclusivo (AAAA-MM-DD, UTC).")
+@click.option('--model', help="Filtra por model_used.")
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="Arquivo de saída (padrão: stdout).")
+def export_sessions_command(export_format, start, end, model, output):
+    """Exporta a coleção 'sessions' em CSV ou Parquet, página a página."""
+    if not get_db():
+        logging.error("ERRO CRÍTICO: Firestore não inicializado.")
+        return
+    try:
+        start, end = parse_export_date(start), parse_export_date(end, end=True)
+    except ValueError as e:
+        raise click.BadParameter(f"use AAAA-MM-DD ({e})")
+    chunks = export_sessions(db, export_format, start, end, model)
+    binary = export_format == "parquet"
+    if output:
+        with open(output, "wb" if binary else "w", **({} if binary else {"encoding": "utf-8", "newline": ""})) as f:
+            for chunk in chunks:
+                f.write(chunk)
+    else:
+        stream = sys.stdout.buffer if binary else sys.stdout
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.flush()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Contadores, gauges e histogramas deste worker no formato de texto do Prometheus (rótulo `worker` = PID)."""
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/initialize_chat', methods=['POST'])
+@trace_turn("initialize_chat")
 def initialize_chat():
     if not db:
         return jsonify({"bot_response": "ERRO: Banco de dados indisponível.", "chat_state": "ERROR"}), 500
     
     if session_data.get("session_uuid") and not session_data.get("session_saved"):
-        session_to_save = copy.deepcopy(session_data) # Cria uma cópia profunda para garantir a integridade dos dados
-        logging.info(f"Salvando sessão anterior abandonada: {session_to_save['session_uuid']}")
-        save_session_to_firestore(db, session_to_save)
+        # queue_session_save copia o registro da sessão ao enfileirar, então não é preciso copiá-la.
+        logging.info(f"Salvando sessão anterior abandonada: {session_data['session_uuid']}")
+        queue_session_save(db, session_data)
     
-    session_data.clear()
-    session_data["customer_data"] = {
-        "name": None, "email": None, "phone": None, 
-        "product_selected_for_cart": None, 
-        "cart": []
-    }
-    session_data["chat_state"] = 'ajuda_na_escolha' 
-    session_data["chat_history_for_llm"] = []
-    session_data["last_input_invalid"] = False
-    session_data["session_uuid"] = str(uuid.uuid4())
-    session_data["session_saved"] = False
-    session_data["total_value"] = 0.0
-
-
-    if AB_TEST_ENABLED:
-        session_data["ab_test_group"] = random.choice(['A', 'B'])
-        logging.info(f"Nova sessão iniciada. Teste A/B ativo. Grupo atribuído: {session_data['ab_test_group']}")
-    else:
-        session_data["ab_test_group"] = 'A' 
-        logging.info("Nova sessão iniciada. Teste A/B inativo. Usando modelo padrão do grupo A.")
-
-    initial_greeting = "Olá! Bem-vindo ao Marketplace de Eletrônicos. Sou 39A-na, sua assistente virtual. O que você está procurando hoje?"
-    session_data["chat_history_for_llm"].append({"role": "model", "parts": [{"text": initial_greeting}]})
+    initial_greeting = start_new_session(session_data)
     return jsonify({"bot_response": initial_greeting, "chat_state": session_data["chat_state"]})
 
 @app.route('/send_message', methods=['POST'])
+@trace_turn("send_message")
 def send_message():
     if not db:
         return jsonify({"bot_response": "ERRO: Banco de dados indisponível.", "chat_state": "ERROR"}), 500
 
     data = request.get_json()
     user_input = data.get('user_input', '').strip()
+    restarted = restart_lost_session(session_data)
+    if restarted:
+        return jsonify({"bot_response": restarted, "chat_state": session_data["chat_state"]}), 409
     session_data["last_input_invalid"] = False 
 
     if not user_input:
@@ -171,76 +202,163 @@ def send_message():
     if session_data["chat_state"] == 'FINALIZED':
         return jsonify({"bot_response": "Obrigado! Para uma nova compra, por favor, reinicie a conversa.", "chat_state": session_data["chat_state"]})
 
-    session_data["chat_history_for_llm"].append({"role": "user", "parts": [{"text": user_input}]})
-    
-    current_state_before_llm = session_data["chat_state"]
-    customer = session_data["customer_data"]
-
-    if current_state_before_llm == 'AWAITING_NAME':
-        words = user_input.split()
-        if len(user_input) > 3 and len(words) >= 2 and words[0][0].isupper() and all(word[0].isalpha() or word[0].isdigit()==False for word in words if len(word)>0): # Verifica se todas as palavras começam com letra
-            customer["name"] = user_input
-            session_data["chat_state"] = 'AWAITING_EMAIL'
-        else:
-            session_data["last_input_invalid"] = True
-    elif current_state_before_llm == 'AWAITING_EMAIL':
-        email_regex = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-        if re.fullmatch(email_regex, user_input):
-            customer["email"] = user_input
-            session_data["chat_state"] = 'AWAITING_PHONE'
-        else:
-            session_data["last_input_invalid"] = True
-    elif current_state_before_llm == 'AWAITING_PHONE':
-        cleaned_phone = re.sub(r'\D', '', user_input)
-        if 10 <= len(cleaned_phone) <= 11:
-            customer["phone"] = user_input 
-            session_data["chat_state"] = 'PROPOSAL_READY'
-        else:
-            session_data["last_input_invalid"] = True
-    llm_payload_history = []
-    system_prompt = get_base_system_prompt(db)
-    context_instruction = build_llm_prompt_context_instruction(session_data)
-    
-    llm_payload_history.append({"role": "user", "parts": [{"text": system_prompt + "\n\n" + context_instruction}]})
-    llm_payload_history.append({"role": "model", "parts": [{"text": "Entendido."}]})
-    llm_payload_history.extend(session_data["chat_history_for_llm"])
+    state_before = validate_customer_input(session_data, user_input)
+    with span("catalog"):
+        product_index = get_product_index(db)
+    # Coleta de dados e pedidos de carrinho sem ambiguidade são resolvidos localmente, sem chamar o LLM.
+    with span("local_reply"):
+        bot_response_text = answer_locally(session_data, user_input, state_before, product_index)
+    if bot_response_text is None:
+        # Um acerto no cache não chama o LLM: não passa pela admissão nem consome ficha ou slot.
+        cache_key, bot_response = response_cache.lookup(session_data, user_input, get_catalog(db)["version"])
+        if bot_response is None:
+            try:
+                with span("admission"):
+                    slot = admit(session_data["session_uuid"], turn_model(session_data, AB_TEST_ENABLED))
+            except AdmissionRejected as e:
+                return busy_response(e, state_before)
+
+            with slot:
+                with span("prompt"):
+                    system_prompt = get_base_system_prompt(db)
+                    context_instruction = build_llm_prompt_context_instruction(session_data)
+                    llm_context = prepare_llm_context(session_data, system_prompt, context_instruction)
+
+                with span("llm", ab_test=AB_TEST_ENABLED):
+                    start = time.perf_counter()
+                    if HEDGED_REQUESTS_ENABLED:
+                        bot_response = call_llm_hedged(system_prompt + "\n\n" + llm_context["context_instruction"], llm_context["history"], session_data, AB_TEST_ENABLED, slot)
+                    elif AB_TEST_ENABLED:
+                        bot_response = call_openrouter_api(system_prompt + "\n\n" + llm_context["context_instruction"], llm_context["history"], session_data)
+                    else:
+                        bot_response = call_gemini_api(build_gemini_history(system_prompt, llm_context["context_instruction"], llm_context["history"]))
+                    response_cache.store(cache_key, bot_response, time.perf_counter() - start)
+        with span("parse"):
+            bot_response_text = apply_llm_response(session_data, bot_response)
+            reprice_cart(session_data, product_index)
+
+    with span("save"):
+        queue_session_save(db, session_data)
+    log_turn(session_data)
+    return jsonify({"bot_response": bot_response_text, "chat_state": session_data["chat_state"]})
+
+@app.route('/send_message_stream', methods=['POST'])
+@trace_turn("send_message_stream")
+def send_message_stream():
+    """Mesmo fluxo de /send_message, mas envia o texto de "resposta" via SSE conforme o LLM gera."""
+    if not db:
+        return jsonify({"bot_response": "ERRO: Banco de dados indisponível.", "chat_state": "ERROR"}), 500
+
+    data = request.get_json()
+    user_input = data.get('user_input', '').strip()
+    restarted = restart_lost_session(session_data)
+    if restarted:
+        return jsonify({"bot_response": restarted, "chat_state": session_data["chat_state"]}), 409
+    session_data["last_input_invalid"] = False
+
+    if not user_input:
+        return jsonify({"bot_response": "Por favor, diga algo.", "chat_state": session_data["chat_state"]}), 400
+
+    if session_data["chat_state"] == 'FINALIZED':
+        return jsonify({"bot_response": "Obrigado! Para uma nova compra, por favor, reinicie a conversa.", "chat_state": session_data["chat_state"]})
+
+    state_before = validate_customer_input(session_data, user_input)
+    with span("catalog"):
+        product_index = get_product_index(db)
+    with span("local_reply"):
+        local_reply = answer_locally(session_data, user_input, state_before, product_index)
+    if local_reply is not None:
+        # Resposta local já completa: sai como JSON, que o front-end também aceita nesta rota.
+        with span("save"):
+            queue_session_save(db, session_data)
+        log_turn(session_data)
+        return jsonify({"bot_response": local_reply, "chat_state": session_data["chat_state"]})
 
-    if AB_TEST_ENABLED:
-        bot_response = call_openrouter_api(system_prompt, session_data["chat_history_for_llm"], session_data)
+    cache_key, cached = response_cache.lookup(session_data, user_input, get_catalog(db)["version"])
+    if cached is not None:
+        # Acerto no cache: a resposta inteira sai num único pedaço, sem admissão nem slot do modelo.
+        slot = Slot(None)
+        chunks = [cached]
     else:
-        bot_response = call_gemini_api(llm_payload_history)
-    bot_response_text = bot_response
-    match = re.search(r'\{.*\}', bot_response, re.DOTALL)
+        try:
+            with span("admission"):
+                slot = admit(session_data["session_uuid"], turn_model(session_data, AB_TEST_ENABLED))
+        except AdmissionRejected as e:
+            return busy_response(e, state_before)
+
+        try:
+            with span("prompt"):
+                system_prompt = get_base_system_prompt(db)
+                context_instruction = build_llm_prompt_context_instruction(session_data)
+                llm_context = prepare_llm_context(session_data, system_prompt, context_instruction)
+
+            if AB_TEST_ENABLED:
+                stream = stream_openrouter_api(system_prompt + "\n\n" + llm_context["context_instruction"], llm_context["history"], session_data)
+            else:
+                stream = stream_gemini_api(build_gemini_history(system_prompt, llm_context["context_instruction"], llm_context["history"]))
+            chunks = response_cache.store_stream(cache_key, stream)
+        except BaseException:
+            # Até o Response existir, ninguém mais libera o slot: sem isto ele vazaria para sempre.
+            slot.release()
+            raise
+
+    def generate():
+        # O corpo é gerado depois que a view retorna: o tempo do stream fica em `llm_stream`, fora de chat_turn_seconds.
+        extractor = RespostaStreamExtractor()
+        with span("llm_stream", ab_test=AB_TEST_ENABLED), slot:
+            for chunk in chunks:
+                delta = extractor.feed(chunk)
+                if delta:
+                    yield _sse_event("delta", {"text": delta})
+
+        # O estado (chat_state, cart, total_value) só é aplicado com o objeto completo.
+        with span("parse"):
+            bot_response_text = apply_llm_response(session_data, extractor.text)
+            reprice_cart(session_data, product_index)
+        with span("save"):
+            queue_session_save(db, session_data)
+        log_turn(session_data)
+        done = {"bot_response": bot_response_text, "chat_state": session_data["chat_state"]}
+        if isinstance(app.session_interface, ServerSideSessionInterface):
+            # Os cabeçalhos já foram enviados, mas a sessão no servidor pode ser gravada diretamente.
+            app.session_interface.persist(session_data)
+        else:
+            # O cookie de sessão já foi enviado junto com os cabeçalhos; o cliente devolve
+            # este token assinado em /commit_stream_state para persistir o novo estado.
+            done["session_token"] = app.session_interface.get_signing_serializer(app).dumps(dict(session_data))
+        yield _sse_event("done", done)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Se o cliente desconectar antes de o stream começar, o slot do modelo é liberado aqui.
+    response.call_on_close(slot.release)
+    return response
+
+@app.route('/commit_stream_state', methods=['POST'])
+def commit_stream_state():
+    """Aplica ao cookie de sessão o estado final produzido por /send_message_stream."""
+    token = (request.get_json(silent=True) or {}).get('session_token')
     try:
-        bot_response = json.loads(bot_response)
-    except json.JSONDecodeError:
-        match = re.search(r'\{.*\}', bot_response, re.DOTALL)
-        if match:
-            clean_json_str = match.group(0)
-            bot_response = json.loads(clean_json_str)
-    if not isinstance(bot_response, dict):
-        bot_response_text = bot_response
-    else:
-        bot_response_text = bot_response["resposta"] if isinstance(bot_response, dict) else bot_response
-        session_data["chat_state"] = bot_response["chat_state"] if isinstance(bot_response, dict) else session_data["chat_state"]
-        session_data["customer_data"]["product_selected_for_cart"] = bot_response.get("product_selected_for_cart", None)
-        session_data["customer_data"]["cart"] = bot_response.get("cart", [])
-        session_data["last_input_invalid"] = bot_response.get("last_input_invalid", False)
-        session_data["total_value"] = bot_response.get("total_value", 0.0)
-    session_data["chat_history_for_llm"].append({"role": "model", "parts": [{"text": bot_response_text}]})
-
-    if isinstance(bot_response_text, str) and re.search(r'https?://', bot_response_text):
-        session_data["chat_state"] = "proposta_final"
-    
-    logging.info(session_data)
-    save_session_to_firestore(db, session_data)
-    return jsonify({"bot_response": bot_response_text, "chat_state": session_data["chat_state"]})
+        new_state = app.session_interface.get_signing_serializer(app).loads(token, max_age=300)
+    except Exception:
+        return jsonify({"error": "Token de sessão inválido"}), 400
+    if new_state.get("session_uuid") != session_data.get("session_uuid"):
+        return jsonify({"error": "Token pertence a outra sessão"}), 409
+    session_data.clear()
+    session_data.update(new_state)
+    return jsonify({"chat_state": session_data["chat_state"]})
+
+def busy_response(rejection, state_before):
+    """Resposta rápida para um turno não admitido (429 se a sessão excedeu o limite, 503 se o modelo está saturado)."""
+    discard_user_turn(session_data, state_before)
+    message, status = busy_reply(rejection)
+    return (jsonify({"bot_response": message, "chat_state": session_data["chat_state"], "retry_after": rejection.retry_after}),
+            status, {"Retry-After": str(rejection.retry_after)})
+
+def _sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
 if __name__ == '__main__':
-    if not db: logging.error("ERRO CRÍTICO: Firestore não inicializado.")
-    else:
-        with app.app_context(): 
-            seed_initial_products(db)
-    
     logging.basicConfig(level=logging.DEBUG)
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    warm_up_app()
+    app.run(debug=True, port=5001)
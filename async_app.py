@@ -0,0 +1,190 @@
+"""Variante assíncrona (ASGI) do fluxo de chat, para servir muitas conversas simultâneas por processo.
+
+Executar com: hypercorn async_app:app --bind 0.0.0.0:5001
+O dashboard continua sendo servido pelo app Flask (app.py). Como no app Flask, a sessão fica no
+backend de SESSION_BACKEND (o cookie só leva o `session_uuid`) e os turnos que vão ao LLM passam
+pelo controle de admissão; o hedging de requisições existe só no app Flask.
+"""
+import asyncio
+import os
+import time
+import logging
+from quart import Quart, Response, request, jsonify, render_template, session as session_data
+from quart.sessions import SessionInterface
+from firebase_admin import firestore_async
+from utils.constants import AB_TEST_ENABLED, LOG_LEVEL
+from utils.firebase import async_save_session_to_firestore
+from utils.llm import get_base_system_prompt, build_llm_prompt_context_instruction
+from utils.llm_async import async_call_gemini_api, async_call_openrouter_api, close_async_http_client
+from utils.chat import start_new_session, restart_lost_session, validate_customer_input, build_gemini_history, apply_llm_response, discard_user_turn
+from utils.context import prepare_llm_context
+from utils.catalog import get_catalog, catalog_cached
+from utils import response_cache
+from utils.cart import get_product_index, reprice_cart
+from utils.checkout import answer_locally
+from utils.tracing import span, trace_turn, log_turn
+from utils.metrics import render_prometheus
+from utils.lifecycle import get_firestore_client
+from utils.session_store import create_session_store, ServerSideSessionInterface
+from utils.admission import AdmissionRejected, async_admit, busy_reply, turn_model
+
+if LOG_LEVEL:
+    logging.basicConfig(level=LOG_LEVEL)
+
+app = Quart(__name__)
+app.secret_key = os.getenv("FLASK_SECRET_KEY", "dapojNDOUIANIKDAHIODHAKMsdnawuiohqSJ213141SAMjmopdja")
+
+
+class AsyncServerSideSessionInterface(SessionInterface):
+    """ServerSideSessionInterface para o Quart: a mesma sessão no servidor, com o backend
+    (SQLite/Redis, bloqueantes) acessado no executor padrão, fora do event loop."""
+
+    def __init__(self, store):
+        self.server_side = ServerSideSessionInterface(store)
+
+    async def open_session(self, app, request):
+        return await asyncio.get_running_loop().run_in_executor(None, self.server_side.open_session, app, request)
+
+    async def save_session(self, app, session, response):
+        await asyncio.get_running_loop().run_in_executor(None, self.server_side.save_session, app, session, response)
+
+
+session_store = create_session_store()
+if session_store is not None:
+    app.session_interface = AsyncServerSideSessionInterface(session_store)
+
+# Clientes do Firestore do worker, criados em `start_up` (nunca no import, que pode acontecer antes
+# do fork dos workers do hypercorn). O síncrono só alimenta o cache do catálogo; as escritas do
+# chat usam o assíncrono.
+db = None
+async_db = None
+
+
+def connect_firestore():
+    """Clientes síncrono e assíncrono do Firestore deste processo; (None, None) se a inicialização falhar."""
+    client = get_firestore_client()
+    if client is None:
+        return None, None
+    try:
+        return client, firestore_async.client()
+    except Exception as e:
+        logging.error(f"ERRO CRÍTICO: Falha ao criar o cliente assíncrono do Firestore: {e}")
+        return None, None
+
+
+async def load_product_index(db):
+    """Índice de produtos sem bloquear o event loop: a leitura síncrona do catálogo, quando o cache
+    ainda não o tem, roda no executor padrão."""
+    if catalog_cached(db):
+        return get_product_index(db)
+    return await asyncio.get_running_loop().run_in_executor(None, get_product_index, db)
+
+
+@app.before_serving
+async def start_up():
+    global db, async_db
+    loop = asyncio.get_running_loop()
+    if async_db is None:
+        db, async_db = await loop.run_in_executor(None, connect_firestore)
+    if db:
+        await load_product_index(db)
+        await loop.run_in_executor(None, get_base_system_prompt, db)
+
+@app.after_serving
+async def shutdown():
+    await close_async_http_client()
+
+@app.route('/')
+async def index():
+    return await render_template('index.html', streaming_enabled=False)
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    """Contadores, gauges e histogramas deste worker no formato de texto do Prometheus (rótulo `worker` = PID)."""
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/initialize_chat', methods=['POST'])
+@trace_turn("initialize_chat")
+async def initialize_chat():
+    if not async_db:
+        return jsonify({"bot_response": "ERRO: Banco de dados indisponível.", "chat_state": "ERROR"}), 500
+
+    if session_data.get("session_uuid") and not session_data.get("session_saved"):
+        logging.info(f"Salvando sessão anterior abandonada: {session_data['session_uuid']}")
+        await async_save_session_to_firestore(async_db, dict(session_data))
+
+    initial_greeting = start_new_session(session_data)
+    return jsonify({"bot_response": initial_greeting, "chat_state": session_data["chat_state"]})
+
+@app.route('/send_message', methods=['POST'])
+@trace_turn("send_message")
+async def send_message():
+    if not async_db:
+        return jsonify({"bot_response": "ERRO: Banco de dados indisponível.", "chat_state": "ERROR"}), 500
+
+    data = await request.get_json()
+    user_input = data.get('user_input', '').strip()
+    restarted = restart_lost_session(session_data)
+    if restarted:
+        return jsonify({"bot_response": restarted, "chat_state": session_data["chat_state"]}), 409
+    session_data["last_input_invalid"] = False
+
+    if not user_input:
+        return jsonify({"bot_response": "Por favor, diga algo.", "chat_state": session_data["chat_state"]}), 400
+
+    if session_data["chat_state"] == 'FINALIZED':
+        return jsonify({"bot_response": "Obrigado! Para uma nova compra, por favor, reinicie a conversa.", "chat_state": session_data["chat_state"]})
+
+    state_before = validate_customer_input(session_data, user_input)
+    with span("catalog"):
+        product_index = await load_product_index(db)
+    with span("local_reply"):
+        local_reply = answer_locally(session_data, user_input, state_before, product_index)
+    if local_reply is not None:
+        with span("save"):
+            await async_save_session_to_firestore(async_db, session_data)
+        log_turn(session_data)
+        return jsonify({"bot_response": local_reply, "chat_state": session_data["chat_state"]})
+
+    # O catálogo já foi carregado em load_product_index: daqui em diante vem do cache em memória.
+    # Um acerto no cache não chama o LLM: não passa pela admissão nem consome ficha ou slot.
+    cache_key, bot_response = response_cache.lookup(session_data, user_input, get_catalog(db)["version"])
+    if bot_response is None:
+        try:
+            with span("admission"):
+                slot = await async_admit(session_data["session_uuid"], turn_model(session_data, AB_TEST_ENABLED))
+        except AdmissionRejected as e:
+            return busy_response(e, state_before)
+
+        with slot:
+            with span("prompt"):
+                system_prompt = get_base_system_prompt(db)
+                context_instruction = build_llm_prompt_context_instruction(session_data)
+                llm_context = prepare_llm_context(session_data, system_prompt, context_instruction)
+
+            with span("llm", ab_test=AB_TEST_ENABLED):
+                start = time.perf_counter()
+                if AB_TEST_ENABLED:
+                    bot_response = await async_call_openrouter_api(system_prompt + "\n\n" + llm_context["context_instruction"], llm_context["history"], session_data)
+                else:
+                    bot_response = await async_call_gemini_api(build_gemini_history(system_prompt, llm_context["context_instruction"], llm_context["history"]))
+                response_cache.store(cache_key, bot_response, time.perf_counter() - start)
+    with span("parse"):
+        bot_response_text = apply_llm_response(session_data, bot_response)
+        reprice_cart(session_data, product_index)
+
+    with span("save"):
+        await async_save_session_to_firestore(async_db, session_data)
+    log_turn(session_data)
+    return jsonify({"bot_response": bot_response_text, "chat_state": session_data["chat_state"]})
+
+def busy_response(rejection, state_before):
+    """Resposta rápida para um turno não admitido, como em app.py."""
+    discard_user_turn(session_data, state_before)
+    message, status = busy_reply(rejection)
+    return (jsonify({"bot_response": message, "chat_state": session_data["chat_state"], "retry_after": rejection.retry_after}),
+            status, {"Retry-After": str(rejection.retry_after)})
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    app.run(debug=True, port=5001)
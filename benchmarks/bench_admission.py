@@ -0,0 +1,169 @@
+"""Rajada de usuários contra um provedor com cota, com e sem controle de admissão (utils/admission.py).
+
+O LLM local (FakeLLMServer) imita o plano gratuito do OpenRouter: acima de
+`--quota` requisições simultâneas por modelo, responde 429. Muitos usuários começam
+a conversar ao mesmo tempo (teste A/B ligado, sem failover para o Gemini) e uma
+sessão "apressada" dispara mensagens sem parar, de várias abas.
+
+Sem admissão, os 429 viram retentativas, o circuito do provedor abre e os usuários
+recebem a mensagem de erro. Com admissão (slots por modelo iguais à cota, fila justa
+entre sessões com prazo e token bucket por sessão), o provedor não devolve 429, os
+turnos que não cabem no prazo recebem rapidamente a resposta de "ocupado" e a
+sessão apressada é limitada sem atrasar as demais.
+
+Uso: python -m benchmarks.bench_admission --users 80 --quota 4
+"""
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import app as flask_app_module
+import utils.admission as admission
+import utils.chat as chat
+import utils.firebase as firebase
+import utils.llm as llm
+import utils.transport as transport
+from utils import metrics
+from testing.fakes import FakeFirestore, FakeLLMServer, lognormal_latency
+from utils.firebase import seed_initial_products
+from utils.write_behind import flush_session_writes
+
+TURNS = ["oi, estou procurando um presente", "tem garantia estendida?", "e o parcelamento, como funciona?"]
+ERROR_PREFIXES = ("Ops!", "Desculpe", "ERRO")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else 0.0
+
+
+def classify(response):
+    if response.status_code == 429:
+        return "limitado"
+    if response.status_code == 503:
+        return "ocupado"
+    text = response.get_json().get("bot_response") or ""
+    return "erro" if text.startswith(ERROR_PREFIXES) else "ok"
+
+
+def run(users, spam_tabs, spam_messages, think, seed):
+    results = {"usuários": [], "apressada": []}
+    lock = threading.Lock()
+    rng = random.Random(seed)
+    thinks = [[rng.uniform(0, think) for _ in TURNS] for _ in range(users)]
+    cookie_name = flask_app_module.app.config["SESSION_COOKIE_NAME"]
+
+    def record(kind, response, seconds):
+        with lock:
+            results[kind].append((classify(response), seconds))
+
+    def conversation(index):
+        client = flask_app_module.app.test_client()
+        client.post("/initialize_chat")
+        for user_input, pause in zip(TURNS, thinks[index]):
+            time.sleep(pause)
+            start = time.perf_counter()
+            response = client.post("/send_message", json={"user_input": user_input})
+            record("usuários", response, time.perf_counter() - start)
+
+    spammer = flask_app_module.app.test_client()
+    spammer.post("/initialize_chat")
+    session_cookie = spammer.get_cookie(cookie_name).value
+
+    def spam_tab(_):
+        # Cada aba reaproveita o cookie da mesma sessão.
+        client = flask_app_module.app.test_client()
+        client.set_cookie(cookie_name, session_cookie)
+        for _ in range(spam_messages):
+            start = time.perf_counter()
+            response = client.post("/send_message", json={"user_input": "oi?? tem alguém aí?"})
+            record("apressada", response, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=users + spam_tabs) as pool:
+        futures = [pool.submit(conversation, i) for i in range(users)] + [pool.submit(spam_tab, i) for i in range(spam_tabs)]
+        for future in futures:
+            future.result()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=80, help="conversas que começam juntas")
+    parser.add_argument("--quota", type=int, default=4, help="requisições simultâneas por modelo aceitas pelo provedor")
+    parser.add_argument("--spam-tabs", type=int, default=3)
+    parser.add_argument("--spam-messages", type=int, default=15)
+    parser.add_argument("--think", type=float, default=0.5, help="pausa máxima (s) antes de cada mensagem")
+    parser.add_argument("--queue-timeout", type=float, default=5.0, help="prazo (s) de espera por um slot")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    # Sem admissão os erros do provedor são esperados (e muitos): nada de log durante a rodada.
+    logging.disable(logging.CRITICAL)
+
+    random.seed(args.seed)
+    for module in (flask_app_module, llm, chat, firebase):
+        module.AB_TEST_ENABLED = True
+    admission.LLM_MAX_CONCURRENCY_PER_MODEL = args.quota
+    admission.ADMISSION_QUEUE_TIMEOUT_SECONDS = args.queue_timeout
+    summary = {}
+    with FakeLLMServer(latency=lognormal_latency(0.4, 1.2, random.Random(args.seed)), max_concurrent_per_model=args.quota) as server:
+        llm.OPENROUTER_API_KEY = "fake"
+        llm.OPENROUTER_API_URL = server.openrouter_url
+        llm.GEMINI_API_KEY = None
+        for label, enabled in (("sem admissão", False), ("com admissão", True)):
+            admission.ADMISSION_CONTROL_ENABLED = enabled
+            admission.reset_admission()
+            transport._breakers.clear()
+            metrics.reset_metrics()
+            db = FakeFirestore()
+            seed_initial_products(db)
+            flask_app_module.db = db
+            quota_before, served_before = server.quota_rejections, server.requests_served
+            start = time.perf_counter()
+            results = run(args.users, args.spam_tabs, args.spam_messages, args.think, args.seed)
+            elapsed = time.perf_counter() - start
+            flush_session_writes()
+            summary[label] = (results, server.quota_rejections - quota_before, server.requests_served - served_before, elapsed)
+
+    print(f"{args.users} conversas x {len(TURNS)} turnos + sessão apressada ({args.spam_tabs} abas x {args.spam_messages} mensagens); "
+          f"cota do provedor: {args.quota} simultâneas por modelo\n")
+    print(f"{'modo':<14}{'quem':<11}{'ok':>6}{'erro':>6}{'ocupado':>9}{'limitado':>10}{'p50 ok (ms)':>13}{'p95 ok (ms)':>13}{'máx rejeição (ms)':>19}")
+    for label, (results, _, _, _) in summary.items():
+        for kind, turns in results.items():
+            counts = Counter(outcome for outcome, _ in turns)
+            ok = [seconds for outcome, seconds in turns if outcome == "ok"]
+            rejected = [seconds for outcome, seconds in turns if outcome in ("ocupado", "limitado")]
+            print(f"{label:<14}{kind:<11}{counts['ok']:>6}{counts['erro']:>6}{counts['ocupado']:>9}{counts['limitado']:>10}"
+                  f"{percentile(ok, 50) * 1000:>13.0f}{percentile(ok, 95) * 1000:>13.0f}{max(rejected, default=0) * 1000:>19.0f}")
+    print()
+    for label, (_, quota_rejections, served, elapsed) in summary.items():
+        print(f"{label:<14}429 do provedor: {quota_rejections:>4}   requisições ao LLM: {served:>4}   duração: {elapsed:.1f}s")
+
+    results, quota_rejections, _, _ = summary["com admissão"]
+    users = Counter(outcome for outcome, _ in results["usuários"])
+    spam = Counter(outcome for outcome, _ in results["apressada"])
+    rejected = [seconds for outcome, seconds in results["usuários"] + results["apressada"] if outcome in ("ocupado", "limitado")]
+    baseline_ok = Counter(outcome for outcome, _ in summary["sem admissão"][0]["usuários"])["ok"]
+    problems = []
+    if quota_rejections:
+        problems.append(f"o provedor devolveu {quota_rejections} respostas 429 com admissão ligada")
+    if users["erro"]:
+        problems.append(f"{users['erro']} turnos de usuários receberam a mensagem de erro com admissão ligada")
+    if users["ok"] <= baseline_ok:
+        problems.append(f"admissão não aumentou os turnos atendidos ({users['ok']} vs {baseline_ok})")
+    if not spam["limitado"]:
+        problems.append("a sessão apressada não foi limitada")
+    if rejected and max(rejected) > args.queue_timeout + 1:
+        problems.append(f"rejeição demorou {max(rejected):.1f}s (prazo {args.queue_timeout}s)")
+    if problems:
+        print("FALHA:\n" + "\n".join(f"  {problem}" for problem in problems))
+        sys.exit(1)
+    print("\nOK: sem 429 do provedor nem mensagens de erro; rejeições rápidas e sessão apressada limitada.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Compara conversas simultâneas por worker: app Flask síncrono vs. async_app (Quart + httpx).
+
+Ambos rodam contra um LLM local (FakeLLMServer) com latência fixa e um Firestore em
+memória. O app síncrono é servido por um único worker sem threads, como um worker
+`sync` do gunicorn; o assíncrono roda num único event loop. O controle de admissão fica
+com a configuração padrão (LLM_MAX_CONCURRENCY_PER_MODEL e ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL),
+e a coluna "shed" conta os turnos recusados com 429/503.
+
+Uso: python -m benchmarks.bench_async_concurrency --sessions 100 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+import app as flask_app_module
+import async_app as async_app_module
+import utils.admission as admission
+import utils.llm as llm
+import utils.llm_async as llm_async
+from testing.fakes import FakeAsyncFirestore, FakeFirestore, FakeLLMServer
+from utils.firebase import seed_initial_products
+
+
+def _point_to_fakes(server, db):
+    for module in (llm, llm_async):
+        module.GEMINI_API_KEY = "fake"
+        module.GEMINI_API_URL = server.gemini_url
+    flask_app_module.db = db
+    async_app_module.db = db
+    async_app_module.async_db = FakeAsyncFirestore(db)
+
+
+def run_sync(server, sessions):
+    httpd = make_server("127.0.0.1", 0, flask_app_module.app, threaded=False)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_port}"
+
+    def conversation(_):
+        with requests.Session() as client:
+            client.post(f"{base_url}/initialize_chat", timeout=600)
+            response = client.post(f"{base_url}/send_message", json={"user_input": "quais celulares vocês têm?"}, timeout=600)
+            return response.status_code
+
+    server.max_in_flight = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        statuses = list(pool.map(conversation, range(sessions)))
+    elapsed = time.perf_counter() - start
+    httpd.shutdown()
+    return elapsed, server.max_in_flight, statuses.count(200), sum(status in (429, 503) for status in statuses)
+
+
+async def _run_async(server, sessions):
+    app = async_app_module.app
+    await app.startup()
+
+    async def conversation():
+        client = app.test_client()
+        await client.post("/initialize_chat")
+        response = await client.post("/send_message", json={"user_input": "quais celulares vocês têm?"})
+        return response.status_code
+
+    server.max_in_flight = 0
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(conversation() for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    await app.shutdown()
+    return elapsed, server.max_in_flight, statuses.count(200), sum(status in (429, 503) for status in statuses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    db = FakeFirestore()
+    seed_initial_products(db)
+    with FakeLLMServer(latency=args.llm_latency) as server:
+        _point_to_fakes(server, db)
+        admission.reset_admission()
+        results = {
+            "flask (1 worker sync)": run_sync(server, args.sessions),
+            "async_app (1 event loop)": asyncio.run(_run_async(server, args.sessions)),
+        }
+
+    print(f"{args.sessions} conversas, latência do LLM {args.llm_latency}s")
+    print(f"{'servidor':<26}{'tempo (s)':>10}{'turnos/s':>10}{'LLM simult.':>13}{'ok':>6}{'shed':>6}")
+    for name, (elapsed, max_in_flight, ok, shed) in results.items():
+        print(f"{name:<26}{elapsed:>10.2f}{args.sessions / elapsed:>10.1f}{max_in_flight:>13}{ok:>6}{shed:>6}")
+
+
+if __name__ == "__main__":
+    main()
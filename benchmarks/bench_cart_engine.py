@@ -0,0 +1,159 @@
+"""Chamadas ao LLM por compra concluída: fluxo só com LLM, com o carrinho no servidor
+(utils/cart.py) e com o carrinho mais a coleta de dados por templates (utils/checkout.py).
+
+Reproduz conversas roteirizadas no app Flask com um LLM substituto que devolve, para
+cada turno, a resposta que o modelo daria (inclusive um total somado errado). Com
+CART_ENGINE_ENABLED, os turnos de carrinho ("sim", "adicionar X", "remover X", "qual o
+total", "finalizar") são resolvidos localmente; com CHECKOUT_FAST_PATH_ENABLED, também
+nome/email/telefone (válidos ou não) e a proposta final. Compara-se o número de
+chamadas ao LLM por compra concluída e se o total final bate com os preços do catálogo.
+
+Uso: python -m benchmarks.bench_cart_engine --repeat 20
+"""
+import argparse
+import json
+import logging
+import sys
+
+import app as flask_app_module
+import utils.admission as admission
+import utils.cart as cart
+import utils.checkout as checkout
+from testing.fakes import FakeFirestore
+from utils.firebase import seed_initial_products
+
+PHONE = {"nome": "NovoPhone X12", "preço": "3.499,00"}
+LAPTOP = {"nome": "UltraBook Pro 15", "preço": "7.999,00"}
+BUDS = {"nome": "SoundBuds Plus", "preço": "399,00"}
+WATCH = {"nome": "TimeWatch S2", "preço": "1.299,00"}
+TABLET = {"nome": "TabMaster 10", "preço": "2.499,00"}
+
+
+def _reply(state, text, cart_items=(), total="0,00", selected=None):
+    return {"chat_state": state, "resposta": text, "product_selected_for_cart": selected,
+            "cart": list(cart_items), "total_value": total, "last_input_invalid": False}
+
+
+def _checkout_turns(items, total, invalid_email=False):
+    turns = [("Maria Silva", _reply("AWAITING_EMAIL", "Obrigada, Maria! Qual é o seu email?", items, total))]
+    if invalid_email:
+        turns.append(("maria arroba example", _reply("AWAITING_EMAIL", "Esse email parece inválido. Pode verificar?", items, total)))
+    return turns + [
+        ("maria.silva@example.com", _reply("AWAITING_PHONE", "Perfeito. Agora seu telefone com DDD, por favor.", items, total)),
+        ("(11) 98765-4321", _reply("PROPOSAL_READY", f"Proposta pronta! Total R$ {total}. Finalize em https://marketplace-39A.com.br/p-123", items, total)),
+    ]
+
+
+SCRIPTS = {
+    "celular direto": [
+        ("quais celulares vocês têm?", _reply("confirma_carrinho", "Temos o NovoPhone X12 por R$ 3.499,00. Gostaria de adicioná-lo ao carrinho?", selected=PHONE)),
+        ("sim", _reply("ajuda_na_escolha", "Adicionado! Gostaria de adicionar mais itens ou finalizar a compra?", [PHONE], "3.499,00")),
+        ("finalizar a compra", _reply("AWAITING_NAME", "Ótimo! Qual é o seu nome completo?", [PHONE], "3.499,00")),
+    ] + _checkout_turns([PHONE], "3.499,00"),
+    "notebook + fone, total errado": [
+        ("quero um notebook para trabalhar", _reply("confirma_carrinho", "O UltraBook Pro 15 custa R$ 7.999,00. Quer adicioná-lo?", selected=LAPTOP)),
+        ("pode adicionar", _reply("ajuda_na_escolha", "Adicionado! Mais alguma coisa?", [LAPTOP], "7.999,00")),
+        ("adiciona também o fone SoundBuds", _reply("ajuda_na_escolha", "Fone adicionado! Total R$ 8.389,00.", [LAPTOP, BUDS], "8.389,00")),
+        ("qual o total?", _reply("ajuda_na_escolha", "Seu total é R$ 8.389,00.", [LAPTOP, BUDS], "8.389,00")),
+        ("finalizar", _reply("AWAITING_NAME", "Vamos lá! Qual é o seu nome completo?", [LAPTOP, BUDS], "8.389,00")),
+    ] + _checkout_turns([LAPTOP, BUDS], "8.389,00", invalid_email=True),
+    "troca de item e pedido ambíguo": [
+        ("adicionar o TimeWatch S2 e o TabMaster 10", _reply("ajuda_na_escolha", "Adicionei os dois! Total R$ 3.798,00.", [WATCH, TABLET], "3.798,00")),
+        ("na verdade remover o TabMaster", _reply("ajuda_na_escolha", "Removido. Total R$ 1.299,00.", [WATCH], "1.299,00")),
+        ("tem garantia estendida?", _reply("ajuda_na_escolha", "Sim! Temos garantia estendida opcional.", [WATCH], "1.299,00")),
+        ("quero fechar o pedido", _reply("AWAITING_NAME", "Claro! Qual é o seu nome completo?", [WATCH], "1.299,00")),
+    ] + _checkout_turns([WATCH], "1.299,00"),
+}
+# Perguntas sobre produtos que mencionam verbos de carrinho: nenhuma pode alterar o carrinho nem finalizar a compra.
+NOT_CART_INTENTS = [
+    "o NovoPhone X12 inclui carregador?",
+    "tira uma dúvida: o novophone é bom?",
+    "bota fé que o tablet é bom?",
+    "o GameBox vem com controle? se vier vou levar",
+    "posso pagar em 12x?",
+    "Posso pagar no boleto?",
+    "dá pra colocar película no NovoPhone?",
+    "se o TabMaster vier com capa eu vou levar",
+]
+EXPECTED_TOTALS = {"celular direto": 3499.0, "notebook + fone, total errado": 8398.0, "troca de item e pedido ambíguo": 1299.0}
+
+
+class ScriptedLLM:
+    """Substitui call_gemini_api: devolve a resposta roteirizada do turno atual e conta as chamadas."""
+
+    def __init__(self):
+        self.reply = None
+        self.calls = 0
+
+    def __call__(self, prompt_history):
+        self.calls += 1
+        return json.dumps(self.reply, ensure_ascii=False)
+
+
+def run(client, llm, engine_enabled, fast_path_enabled, repeat):
+    cart.CART_ENGINE_ENABLED = engine_enabled
+    checkout.CHECKOUT_FAST_PATH_ENABLED = fast_path_enabled
+    results = {}
+    for name, script in SCRIPTS.items():
+        calls_before, completed, wrong_totals = llm.calls, 0, 0
+        for _ in range(repeat):
+            client.post("/initialize_chat")
+            for user_input, reply in script:
+                llm.reply = reply
+                state = client.post("/send_message", json={"user_input": user_input}).get_json()["chat_state"]
+            with client.session_transaction() as session:
+                total = session["total_value"]
+            completed += state == "proposta_final"
+            wrong_totals += abs(float(total) - EXPECTED_TOTALS[name]) > 0.001
+        results[name] = ((llm.calls - calls_before) / repeat, completed, wrong_totals)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    db = FakeFirestore()
+    seed_initial_products(db)
+    llm = ScriptedLLM()
+    flask_app_module.db = db
+    flask_app_module.call_gemini_api = llm
+    flask_app_module.AB_TEST_ENABLED = False
+    # Os roteiros mandam vários turnos seguidos na mesma sessão, sem pausa: o limite por sessão barraria parte deles.
+    admission.ADMISSION_CONTROL_ENABLED = False
+    client = flask_app_module.app.test_client()
+
+    configs = {
+        "só LLM": run(client, llm, False, False, args.repeat),
+        "carrinho": run(client, llm, True, False, args.repeat),
+        "carrinho + coleta": run(client, llm, True, True, args.repeat),
+    }
+
+    print(f"{'conversa':<34}{'turnos':>7}" + "".join(f"{label:>20}" for label in configs) + f"{'totais errados':>18}")
+    for name, script in SCRIPTS.items():
+        calls = "".join(f"{results[name][0]:>12.1f} LLM {results[name][1]:>2}✓" for results in configs.values())
+        wrong = "/".join(str(results[name][2]) for results in configs.values())
+        print(f"{name:<34}{len(script):>7}{calls}{wrong:>18}")
+    print()
+    for label, results in configs.items():
+        completed = sum(r[1] for r in results.values())
+        calls = sum(r[0] * args.repeat for r in results.values())
+        print(f"{label:<20} chamadas ao LLM por compra concluída: {calls / completed:.2f}")
+
+    index = cart.get_product_index(db)
+    session_data = {"chat_state": "ajuda_na_escolha", "customer_data": {"cart": [cart.cart_item(index.by_id["p1"])], "product_selected_for_cart": None}}
+    false_positives = [(text, match[0]) for text in NOT_CART_INTENTS if (match := cart.match_cart_intent(session_data, text, index))]
+    print(f"\nPerguntas com verbos de carrinho resolvidas localmente por engano: {len(false_positives)} de {len(NOT_CART_INTENTS)}")
+    problems = [f"{text!r} tratada como {intent}" for text, intent in false_positives]
+    problems += [f"{label}: total final errado em {sum(r[2] for r in results.values())} conversas"
+                 for label, results in configs.items() if label != "só LLM" and any(r[2] for r in results.values())]
+    if problems:
+        print("FALHA:\n" + "\n".join(f"  {problem}" for problem in problems))
+        sys.exit(1)
+    print("OK: carrinho e coleta locais só para pedidos diretos, com totais do catálogo.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Tempo de boot e primeiro turno de um worker frio vs. aquecido (utils/lifecycle.py).
+
+1. Import: mede `import app` num processo novo (o Firebase não é mais inicializado no
+   import) e, à parte, quanto custa a inicialização do Firebase que saiu do import.
+2. Primeiros turnos: com o Firestore em memória (latência de leitura) e um LLM local
+   que cobra um custo por conexão nova (handshake TLS simulado), compara os primeiros
+   turnos de usuários simultâneos num worker frio (catálogo, prompt e conexões feitos
+   dentro do turno) e num worker aquecido por `warm_up_app()`.
+3. gunicorn (se instalado): sobe `gunicorn -c gunicorn.conf.py app:app` com e sem
+   preload_app e mede o tempo até /healthz responder em todos os workers e o /readyz.
+   Sem credenciais do Firebase, o /readyz deve responder 503.
+
+Uso: python -m benchmarks.bench_cold_start --users 4 --connect-latency 0.15
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+from urllib.error import HTTPError, URLError
+
+import app as flask_app_module
+import utils.admission as admission
+import utils.cart as cart
+import utils.catalog as catalog
+import utils.lifecycle as lifecycle
+import utils.llm as llm
+import utils.transport as transport
+import utils.write_behind as write_behind
+from testing.fakes import FakeFirestore, FakeLLMServer
+from utils.firebase import seed_initial_products
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_MESSAGE = "oi, quais celulares vocês têm?"
+
+
+def timed_subprocess(code, runs, env=None):
+    """Mediana (s) do tempo impresso por `code` em processos Python novos."""
+    values = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+        values.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(values)
+
+
+def reset_process_state():
+    """Volta o processo ao estado de um worker recém-criado (caches, sessão HTTP, fila de gravação e aquecimento)."""
+    # Grava as sessões da fase anterior aqui, fora da medição, e não no primeiro turno da próxima fase.
+    write_behind.flush_session_writes()
+    write_behind._queue = None
+    catalog.invalidate_catalog_cache()
+    llm._system_prompt_cache = {"version": None, "prompt": None}
+    cart._index_cache = {"version": None, "index": None}
+    if transport._session is not None:
+        transport._session.close()
+    transport._session = None
+    lifecycle._state.update({"phase": "cold", "pid": None, "steps": {}, "error": None, "ready_seconds": None})
+    flask_app_module.app.jinja_env.cache.clear()
+
+
+def first_turns(users):
+    def conversation(_):
+        client = flask_app_module.app.test_client()
+        client.post("/initialize_chat")
+        start = time.perf_counter()
+        client.post("/send_message", json={"user_input": FIRST_MESSAGE})
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        return list(pool.map(conversation, range(users)))
+
+
+def run_first_turns(server, users, read_latency, warm):
+    reset_process_state()
+    db = FakeFirestore(read_latency=read_latency)
+    seed_initial_products(db)
+    flask_app_module.db = db
+    warm_up = None
+    if warm:
+        start = time.perf_counter()
+        flask_app_module.warm_up_app()
+        warm_up = time.perf_counter() - start
+    connections_before = server.connections_opened
+    latencies = first_turns(users)
+    return latencies, server.connections_opened - connections_before, warm_up
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url):
+    try:
+        with urlopen(url, timeout=2) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def gunicorn_boot(preload, workers, timeout=60):
+    """Sobe o gunicorn e mede o tempo até cada worker responder /healthz; devolve (s, pids, /readyz)."""
+    port = _free_port()
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_PRELOAD=str(preload).lower(),
+               GOOGLE_APPLICATION_CREDENTIALS="/nonexistent/firebase-credentials.json")
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "app:app"],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start, pids, elapsed = time.perf_counter(), set(), None
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                status, body = _get(f"http://127.0.0.1:{port}/healthz")
+                pids.add(body["pid"])
+                if len(pids) >= workers:
+                    elapsed = time.perf_counter() - start
+                    break
+            except (URLError, ConnectionError, socket.timeout):
+                time.sleep(0.02)
+        ready = _get(f"http://127.0.0.1:{port}/readyz") if elapsed is not None else (None, {})
+        return elapsed, pids, ready
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=4, help="usuários simultâneos chegando ao worker novo")
+    parser.add_argument("--connect-latency", type=float, default=0.15, help="custo (s) de cada conexão nova ao LLM")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--read-latency", type=float, default=0.05, help="latência (s) de cada leitura do Firestore")
+    parser.add_argument("--import-runs", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4, help="workers do gunicorn")
+    parser.add_argument("--skip-gunicorn", action="store_true")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    problems = []
+
+    timer = "import time; t = time.perf_counter(); {}; print(time.perf_counter() - t)"
+    import_seconds = timed_subprocess(timer.format("import app"), args.import_runs)
+    firebase_seconds = timed_subprocess("import utils.lifecycle as l; " + timer.format("l.get_firestore_client()"), args.import_runs)
+    print(f"import app: {import_seconds * 1000:.0f} ms (mediana de {args.import_runs})")
+    print(f"inicialização do Firebase (antes no import, agora no aquecimento de cada worker): {firebase_seconds * 1000:.0f} ms\n")
+
+    for module in (flask_app_module, llm):
+        module.AB_TEST_ENABLED = False
+    lifecycle.WARMUP_LLM_CONNECTIONS = args.users
+    # Um slot do modelo por usuário: aqui só o custo do worker frio importa, não a fila de admissão.
+    admission.LLM_MAX_CONCURRENCY_PER_MODEL = args.users
+    admission.reset_admission()
+    results = {}
+    with FakeLLMServer(latency=args.llm_latency, connect_latency=args.connect_latency) as server:
+        llm.GEMINI_API_KEY = "fake"
+        llm.GEMINI_API_URL = server.gemini_url
+        llm.OPENROUTER_API_KEY = None
+        for label, warm in (("frio", False), ("aquecido", True)):
+            results[label] = run_first_turns(server, args.users, args.read_latency, warm)
+
+    print(f"{args.users} usuários no primeiro turno de um worker novo (LLM {args.llm_latency * 1000:.0f} ms + "
+          f"{args.connect_latency * 1000:.0f} ms por conexão nova, leitura do Firestore {args.read_latency * 1000:.0f} ms)\n")
+    print(f"{'worker':<10}{'aquecimento (ms)':>18}{'p50 1º turno (ms)':>19}{'máx 1º turno (ms)':>19}{'conexões novas no turno':>25}")
+    for label, (latencies, connections, warm_up) in results.items():
+        warm_up_text = f"{warm_up * 1000:.0f}" if warm_up is not None else "-"
+        print(f"{label:<10}{warm_up_text:>18}{statistics.median(latencies) * 1000:>19.0f}{max(latencies) * 1000:>19.0f}{connections:>25}")
+    steps = lifecycle.readiness()["steps"]
+    print("\netapas do aquecimento: " + ", ".join(f"{name} {step['seconds'] * 1000:.0f} ms" for name, step in steps.items()))
+
+    cold, warm = results["frio"][0], results["aquecido"][0]
+    if max(warm) >= statistics.median(cold):
+        problems.append(f"primeiro turno aquecido ({max(warm) * 1000:.0f} ms) não é mais rápido que o frio ({statistics.median(cold) * 1000:.0f} ms)")
+    if results["aquecido"][1]:
+        problems.append(f"{results['aquecido'][1]} conexões novas abertas durante os turnos do worker aquecido")
+    if not lifecycle.readiness()["ready"]:
+        problems.append(f"worker aquecido não ficou pronto: {lifecycle.readiness()}")
+
+    if not args.skip_gunicorn:
+        if importlib.util.find_spec("gunicorn") is None:
+            print("\n(gunicorn não instalado: boot não medido)")
+        else:
+            print(f"\ngunicorn com {args.workers} workers (sem credenciais do Firebase)")
+            print(f"{'preload_app':<14}{'todos os workers no /healthz (ms)':>36}{'/readyz':>10}")
+            for preload in (False, True):
+                elapsed, pids, (status, body) = gunicorn_boot(preload, args.workers)
+                if elapsed is None:
+                    problems.append(f"gunicorn (preload={preload}): só {len(pids)} workers responderam /healthz")
+                    print(f"{str(preload):<14}{'-':>36}{'-':>10}")
+                    continue
+                print(f"{str(preload):<14}{elapsed * 1000:>36.0f}{status:>10}")
+                if status != 503 or body.get("error") != "Firestore não inicializado":
+                    problems.append(f"gunicorn (preload={preload}): /readyz sem Firestore respondeu {status} {body}")
+
+    if problems:
+        print("FALHA:\n" + "\n".join(f"  {problem}" for problem in problems))
+        sys.exit(1)
+    print("\nOK: worker aquecido atende o primeiro turno sem carregar catálogo nem abrir conexões.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Tamanho do prompt por turno com e sem a janela de contexto (utils/context.py).
+
+Reproduz conversas sintéticas de 30 turnos (sem chamar o LLM) e compara, a cada
+turno, os tokens estimados e os bytes do payload do Gemini enviados pelo fluxo
+antigo (histórico completo) e pelo fluxo com janela deslizante + resumo. Enquanto o
+histórico cabe no orçamento os dois payloads devem ser idênticos.
+
+Uso: python -m benchmarks.bench_context_window --turns 30 --conversations 20
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+
+import utils.context as context
+from utils.catalog import render_products_string
+from utils.chat import build_gemini_history, start_new_session
+from utils.constants import DEFAULT_PRODUCTS_SEED
+from utils.llm import _gemini_payload, build_llm_prompt_context_instruction, render_system_prompt
+
+USER_TEMPLATES = [
+    "Vocês têm {name}? Quanto custa?",
+    "Quero saber mais sobre o {name}, ele vale a pena para uso diário?",
+    "Pode adicionar o {name} no carrinho, por favor.",
+    "Qual a diferença entre o {name} e o {other}?",
+    "Tem parcelamento para o {name}? E garantia estendida?",
+    "Acho que vou levar também o {other}.",
+]
+BOT_TEMPLATES = [
+    "O {name} custa R$ {price}. É uma ótima escolha para quem busca desempenho e durabilidade, com parcelamento em 12x sem juros. Gostaria de adicioná-lo ao carrinho?",
+    "Claro! O {name} foi adicionado ao carrinho. Seu carrinho agora tem {count} item(ns). Gostaria de adicionar mais itens ou finalizar a compra?",
+    "Comparando o {name} (R$ {price}) com o {other}, o primeiro se destaca pela relação custo-benefício, enquanto o segundo oferece recursos mais avançados. Posso ajudar com mais alguma dúvida?",
+    "Sim! Oferecemos parcelamento em 12x sem juros e garantia estendida opcional para o {name}. Deseja incluir no pedido?",
+]
+
+
+def _model_reply(rng, product, other, count):
+    return json.dumps({
+        "chat_state": "ajuda_na_escolha",
+        "resposta": rng.choice(BOT_TEMPLATES).format(name=product["name"], price=product["price"], other=other["name"], count=count),
+        "cart": [{"nome": product["name"], "preço": product["price"]}] * count,
+        "total_value": product["price"],
+    }, ensure_ascii=False)
+
+
+def replay(turns, seed):
+    """Retorna, por turno, (tokens, bytes) do fluxo completo e do fluxo com janela, se a janela estava ativa e se o histórico cabia no orçamento."""
+    rng = random.Random(seed)
+    system_prompt = render_system_prompt(render_products_string(DEFAULT_PRODUCTS_SEED))
+    session = {}
+    start_new_session(session)
+    rows = []
+    for turn in range(1, turns + 1):
+        product, other = rng.sample(DEFAULT_PRODUCTS_SEED, 2)
+        session["chat_history_for_llm"].append({"role": "user", "parts": [{"text": rng.choice(USER_TEMPLATES).format(name=product["name"], other=other["name"])}]})
+        instruction = build_llm_prompt_context_instruction(session)
+        fits = context.estimate_messages_tokens(session["chat_history_for_llm"]) <= context.CONTEXT_HISTORY_TOKEN_BUDGET
+
+        full_history = build_gemini_history(system_prompt, instruction, session["chat_history_for_llm"])
+        full_tokens = context.estimate_messages_tokens(full_history)
+        full_bytes = len(json.dumps(_gemini_payload(full_history), ensure_ascii=False).encode("utf-8"))
+
+        llm_context = context.prepare_llm_context(session, system_prompt, instruction)
+        window_history = build_gemini_history(system_prompt, llm_context["context_instruction"], llm_context["history"])
+        window_bytes = len(json.dumps(_gemini_payload(window_history), ensure_ascii=False).encode("utf-8"))
+
+        rows.append((full_tokens, full_bytes, llm_context["prompt_tokens"], window_bytes, llm_context["context_instruction"] != instruction, fits))
+        reply = _model_reply(rng, product, other, min(turn, 3))
+        session["chat_history_for_llm"].append({"role": "model", "parts": [{"text": reply}]})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--conversations", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    context.CONTEXT_WINDOW_ENABLED = True
+
+    runs = [replay(args.turns, seed) for seed in range(args.conversations)]
+    print(f"{'turno':>6}{'tokens (completo)':>19}{'tokens (janela)':>17}{'bytes (completo)':>18}{'bytes (janela)':>16}")
+    for turn in sorted({1, 5, 10, 15, 20, 25, args.turns}):
+        if turn > args.turns:
+            continue
+        averages = [sum(run[turn - 1][i] for run in runs) / len(runs) for i in range(4)]
+        print(f"{turn:>6}{averages[0]:>19.0f}{averages[2]:>17.0f}{averages[1]:>18.0f}{averages[3]:>16.0f}")
+
+    full_total = sum(row[0] for run in runs for row in run)
+    window_total = sum(row[2] for run in runs for row in run)
+    first_windowed = [next((turn for turn, row in enumerate(run, 1) if row[4]), None) for run in runs]
+    windowed_from = [turn for turn in first_windowed if turn is not None]
+    print(f"\nJanela ativa a partir do turno {sum(windowed_from) / len(windowed_from):.1f} (média)" if windowed_from else "\nJanela nunca ativada")
+    print(f"Tokens de entrada por conversa: {full_total / len(runs):.0f} (completo) vs {window_total / len(runs):.0f} (janela), "
+          f"economia de {100 * (1 - window_total / full_total):.1f}%")
+
+    problems = []
+    if any(row[1] != row[3] for run in runs for row in run if row[5]):
+        problems.append("payload diferente do completo em turnos com o histórico dentro do orçamento")
+    if window_total >= full_total:
+        problems.append("a janela não reduziu os tokens de entrada")
+    if problems:
+        print("FALHA:\n" + "\n".join(f"  {problem}" for problem in problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
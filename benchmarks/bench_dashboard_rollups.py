@@ -0,0 +1,119 @@
+"""Confere os contadores do dashboard contra a varredura completa e compara o custo das duas leituras.
+
+Gera sessões sintéticas gravadas várias vezes por save_session_to_firestore (como a
+cada turno), com troca de estado, de dia e de modelo, num Firestore em memória.
+Depois verifica que /dashboard_data e /list_models calculados pelos contadores são
+idênticos ao cálculo antigo por varredura (geral e por modelo), inclusive após o
+backfill, e mostra leituras e tempo de cada abordagem. Numa base com sessões
+anteriores aos contadores, confere que a varredura continua em uso até o backfill
+terminar, mesmo depois de novas gravações.
+
+Uso: python -m benchmarks.bench_dashboard_rollups --sessions 5000
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import utils.firebase as firebase
+from utils.dashboard import COUNTED_FIELD, backfill_rollups, dashboard_from_sessions, list_dashboard_models, load_dashboard_data
+from testing.fakes import FakeFirestore
+
+STATES = ["ajuda_na_escolha", "confirma_carrinho", "AWAITING_NAME", "AWAITING_EMAIL", "AWAITING_PHONE", "proposta_final"]
+
+
+class _Clock(datetime):
+    current = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+def generate(db, sessions, seed):
+    rng = random.Random(seed)
+    firebase.datetime = _Clock
+    for _ in range(sessions):
+        _Clock.current = datetime(2025, 6, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        firebase.AB_TEST_ENABLED = rng.random() < 0.7
+        session = {
+            "session_uuid": f"s{rng.getrandbits(64):016x}",
+            "ab_test_group": rng.choice("AB"),
+            "chat_state": STATES[0],
+            "customer_data": {"cart": []},
+            "total_value": 0.0,
+        }
+        for turn in range(rng.randint(1, 8)):
+            session["chat_state"] = STATES[min(turn, len(STATES) - 1)] if rng.random() < 0.8 else rng.choice(STATES)
+            # Algumas conversas atravessam a meia-noite entre um turno e outro.
+            _Clock.current += timedelta(minutes=rng.choice([1, 2, 5, 240]))
+            firebase.save_session_to_firestore(db, session)
+    firebase.datetime = datetime
+    firebase.AB_TEST_ENABLED = False
+
+
+def _timed(db, func, *args):
+    db.reset_counters()
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000, db.reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    db = FakeFirestore()
+    # Instalação nova: o backfill (vazio) roda antes das primeiras sessões.
+    backfill_rollups(db)
+    generate(db, args.sessions, args.seed)
+    sessions = [doc.to_dict() for doc in db.collection('sessions').stream()]
+    models = sorted({s["model_used"] for s in sessions})
+
+    failures = []
+    for model in [None] + models:
+        expected, scan_ms, scan_reads = _timed(db, lambda m: dashboard_from_sessions(
+            d.to_dict() for d in (db.collection('sessions').where('model_used', '==', m) if m else db.collection('sessions')).stream()), model)
+        actual, rollup_ms, rollup_reads = _timed(db, load_dashboard_data, db, model)
+        if actual != expected:
+            failures.append(f"dashboard_data (modelo={model})")
+        print(f"modelo={model or 'todos':<34} varredura: {scan_reads:>6} leituras {scan_ms:>8.1f} ms | contadores: {rollup_reads:>4} leituras {rollup_ms:>6.1f} ms")
+
+    if list_dashboard_models(db) != models:
+        failures.append("list_models")
+
+    backfilled = FakeFirestore()
+    batch = backfilled.batch()
+    for s in sessions:
+        # Sessões gravadas antes dos contadores: sem a marca de contadas.
+        legacy_session = {k: v for k, v in s.items() if k != COUNTED_FIELD}
+        batch.set(backfilled.collection('sessions').document(s["session_uuid"]), legacy_session)
+        if len(batch) == batch.MAX_OPERATIONS:
+            batch.commit()
+            batch = backfilled.batch()
+    batch.commit()
+    # Uma sessão nova gravada antes do backfill cria dashboard_meta/models, mas os
+    # contadores ainda não cobrem as sessões antigas: a leitura segue pela varredura.
+    generate(backfilled, 1, args.seed + 1)
+    legacy = [doc.to_dict() for doc in backfilled.collection('sessions').stream()]
+    if load_dashboard_data(backfilled) != dashboard_from_sessions(legacy):
+        failures.append("dashboard antes do backfill")
+    if list_dashboard_models(backfilled) != sorted({s["model_used"] for s in legacy}):
+        failures.append("list_models antes do backfill")
+    backfill_rollups(backfilled)
+    if load_dashboard_data(backfilled) != dashboard_from_sessions(legacy):
+        failures.append("backfill")
+
+    if failures:
+        print("DIVERGÊNCIA: " + ", ".join(failures))
+        sys.exit(1)
+    print(f"OK: contadores idênticos à varredura completa ({len(sessions)} sessões, {len(models)} modelos).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Memória e conferência da exportação de 'sessions' em streaming (utils/export.py).
+
+Gera uma coleção 'sessions' sintética grande num Firestore em memória e exporta em
+CSV (e em Parquet, se o pyarrow estiver instalado) página a página, com cursores
+(`start_after` + `limit`). Mede com tracemalloc o pico de memória alocada durante a
+exportação para dois tamanhos de coleção e compara com carregar a coleção inteira
+numa lista (como /dashboard_data fazia): o pico da exportação não deve crescer com
+a coleção. Também confere, pela rota /export/sessions, que os filtros de data e de
+modelo devolvem exatamente as sessões esperadas.
+
+Uso: python -m benchmarks.bench_export --sessions 200000
+"""
+import argparse
+import csv
+import io
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import app as flask_app_module
+from utils.constants import EXPORT_PARQUET_ROW_GROUP_SIZE, GEMINI_MODEL_LABEL, OPENROUTER_MODEL_A, OPENROUTER_MODEL_B
+from utils.export import EXPORT_FIELDS, export_sessions, iter_session_pages, parquet, parse_export_date, pyarrow
+from testing.fakes import FakeFirestore
+
+MODELS = [GEMINI_MODEL_LABEL, OPENROUTER_MODEL_A, OPENROUTER_MODEL_B]
+STATES = ["ajuda_na_escolha", "confirma_carrinho", "AWAITING_NAME", "AWAITING_EMAIL", "AWAITING_PHONE", "proposta_final"]
+FIRST_DAY = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def seed_sessions(db, sessions, seed):
+    rng = random.Random(seed)
+    batch = db.batch()
+    collection = db.collection('sessions')
+    for index in range(sessions):
+        if len(batch) >= batch.MAX_OPERATIONS:
+            batch.commit()
+            batch = db.batch()
+        session_uuid = f"s{index:09d}"
+        batch.set(collection.document(session_uuid), {
+            "session_uuid": session_uuid,
+            "model_used": rng.choice(MODELS),
+            "final_state": rng.choice(STATES),
+            "cart_items": rng.randint(0, 3),
+            "total_value": round(rng.uniform(0, 12000), 2),
+            "timestamp_utc": FIRST_DAY + timedelta(seconds=rng.randrange(180 * 86400)),
+        })
+    batch.commit()
+
+
+def _peak_bytes(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(sessions, seed, export_format):
+    db = FakeFirestore()
+    seed_sessions(db, sessions, seed)
+    # Monta o índice ordenado do Firestore em memória antes de medir: ele é do substituto, não da exportação.
+    next(iter_session_pages(db, page_size=1))
+
+    exported = {"bytes": 0}
+
+    def run_export():
+        for chunk in export_sessions(db, export_format):
+            exported["bytes"] += len(chunk)
+
+    start = time.perf_counter()
+    export_peak = _peak_bytes(run_export)
+    export_seconds = time.perf_counter() - start
+    load_all_peak = _peak_bytes(lambda: [doc.to_dict() for doc in db.collection('sessions').stream()])
+    return export_peak, load_all_peak, exported["bytes"], export_seconds
+
+
+def check_filters(sessions, seed):
+    """Exporta pela rota com filtros e compara com a contagem direta."""
+    db = FakeFirestore()
+    seed_sessions(db, sessions, seed)
+    flask_app_module.db = db
+    client = flask_app_module.app.test_client()
+    start, end, model = "2025-02-01", "2025-03-15", OPENROUTER_MODEL_B
+    response = client.get(f"/export/sessions?format=csv&start={start}&end={end}&model={model}")
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    low, high = parse_export_date(start), parse_export_date(end, end=True)
+    expected = sorted(doc.id for doc in db.collection('sessions').stream()
+                      if doc.get("model_used") == model and low <= doc.get("timestamp_utc") < high)
+    exported = [row[0] for row in rows[1:]]
+    problems = []
+    if tuple(rows[0]) != EXPORT_FIELDS:
+        problems.append(f"cabeçalho inesperado: {rows[0]}")
+    if sorted(exported) != expected:
+        problems.append(f"filtros: {len(exported)} linhas exportadas, {len(expected)} esperadas")
+    if [row[5] for row in rows[1:]] != sorted(row[5] for row in rows[1:]):
+        problems.append("linhas fora da ordem de timestamp_utc")
+    if client.get("/export/sessions?start=01/02/2025").status_code != 400:
+        problems.append("data inválida não devolveu 400")
+    if pyarrow is not None:
+        response = client.get(f"/export/sessions?format=parquet&start={start}&end={end}&model={model}")
+        table = parquet.read_table(io.BytesIO(response.get_data()))
+        if sorted(table.column("session_uuid").to_pylist()) != expected:
+            problems.append(f"parquet: {table.num_rows} linhas lidas de volta, {len(expected)} esperadas")
+    return len(exported), problems
+
+
+# Sessões gravadas por versões antigas: total em texto (reais), contagem em texto e um total ilegível.
+LEGACY_SESSIONS = [
+    ({"total_value": "3.499,00", "cart_items": 1}, 3499.0, 1),
+    ({"total_value": "R$ 1.299,90", "cart_items": "2"}, 1299.9, 2),
+    ({"total_value": 399, "cart_items": 1.0}, 399.0, 1),
+    ({"total_value": "a combinar", "cart_items": None}, None, None),
+]
+
+
+def check_legacy_values():
+    """Exporta sessões com valores no formato antigo; o arquivo tem de sair inteiro, com os tipos do esquema."""
+    db = FakeFirestore()
+    for index, (fields, _, _) in enumerate(LEGACY_SESSIONS):
+        session_uuid = f"legado{index}"
+        db.collection('sessions').document(session_uuid).set(dict(fields, session_uuid=session_uuid, model_used=GEMINI_MODEL_LABEL,
+                                                                  final_state="proposta_final", timestamp_utc=FIRST_DAY + timedelta(hours=index)))
+    flask_app_module.db = db
+    client = flask_app_module.app.test_client()
+    expected_totals = [total for _, total, _ in LEGACY_SESSIONS]
+    expected_items = [items for _, _, items in LEGACY_SESSIONS]
+    problems = []
+    rows = list(csv.reader(io.StringIO(client.get("/export/sessions?format=csv").get_data(as_text=True))))[1:]
+    if [float(row[4]) if row[4] else None for row in rows] != expected_totals:
+        problems.append(f"csv legado: totais {[row[4] for row in rows]}, esperados {expected_totals}")
+    if pyarrow is not None:
+        table = parquet.read_table(io.BytesIO(client.get("/export/sessions?format=parquet").get_data()))
+        if table.column("total_value").to_pylist() != expected_totals or table.column("cart_items").to_pylist() != expected_items:
+            problems.append(f"parquet legado: totais {table.column('total_value').to_pylist()}, itens {table.column('cart_items').to_pylist()}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    if args.sessions // 4 < 2 * EXPORT_PARQUET_ROW_GROUP_SIZE:
+        parser.error(f"--sessions precisa ser pelo menos {8 * EXPORT_PARQUET_ROW_GROUP_SIZE} (dois row groups na coleção menor)")
+
+    formats = ["csv"] + (["parquet"] if pyarrow is not None else [])
+    sizes = [args.sessions // 4, args.sessions]
+    problems = []
+    print(f"{'formato':<9}{'sessões':>10}{'pico exportação':>18}{'pico lista inteira':>20}{'saída':>12}{'tempo':>9}")
+    for export_format in formats:
+        peaks = []
+        for size in sizes:
+            export_peak, load_all_peak, output_bytes, seconds = measure(size, args.seed, export_format)
+            peaks.append(export_peak)
+            print(f"{export_format:<9}{size:>10}{export_peak / 2**20:>15.1f} MB{load_all_peak / 2**20:>17.1f} MB"
+                  f"{output_bytes / 2**20:>9.1f} MB{seconds:>8.1f}s")
+        # Coleção 4x maior: o pico da exportação deve ficar praticamente igual.
+        if peaks[1] > peaks[0] * 1.25 + 2**20:
+            problems.append(f"{export_format}: pico cresceu de {peaks[0] / 2**20:.1f} MB para {peaks[1] / 2**20:.1f} MB")
+    if pyarrow is None:
+        print("(pyarrow não instalado: Parquet não medido)")
+
+    filtered, filter_problems = check_filters(min(args.sessions, 20_000), args.seed)
+    problems += filter_problems
+    print(f"\nFiltro por data e modelo via /export/sessions: {filtered} sessões exportadas")
+    legacy_problems = check_legacy_values()
+    problems += legacy_problems
+    print(f"Sessões com total em texto (formato antigo): {len(LEGACY_SESSIONS)} exportadas {'com erro' if legacy_problems else 'com os tipos do esquema'}")
+
+    if problems:
+        print("FALHA:\n" + "\n".join(f"  {problem}" for problem in problems))
+        sys.exit(1)
+    print("OK: memória da exportação constante com o tamanho da coleção e filtros corretos.")
+
+
+if __name__ == "__main__":
+    main()
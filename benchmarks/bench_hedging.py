@@ -0,0 +1,163 @@
+"""Latência de cauda do /send_message com e sem requisições "hedged" (utils/hedging.py).
+
+Com o teste A/B ligado, cada sessão usa um dos dois modelos do OpenRouter, servidos
+por um LLM local (FakeLLMServer) com latências roteirizadas por modelo: o modelo A
+costuma responder rápido mas de vez em quando demora segundos; o B é um pouco mais
+lento e mais estável. Sem hedging, cada turno espera o modelo da sessão; com hedging,
+depois do p95 do modelo (aprendido numa rodada de aquecimento) o mesmo turno vai
+para o outro modelo e vale a primeira resposta válida.
+
+Compara p50/p95/p99 dos turnos, requisições extras ao LLM e confere que os
+documentos de 'sessions' registram em `model_turns` exatamente os modelos vencedores
+(e em `model_used` o que respondeu mais turnos). Falha se o p99 com hedging não ficar
+abaixo do p99 sem hedging.
+
+O controle de admissão recebe um slot por usuário em cada modelo: a fila de admissão
+tem o próprio benchmark (bench_admission) e aqui só a cauda do provedor importa.
+
+Uso: python -m benchmarks.bench_hedging --conversations 60 --users 8
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import app as flask_app_module
+import utils.admission as admission
+import utils.chat as chat
+import utils.firebase as firebase
+import utils.llm as llm
+from utils import metrics
+from utils.constants import OPENROUTER_MODEL_A, OPENROUTER_MODEL_B
+from testing.fakes import FakeFirestore, FakeLLMServer, scripted_latency
+from utils.firebase import seed_initial_products
+from utils.write_behind import flush_session_writes
+
+TURNS = ["oi, estou procurando um presente", "tem garantia estendida?", "e o parcelamento, como funciona?"]
+
+
+def _latencies(seed, fast, slow, slow_every, size=200):
+    rng = random.Random(seed)
+    values = [rng.uniform(*slow) if i % slow_every == 0 else rng.uniform(*fast) for i in range(size)]
+    rng.shuffle(values)
+    return values
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else 0.0
+
+
+def run(conversations, users):
+    latencies = []
+
+    def conversation(_):
+        client = flask_app_module.app.test_client()
+        client.post("/initialize_chat")
+        for user_input in TURNS:
+            start = time.perf_counter()
+            client.post("/send_message", json={"user_input": user_input})
+            latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(conversation, range(conversations)))
+    return latencies
+
+
+def hedge_counters():
+    counters = Counter()
+    for name, labels, value in metrics.iter_counters():
+        if name.startswith("llm_hedge_"):
+            counters[(name, labels.get("model"), labels.get("role"))] += value
+    return counters
+
+
+def check_sessions(db, counters):
+    """Confere os documentos de 'sessions' contra as vitórias contadas pelo hedging."""
+    flush_session_writes()
+    recorded, problems = Counter(), []
+    for doc in db.collection('sessions').stream():
+        record = doc.to_dict()
+        turns = record.get("model_turns") or {}
+        recorded.update(turns)
+        if turns and record["model_used"] != max(turns, key=lambda m: (turns[m], m == record["assigned_model"])):
+            problems.append(f"{record['session_uuid']}: model_used={record['model_used']} com model_turns={turns}")
+    won = Counter()
+    for (name, model, _), value in counters.items():
+        if name == "llm_hedge_wins_total" and value:
+            won[model] += value
+    if recorded != won:
+        problems.append(f"model_turns {dict(recorded)} != vitórias {dict(won)}")
+    return recorded, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=60)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20, help="conversas de aquecimento para aprender o p95")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    model_latency = {
+        OPENROUTER_MODEL_A: scripted_latency(_latencies(args.seed, fast=(0.15, 0.35), slow=(2.0, 6.0), slow_every=30)),
+        OPENROUTER_MODEL_B: scripted_latency(_latencies(args.seed + 1, fast=(0.25, 0.45), slow=(0.8, 1.2), slow_every=50)),
+    }
+    random.seed(args.seed)
+    for module in (flask_app_module, llm, chat, firebase):
+        module.AB_TEST_ENABLED = True
+    admission.LLM_MAX_CONCURRENCY_PER_MODEL = args.users
+    admission.reset_admission()
+
+    results = {}
+    with FakeLLMServer(model_latency=model_latency) as server:
+        llm.OPENROUTER_API_KEY = "fake"
+        llm.OPENROUTER_API_URL = server.openrouter_url
+        for label, enabled in (("sem hedging", False), ("com hedging", True)):
+            flask_app_module.HEDGED_REQUESTS_ENABLED = enabled
+            metrics.reset_metrics()
+            if enabled:
+                # O aquecimento grava num banco à parte: só a rodada medida é conferida em 'sessions'.
+                flask_app_module.db = FakeFirestore()
+                seed_initial_products(flask_app_module.db)
+                run(args.warmup, args.users)
+                flush_session_writes()
+            db = FakeFirestore()
+            seed_initial_products(db)
+            flask_app_module.db = db
+            counters_before, served_before = hedge_counters(), server.requests_served
+            latencies = run(args.conversations, args.users)
+            requests = server.requests_served - served_before
+            counters = hedge_counters()
+            counters.subtract(counters_before)
+            results[label] = (latencies, requests, counters, db)
+
+    print(f"{args.conversations} conversas x {len(TURNS)} turnos, {args.users} usuários simultâneos, A/B com {OPENROUTER_MODEL_A} e {OPENROUTER_MODEL_B}\n")
+    print(f"{'modo':<14}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'máx (ms)':>10}{'req. LLM/turno':>16}{'hedges':>8}{'reserva venceu':>16}{'cancelados':>12}")
+    for label, (latencies, requests, counters, _) in results.items():
+        fired = sum(v for (name, _, _), v in counters.items() if name == "llm_hedge_fired_total")
+        backup_wins = sum(v for (name, _, role), v in counters.items() if name == "llm_hedge_wins_total" and role == "backup")
+        cancelled = sum(v for (name, _, _), v in counters.items() if name == "llm_hedge_cancelled_total")
+        print(f"{label:<14}{percentile(latencies, 50) * 1000:>10.0f}{percentile(latencies, 95) * 1000:>10.0f}"
+              f"{percentile(latencies, 99) * 1000:>10.0f}{max(latencies) * 1000:>10.0f}{requests / len(latencies):>16.2f}"
+              f"{fired:>8}{backup_wins:>16}{cancelled:>12}")
+
+    _, _, counters, db = results["com hedging"]
+    recorded, problems = check_sessions(db, counters)
+    p99 = {label: percentile(latencies, 99) for label, (latencies, _, _, _) in results.items()}
+    if p99["com hedging"] >= p99["sem hedging"]:
+        problems.append(f"p99 com hedging ({p99['com hedging'] * 1000:.0f} ms) não é menor que sem hedging "
+                        f"({p99['sem hedging'] * 1000:.0f} ms)")
+    print(f"\nTurnos por modelo vencedor gravados em 'sessions': {dict(recorded)}")
+    if problems:
+        print("FALHA:\n" + "\n".join(f"  {problem}" for problem in problems))
+        sys.exit(1)
+    print("OK: hedging reduz o p99; model_turns e model_used das sessões conferem com os modelos vencedores.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Teste de carga offline do app Flask: conversas simultâneas e /dashboard_data, com limites de regressão.
+
+Sobe o app Flask num servidor WSGI com threads, ligado a substitutos locais: um
+Firestore em memória (FakeFirestore) e os dois provedores de LLM (FakeLLMServer,
+para Gemini e OpenRouter), todos com latência log-normal (mediana e p99
+configuráveis) e taxa de erro. Usuários virtuais percorrem conversas roteirizadas
+por /initialize_chat e /send_message (navegação, carrinho e compra completa) com a
+concorrência escolhida; em seguida /dashboard_data (geral e por modelo) é chamado
+sobre os contadores de um conjunto sintético de 1M de sessões. O processo faz o papel
+do container inteiro, então o limite de chamadas simultâneas por modelo do controle de
+admissão é multiplicado por --workers.
+
+O dashboard lê apenas os contadores pré-agregados (session_rollups), então o
+conjunto sintético é gerado diretamente como os contadores que essas sessões
+produziriam; a equivalência com a varredura completa é conferida por
+bench_dashboard_rollups.
+
+Para cada rota: p50/p95/p99, máximo e taxa de erro; no total, a vazão. Os limites em
+benchmarks/data/load_thresholds.json (ou --thresholds) reprovam a execução com
+código de saída 1. Com --save-results e --baseline, compara-se com uma execução
+anterior (p95 e vazão, com --tolerance de folga).
+
+Uso: python -m benchmarks.bench_load --users 20 --conversations 200
+     python -m benchmarks.bench_load --save-results /tmp/antes.json
+     python -m benchmarks.bench_load --baseline /tmp/antes.json --tolerance 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+import requests
+from werkzeug.serving import make_server
+
+import app as flask_app_module
+import utils.admission as admission
+import utils.llm as llm
+from utils.constants import GEMINI_MODEL_LABEL, OPENROUTER_MODEL_A, OPENROUTER_MODEL_B
+from utils.dashboard import BACKFILL_DOC, META_COLLECTION, MODELS_DOC, ROLLUPS_COLLECTION, rollup_doc_id
+from testing.fakes import FakeFirestore, FakeLLMServer, lognormal_latency
+from utils.firebase import seed_initial_products
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), "data", "load_thresholds.json")
+
+# Conversas roteirizadas e seus pesos. O LLM local sempre oferece o NovoPhone X12
+# (DEFAULT_FAKE_LLM_RESPONSE), então "sim" e a coleta de dados seguem o fluxo de compra.
+SCRIPTS = {
+    "compra completa": (4, ["quais celulares vocês têm?", "sim", "finalizar a compra",
+                            "Maria Silva", "maria.silva@example.com", "(11) 98765-4321"]),
+    "navegação": (4, ["oi, estou procurando um presente", "tem garantia estendida?", "qual a diferença para o modelo anterior?"]),
+    "carrinho e desistência": (2, ["quais celulares vocês têm?", "pode adicionar", "qual o total?", "remover o NovoPhone"]),
+}
+DASHBOARD_STATES = (("ajuda_na_escolha", 40), ("confirma_carrinho", 15), ("AWAITING_NAME", 8),
+                    ("AWAITING_EMAIL", 5), ("AWAITING_PHONE", 4), ("proposta_final", 28))
+
+
+def percentile(values, q):
+    """Percentil por posição (nearest-rank) de uma lista de valores."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, route, elapsed, ok):
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            if not ok:
+                self.errors[route] += 1
+
+    def summary(self, route):
+        values = self.latencies[route]
+        return {
+            "requests": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values, default=0) * 1000,
+            "error_rate": self.errors[route] / len(values) if values else 0.0,
+        }
+
+
+def _post(http, recorder, base_url, route, payload=None):
+    start = time.perf_counter()
+    try:
+        response = http.post(f"{base_url}/{route}", json=payload, timeout=120)
+        body = response.json()
+        ok = response.status_code < 500 and not str(body.get("bot_response", "")).startswith("ERRO")
+    except (requests.RequestException, ValueError):
+        ok = False
+    recorder.record(route, time.perf_counter() - start, ok)
+
+
+def run_conversation(base_url, recorder, turns):
+    with requests.Session() as http:
+        _post(http, recorder, base_url, "initialize_chat")
+        for user_input in turns:
+            _post(http, recorder, base_url, "send_message", {"user_input": user_input})
+
+
+def seed_dashboard(db, sessions, days, seed):
+    """Grava os contadores do dashboard equivalentes a `sessions` sessões distribuídas em `days` dias."""
+    rng = random.Random(seed)
+    models = [GEMINI_MODEL_LABEL, OPENROUTER_MODEL_A, OPENROUTER_MODEL_B]
+    day_labels = [(date(2025, 1, 1) + timedelta(days=d)).isoformat() for d in range(days)]
+    states, weights = zip(*DASHBOARD_STATES)
+    counts = defaultdict(lambda: defaultdict(int))
+    for model, day, state in zip(rng.choices(models, k=sessions), rng.choices(day_labels, k=sessions), rng.choices(states, weights, k=sessions)):
+        counts[(model, day)][state] += 1
+
+    rollups = db.collection(ROLLUPS_COLLECTION)
+    batch = db.batch()
+    for (model, day), day_states in counts.items():
+        if len(batch) >= batch.MAX_OPERATIONS:
+            batch.commit()
+            batch = db.batch()
+        batch.set(rollups.document(rollup_doc_id(model, day)), {"model": model, "day": day, "shard": 0, "states": dict(day_states)})
+    batch.set(db.collection(META_COLLECTION).document(MODELS_DOC), {"models": models})
+    # Como depois de 'flask backfill-rollups': sem a marca, o dashboard volta à varredura de 'sessions'.
+    batch.set(db.collection(META_COLLECTION).document(BACKFILL_DOC), {"completed_at": datetime.now(timezone.utc), "sessions": sessions})
+    batch.commit()
+    return models, len(counts)
+
+
+def run_dashboard(base_url, recorder, models, requests_count, users):
+    urls = [f"{base_url}/dashboard_data"] + [f"{base_url}/dashboard_data?model={model}" for model in models]
+
+    def fetch(index):
+        start = time.perf_counter()
+        try:
+            response = requests.get(urls[index % len(urls)], timeout=120)
+            ok = response.status_code == 200 and bool(response.json().get("bar_chart_data", {}).get("datasets"))
+        except (requests.RequestException, ValueError):
+            ok = False
+        recorder.record("dashboard_data", time.perf_counter() - start, ok)
+
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(fetch, range(requests_count)))
+
+
+def check_thresholds(results, thresholds):
+    violations = []
+    for route, limits in thresholds.get("routes", {}).items():
+        summary = results["routes"].get(route)
+        if summary is None:
+            continue
+        for metric, limit in limits.items():
+            if summary[metric] > limit:
+                violations.append(f"{route} {metric} = {summary[metric]:.3f} > limite {limit}")
+    minimum = thresholds.get("min_turns_per_second")
+    if minimum is not None and results["turns_per_second"] < minimum:
+        violations.append(f"vazão {results['turns_per_second']:.1f} turnos/s < mínimo {minimum}")
+    return violations
+
+
+def compare_baseline(results, baseline, tolerance):
+    regressions = []
+    for route, summary in results["routes"].items():
+        before = baseline["routes"].get(route)
+        if before and before["p95_ms"] > 0 and summary["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route} p95 {before['p95_ms']:.1f} ms -> {summary['p95_ms']:.1f} ms")
+    if results["turns_per_second"] < baseline["turns_per_second"] * (1 - tolerance):
+        regressions.append(f"vazão {baseline['turns_per_second']:.1f} -> {results['turns_per_second']:.1f} turnos/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="usuários virtuais simultâneos")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--llm-p50", type=float, default=0.3, help="mediana da latência do LLM (s)")
+    parser.add_argument("--llm-p99", type=float, default=1.5)
+    parser.add_argument("--llm-error-rate", type=float, default=0.01, help="fração de respostas 503 do LLM")
+    parser.add_argument("--firestore-p50", type=float, default=0.005)
+    parser.add_argument("--firestore-p99", type=float, default=0.03)
+    parser.add_argument("--firestore-error-rate", type=float, default=0.0)
+    parser.add_argument("--dashboard-sessions", type=int, default=1_000_000)
+    parser.add_argument("--dashboard-days", type=int, default=180)
+    parser.add_argument("--dashboard-requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4,
+                        help="workers do gunicorn que este processo representa (WEB_CONCURRENCY): multiplica os slots por modelo")
+    parser.add_argument("--ab-test", action="store_true", help="usa o OpenRouter (modelos A/B) em vez do Gemini")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--save-results", help="grava os resultados em JSON para comparar depois")
+    parser.add_argument("--baseline", help="resultados de uma execução anterior (--save-results)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="piora aceita em relação ao --baseline")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    db = FakeFirestore(commit_latency=lognormal_latency(args.firestore_p50, args.firestore_p99, rng),
+                       read_latency=lognormal_latency(args.firestore_p50, args.firestore_p99, rng),
+                       error_rate=args.firestore_error_rate)
+    seed_initial_products(db)
+    start = time.perf_counter()
+    models, rollup_docs = seed_dashboard(db, args.dashboard_sessions, args.dashboard_days, args.seed)
+    print(f"Dashboard: {args.dashboard_sessions} sessões sintéticas em {rollup_docs} documentos de contadores "
+          f"({time.perf_counter() - start:.1f}s para gerar)")
+
+    flask_app_module.db = db
+    flask_app_module.AB_TEST_ENABLED = args.ab_test
+    # Um só processo faz o papel do container inteiro: o limite por modelo vale por worker.
+    admission.LLM_MAX_CONCURRENCY_PER_MODEL *= args.workers
+    admission.reset_admission()
+    httpd = make_server("127.0.0.1", 0, flask_app_module.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_port}"
+
+    names = list(SCRIPTS)
+    weights = [SCRIPTS[name][0] for name in names]
+    conversations = [SCRIPTS[name][1] for name in rng.choices(names, weights, k=args.conversations)]
+    recorder = Recorder()
+    with FakeLLMServer(latency=lognormal_latency(args.llm_p50, args.llm_p99, rng), error_rate=args.llm_error_rate) as server:
+        llm.GEMINI_API_KEY = "fake"
+        llm.GEMINI_API_URL = server.gemini_url
+        llm.OPENROUTER_API_KEY = "fake"
+        llm.OPENROUTER_API_URL = server.openrouter_url
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            list(pool.map(lambda turns: run_conversation(base_url, recorder, turns), conversations))
+        chat_seconds = time.perf_counter() - start
+        llm_requests = server.requests_served
+    run_dashboard(base_url, recorder, models, args.dashboard_requests, args.users)
+    httpd.shutdown()
+
+    turns = len(recorder.latencies["send_message"])
+    results = {
+        "config": vars(args),
+        "routes": {route: recorder.summary(route) for route in ("initialize_chat", "send_message", "dashboard_data")},
+        "turns_per_second": turns / chat_seconds,
+        "conversations_per_second": args.conversations / chat_seconds,
+        "llm_requests": llm_requests,
+    }
+
+    print(f"{args.conversations} conversas, {args.users} usuários simultâneos, LLM p50/p99 {args.llm_p50}/{args.llm_p99}s "
+          f"com {args.llm_error_rate:.0%} de erros, Firestore p50/p99 {args.firestore_p50}/{args.firestore_p99}s\n")
+    print(f"{'rota':<18}{'req':>7}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}{'máx (ms)':>11}{'erros':>8}")
+    for route, summary in results["routes"].items():
+        print(f"{route:<18}{summary['requests']:>7}{summary['p50_ms']:>11.1f}{summary['p95_ms']:>11.1f}"
+              f"{summary['p99_ms']:>11.1f}{summary['max_ms']:>11.1f}{summary['error_rate']:>8.1%}")
+    print(f"\nVazão: {results['turns_per_second']:.1f} turnos/s, {results['conversations_per_second']:.2f} conversas/s "
+          f"({llm_requests} requisições ao LLM para {turns} turnos)")
+
+    if args.save_results:
+        with open(args.save_results, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Resultados gravados em {args.save_results}")
+
+    with open(args.thresholds, encoding="utf-8") as f:
+        failures = check_thresholds(results, json.load(f))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures += compare_baseline(results, json.load(f), args.tolerance)
+    if failures:
+        print("FALHA:\n" + "\n".join(f"  {failure}" for failure in failures))
+        sys.exit(1)
+    print("OK: dentro dos limites" + (" e sem regressão em relação ao baseline." if args.baseline else "."))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Taxa de acerto e latência economizada pelo cache de respostas (utils/response_cache.py).
+
+Roda conversas no app Flask contra um LLM local (FakeLLMServer) com latência fixa e
+um Firestore em memória. Cada conversa abre com uma pergunta comum sobre o catálogo
+(com variações de caixa, acento e pontuação) e segue com um turno que não é elegível
+ao cache. No meio da rodada com cache, o preço de um produto muda no Firestore para
+conferir que o listener do catálogo invalida as respostas guardadas.
+
+Uso: python -m benchmarks.bench_response_cache --sessions 100 --llm-latency 0.1
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+
+import app as flask_app_module
+import utils.llm as llm
+import utils.response_cache as response_cache
+from utils import metrics
+from utils.catalog import get_catalog_cache_stats
+from testing.fakes import FakeFirestore, FakeLLMServer
+from utils.firebase import seed_initial_products
+
+OPENING_QUESTIONS = [
+    ["quais celulares vocês têm?", "Quais celulares voces tem", "quais celulares vocês têm ?!"],
+    ["quanto custa o NovoPhone?", "Quanto custa o novophone", "quanto custa o NovoPhone X12?"],
+    ["vocês vendem notebook?", "Voces vendem notebook?"],
+    ["tem fone de ouvido bluetooth?", "Tem fone de ouvido Bluetooth"],
+    ["qual o smartwatch mais barato?"],
+    ["oi, estou procurando uma tv", "Oi! Estou procurando uma TV."],
+]
+FOLLOW_UP = "pode adicionar ao carrinho, por favor"
+
+
+def run(client, server, sessions, seed, invalidate_at=None, db=None):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(OPENING_QUESTIONS))]
+    latencies = []
+    llm_calls_before = server.requests_served
+    for index in range(sessions):
+        if index == invalidate_at:
+            db.collection('products').document('p1').update({"price": "3.299,00"})
+            time.sleep(0.05)
+        question = rng.choice(rng.choices(OPENING_QUESTIONS, weights)[0])
+        client.post("/initialize_chat")
+        start = time.perf_counter()
+        client.post("/send_message", json={"user_input": question})
+        latencies.append((time.perf_counter() - start) * 1000)
+        client.post("/send_message", json={"user_input": FOLLOW_UP})
+    return latencies, server.requests_served - llm_calls_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--llm-latency", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    db = FakeFirestore()
+    seed_initial_products(db)
+    flask_app_module.db = db
+    client = flask_app_module.app.test_client()
+
+    with FakeLLMServer(latency=args.llm_latency) as server:
+        llm.GEMINI_API_KEY = "fake"
+        llm.GEMINI_API_URL = server.gemini_url
+
+        response_cache.RESPONSE_CACHE_ENABLED = False
+        off_latencies, off_calls = run(client, server, args.sessions, args.seed)
+
+        response_cache.RESPONSE_CACHE_ENABLED = True
+        response_cache.clear_response_cache()
+        metrics.reset_metrics()
+        on_latencies, on_calls = run(client, server, args.sessions, args.seed, invalidate_at=args.sessions // 2, db=db)
+        stats = response_cache.get_response_cache_stats()
+
+    print(f"{args.sessions} conversas (2 turnos cada), latência do LLM {args.llm_latency}s")
+    print(f"{'cache':<10}{'chamadas ao LLM':>17}{'p50 1º turno (ms)':>20}{'média 1º turno (ms)':>22}")
+    for label, latencies, calls in (("desligado", off_latencies, off_calls), ("ligado", on_latencies, on_calls)):
+        print(f"{label:<10}{calls:>17}{statistics.median(latencies):>20.1f}{statistics.mean(latencies):>22.1f}")
+    print(f"\nAcertos: {stats['hits']}, falhas: {stats['misses']}, taxa de acerto {100 * (stats['hit_rate'] or 0):.1f}% "
+          f"nos turnos elegíveis; latência economizada {stats['latency_saved_seconds']:.2f}s")
+    print(f"Preço alterado na conversa {args.sessions // 2}: catálogo atualizado pelo listener "
+          f"({get_catalog_cache_stats()['snapshot_refreshes']} snapshots) e respostas antigas descartadas.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Confere utils/response_parser.py contra um corpus de respostas reais e malformadas e mede o custo.
+
+O corpus (benchmarks/data/llm_response_corpus.json) traz respostas como chegam dos
+provedores: JSON puro, cercas de código, preâmbulos, blocos <think> do DeepSeek-R1,
+vírgulas sobrando, JSON truncado por max_tokens e campos inválidos. Para cada caso,
+o resultado de parse_llm_response é comparado com o esperado; depois o tempo por
+resposta é comparado com o tratamento antigo de apply_llm_response, cujas exceções
+(que derrubavam a requisição) também são contadas.
+
+O mesmo corpus, mais casos com escapes \\u malformados, truncados e substitutos soltos,
+passa também pelo extrator incremental do streaming (RespostaStreamExtractor), em
+pedaços de vários tamanhos: nenhum caso pode levantar exceção e o texto emitido deve
+ser o mesmo qualquer que seja o tamanho dos pedaços.
+
+Uso: python -m benchmarks.bench_response_parser --repeat 2000
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from decimal import Decimal
+
+from utils.response_parser import _extract_object, parse_llm_response
+from utils.stream_parser import RespostaStreamExtractor
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "llm_response_corpus.json")
+CHUNK_SIZES = (1, 2, 3, 7, 64)
+# (nome, resposta do modelo, texto que o stream deve emitir)
+STREAM_CASES = [
+    ("unicode_e_emoji", '{"resposta": "Ol\\u00e1 \\ud83d\\ude00!", "chat_state": "ajuda_na_escolha"}', "Olá 😀!"),
+    ("unicode_hex_invalido", '{"resposta": "pre\\u00zzo", "chat_state": "ajuda_na_escolha"}', "pre\\u00zzo"),
+    ("unicode_antes_das_aspas", '{"resposta": "fim\\u", "chat_state": "ajuda_na_escolha"}', "fim\\u"),
+    ("substituto_alto_solto", '{"resposta": "x\\ud83d", "chat_state": "ajuda_na_escolha"}', "x\\ud83d"),
+    ("substituto_alto_sem_par", '{"resposta": "\\ud83d\\u0041", "chat_state": "ajuda_na_escolha"}', "\\ud83dA"),
+    ("substituto_baixo_solto", '{"resposta": "\\ude00 ok", "chat_state": "ajuda_na_escolha"}', "\\ude00 ok"),
+    ("unicode_truncado", '{"resposta": "Pre\\u00', "Pre"),
+]
+
+
+def legacy_parse(bot_response):
+    """Tratamento anterior de apply_llm_response (duas buscas gulosas e json.loads sem proteção)."""
+    match = re.search(r'\{.*\}', bot_response, re.DOTALL)
+    try:
+        bot_response = json.loads(bot_response)
+    except json.JSONDecodeError:
+        match = re.search(r'\{.*\}', bot_response, re.DOTALL)
+        if match:
+            bot_response = json.loads(match.group(0))
+    if isinstance(bot_response, dict):
+        return bot_response["resposta"], bot_response.get("total_value", 0.0)
+    return bot_response, None
+
+
+def check(case):
+    parsed = parse_llm_response(case["completion"])
+    expected = case["expected"]
+    actual = {
+        "structured": parsed.structured,
+        "resposta": parsed.resposta,
+        "chat_state": parsed.chat_state,
+        "cart": len(parsed.cart),
+        "total_value": str(parsed.total_value) if parsed.total_value is not None else None,
+        "errors": len(parsed.errors),
+        "has_link": parsed.has_link,
+        "last_input_invalid": parsed.last_input_invalid,
+    }
+    mismatches = [f"{key}: esperado {value!r}, obtido {actual[key]!r}" for key, value in expected.items() if actual[key] != value]
+    if parsed.structured and not isinstance(parsed.total_value, Decimal):
+        mismatches.append("total_value não é Decimal")
+    return mismatches
+
+
+def stream(completion, size):
+    """Texto emitido pelo extrator do streaming com a resposta chegando em pedaços de `size` caracteres."""
+    extractor = RespostaStreamExtractor()
+    return "".join(extractor.feed(completion[i:i + size]) for i in range(0, len(completion), size))
+
+
+def check_stream(completion, expected=None):
+    """Divergências do streaming: exceções, texto diferente entre tamanhos de pedaço ou do esperado."""
+    outputs = set()
+    for size in CHUNK_SIZES:
+        try:
+            outputs.add(stream(completion, size))
+        except Exception as e:
+            return [f"pedaços de {size}: {type(e).__name__}: {e}"]
+    if len(outputs) > 1:
+        return [f"texto varia com o tamanho dos pedaços: {sorted(outputs)!r}"]
+    if expected is not None and outputs != {expected}:
+        return [f"esperado {expected!r}, obtido {outputs.pop()!r}"]
+    return []
+
+
+def _time_per_call(func, completions, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for completion in completions:
+            try:
+                func(completion)
+            except Exception:
+                pass
+    return (time.perf_counter() - start) / (repeat * len(completions)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    failures = 0
+    legacy_crashes = []
+    print(f"{'caso':<40}{'novo':>8}{'antigo':>18}")
+    for case in corpus:
+        mismatches = check(case)
+        failures += bool(mismatches)
+        try:
+            legacy_parse(case["completion"])
+            legacy = "ok"
+        except Exception as e:
+            legacy = type(e).__name__
+            legacy_crashes.append(case["name"])
+        print(f"{case['name']:<40}{'ok' if not mismatches else 'FALHA':>8}{legacy:>18}" + ("".join(f"\n    {m}" for m in mismatches)))
+
+    print(f"\n{'streaming':<40}{'resultado':>8}")
+    for name, completion, expected in [(case["name"], case["completion"], None) for case in corpus] + STREAM_CASES:
+        mismatches = check_stream(completion, expected)
+        failures += bool(mismatches)
+        print(f"{name:<40}{'ok' if not mismatches else 'FALHA':>8}" + "".join(f"\n    {m}" for m in mismatches))
+
+    completions = [case["completion"] for case in corpus]
+    new_us = _time_per_call(parse_llm_response, completions, args.repeat)
+    old_us = _time_per_call(legacy_parse, completions, args.repeat)
+    extract_us = _time_per_call(_extract_object, completions, args.repeat)
+    print(f"\nTempo médio por resposta: {new_us:.1f} µs (novo, com validação) vs {old_us:.1f} µs (antigo, sem validação)")
+    print(f"Só a extração do JSON: {extract_us:.1f} µs (raw_decode numa passada) vs {old_us:.1f} µs (duas buscas gulosas + json.loads)")
+    print(f"O tratamento antigo levantaria exceção em {len(legacy_crashes)} de {len(corpus)} casos.")
+
+    if failures:
+        print(f"FALHA: {failures} caso(s) divergentes.")
+        sys.exit(1)
+    print(f"OK: {len(corpus)} casos conforme o esperado, também no streaming (+{len(STREAM_CASES)} casos de escape).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Custo de sessão por requisição em função do tamanho da conversa, para cada backend.
+
+Mede apenas `open_session` + `save_session` (leitura, serialização e gravação da
+sessão) em um app Flask mínimo que acrescenta um turno (usuário + modelo) por
+requisição, como /send_message. Para o cookie, mostra também o tamanho do
+Set-Cookie (navegadores descartam cookies acima de ~4KB).
+
+Uso: python -m benchmarks.bench_session_overhead --turns 40
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from flask import Flask, session
+
+from utils.chat import start_new_session
+from utils.session_store import MemorySessionStore, SQLiteSessionStore, ServerSideSessionInterface
+
+USER_TEXT = "Quero um celular com boa câmera e bateria que dure o dia todo, até uns 3.500 reais."
+BOT_TEXT = ("O NovoPhone X12 custa R$ 3.499,00 e tem câmera tripla com bateria de longa duração. "
+            "Gostaria de adicioná-lo ao carrinho ou prefere ver outras opções?")
+
+
+class _TimedSessionInterface:
+    """Envolve uma SessionInterface medindo o tempo gasto em abrir e salvar a sessão."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.elapsed = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def open_session(self, app, request):
+        start = time.perf_counter()
+        try:
+            return self.inner.open_session(app, request)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def save_session(self, app, session, response):
+        start = time.perf_counter()
+        try:
+            return self.inner.save_session(app, session, response)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+def _build_app(interface):
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    timed = _TimedSessionInterface(interface)
+    app.session_interface = timed
+
+    @app.post("/initialize_chat")
+    def initialize_chat():
+        start_new_session(session)
+        return "ok"
+
+    @app.post("/turn")
+    def turn():
+        session["last_input_invalid"] = False
+        # Sufixo aleatório para que o zlib do cookie não comprima turnos idênticos.
+        session["chat_history_for_llm"].append({"role": "user", "parts": [{"text": f"{USER_TEXT} {os.urandom(16).hex()}"}]})
+        session["chat_history_for_llm"].append({"role": "model", "parts": [{"text": f"{BOT_TEXT} {os.urandom(16).hex()}"}]})
+        session["customer_data"]["cart"] = session["customer_data"]["cart"] + [{"nome": "NovoPhone X12", "preço": "3.499,00"}]
+        session["total_value"] = 3499.0 * len(session["customer_data"]["cart"])
+        return "ok"
+
+    return app, timed
+
+
+def run(interface, checkpoints, repeats):
+    results = {}
+    for turns in checkpoints:
+        total, cookie_bytes = 0.0, 0
+        for _ in range(repeats):
+            app, timed = _build_app(interface)
+            client = app.test_client()
+            client.post("/initialize_chat")
+            for _ in range(turns - 1):
+                client.post("/turn")
+            timed.elapsed = 0.0
+            response = client.post("/turn")
+            total += timed.elapsed
+            cookie_bytes = max(cookie_bytes, len(response.headers.get("Set-Cookie", "")))
+        results[turns] = (total / repeats * 1000, cookie_bytes)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    checkpoints = sorted({1, 5, 10, 20, args.turns})
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "cookie": Flask.session_interface,
+            "memory": ServerSideSessionInterface(MemorySessionStore()),
+            "sqlite": ServerSideSessionInterface(SQLiteSessionStore(os.path.join(tmp, "sessions.sqlite3"))),
+        }
+        results = {name: run(interface, checkpoints, args.repeats) for name, interface in backends.items()}
+
+    print(f"{'turnos':>7}" + "".join(f"{name + ' (ms)':>14}" for name in results) + f"{'cookie (bytes)':>16}")
+    for turns in checkpoints:
+        row = "".join(f"{results[name][turns][0]:>14.3f}" for name in results)
+        print(f"{turns:>7}{row}{results['cookie'][turns][1]:>16}")
+
+
+if __name__ == "__main__":
+    main()
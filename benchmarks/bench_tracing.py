@@ -0,0 +1,141 @@
+"""Instrumentação por etapa do turno (utils/tracing.py) e o endpoint /metrics.
+
+Roda conversas no app Flask contra um LLM local (FakeLLMServer) com latência fixa e
+um Firestore em memória, lê /metrics como um scrape do Prometheus faria e mostra o
+tempo médio de cada etapa (catalog, local_reply, prompt, llm, parse, save), os
+tokens reportados pelo provedor e quanto da duração do turno as etapas explicam.
+Também mede o custo de um span no modo padrão (sem OpenTelemetry) e compara o
+tamanho da linha de log do turno com o dump completo da sessão que ela substituiu.
+
+Uso: python -m benchmarks.bench_tracing --sessions 50 --llm-latency 0.05
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+
+import app as flask_app_module
+import utils.llm as llm
+from utils import metrics
+from testing.fakes import FakeFirestore, FakeLLMServer
+from utils.firebase import seed_initial_products
+from utils.tracing import span
+
+TURNS = ["quais celulares vocês têm?", "tem garantia estendida?", "qual a diferença para o modelo anterior?"]
+EXPECTED_STAGES = ("catalog", "local_reply", "prompt", "llm", "parse", "save")
+_SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def scrape(client):
+    """Amostras de /metrics como {(nome, labels): valor}, sem o rótulo `worker` (checado aqui)."""
+    body = client.get("/metrics").get_data(as_text=True)
+    worker = f'worker="{os.getpid()}"'
+    samples = {}
+    for line in body.splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            labels = match.group(2) or ""
+            if worker not in labels.split(","):
+                raise AssertionError(f"série sem o rótulo {worker}: {line}")
+            labels = ",".join(label for label in labels.split(",") if label != worker)
+            samples[(match.group(1), labels)] = float(match.group(3))
+    return samples
+
+
+class _CaptureHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    db = FakeFirestore()
+    seed_initial_products(db)
+    flask_app_module.db = db
+    flask_app_module.AB_TEST_ENABLED = False
+    client = flask_app_module.app.test_client()
+    metrics.reset_metrics()
+
+    with FakeLLMServer(latency=args.llm_latency) as server:
+        llm.GEMINI_API_KEY = "fake"
+        llm.GEMINI_API_URL = server.gemini_url
+        for _ in range(args.sessions):
+            client.post("/initialize_chat")
+            for turn in TURNS:
+                client.post("/send_message", json={"user_input": turn})
+
+        # Uma linha de log do turno, capturada em INFO, contra o dump que era feito antes.
+        logging.disable(logging.NOTSET)
+        capture = _CaptureHandler()
+        root = logging.getLogger()
+        previous_level = root.level
+        root.addHandler(capture)
+        root.setLevel(logging.INFO)
+        try:
+            client.post("/send_message", json={"user_input": TURNS[-1]})
+        finally:
+            root.removeHandler(capture)
+            root.setLevel(previous_level)
+            logging.disable(logging.WARNING)
+        with client.session_transaction() as session:
+            old_dump = str(dict(session))
+    turn_lines = [m for m in capture.messages if m.startswith("turno ")]
+
+    samples = scrape(client)
+    failures = []
+    turn_count = samples.get(("chat_turn_seconds_count", 'route="send_message"'), 0)
+    turn_sum = samples.get(("chat_turn_seconds_sum", 'route="send_message"'), 0)
+    print(f"{int(turn_count)} turnos em /send_message, média {turn_sum / max(turn_count, 1) * 1000:.1f} ms (LLM local com {args.llm_latency}s)\n")
+    print(f"{'etapa':<26}{'chamadas':>10}{'média (ms)':>12}{'% do turno':>12}")
+    stage_total = 0.0
+    for (name, labels), value in sorted(samples.items()):
+        if name != "chat_stage_seconds_count":
+            continue
+        stage = labels.split('"')[1]
+        seconds = samples[("chat_stage_seconds_sum", labels)]
+        if stage in EXPECTED_STAGES:
+            stage_total += seconds
+        print(f"{stage:<26}{int(value):>10}{seconds / value * 1000:>12.2f}{seconds / turn_sum * 100 if turn_sum else 0:>11.1f}%")
+    missing = [s for s in EXPECTED_STAGES if ("chat_stage_seconds_count", f'stage="{s}"') not in samples]
+    if missing:
+        failures.append(f"etapas sem medição: {', '.join(missing)}")
+    print(f"\nAs etapas explicam {stage_total / turn_sum * 100 if turn_sum else 0:.1f}% do tempo dos turnos.")
+
+    tokens = {kind: sum(value for (name, labels), value in samples.items() if name == "llm_tokens_total" and f'kind="{kind}"' in labels)
+              for kind in ("prompt", "completion")}
+    print(f"Tokens reportados pelo provedor: {int(tokens['prompt'])} de entrada, {int(tokens['completion'])} de saída")
+    if not tokens["prompt"] or not tokens["completion"]:
+        failures.append("uso de tokens não registrado")
+
+    iterations = 100_000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with span("bench"):
+            pass
+    span_us = (time.perf_counter() - start) / iterations * 1e6
+    print(f"Custo de um span sem OpenTelemetry: {span_us:.2f} µs ({len(EXPECTED_STAGES)} por turno)")
+
+    if turn_lines:
+        print(f"Log por turno: {len(turn_lines[-1])} caracteres (resumo) vs {len(old_dump)} (sessão completa)")
+    else:
+        failures.append("linha de resumo do turno não registrada em INFO")
+
+    if failures:
+        print("FALHA: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK: todas as etapas e o uso de tokens aparecem em /metrics.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Gravações por sessão e latência da gravação no turno: síncrona vs write-behind (utils/write_behind.py).
+
+Simula conversas de vários turnos num Firestore em memória com latência de commit
+(como a ida e volta ao Firestore), gravando a sessão ao fim de cada turno. Compara
+commits e documentos gravados por sessão, e o tempo que o turno espera pela gravação,
+entre save_session_to_firestore e queue_session_save. Confere também que os
+documentos de 'sessions' e os contadores do dashboard terminam idênticos.
+
+Uso: python -m benchmarks.bench_write_behind --sessions 200 --turns 8
+"""
+import argparse
+import logging
+import random
+import statistics
+import sys
+import threading
+import time
+
+import utils.write_behind as write_behind
+from utils.dashboard import load_dashboard_data
+from testing.fakes import FakeFirestore
+from utils.firebase import save_session_to_firestore
+
+STATES = ["ajuda_na_escolha", "ajuda_na_escolha", "confirma_carrinho", "AWAITING_NAME", "AWAITING_EMAIL", "AWAITING_PHONE", "proposta_final"]
+
+
+def _conversation(rng, index, turns):
+    session = {"session_uuid": f"s{index:06d}", "chat_state": STATES[0], "customer_data": {"cart": []}, "total_value": 0.0}
+    for turn in range(turns):
+        session["chat_state"] = STATES[min(turn, len(STATES) - 1)]
+        if rng.random() < 0.4:
+            session["customer_data"]["cart"].append({"nome": "NovoPhone X12", "preço": "3.499,00"})
+            session["total_value"] += 3499.0
+        yield session
+
+
+def run(save, db, sessions, turns, concurrency, seed, think_time):
+    """Executa as conversas em `concurrency` threads; retorna as latências de gravação (ms)."""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(indexes):
+        rng = random.Random(seed + indexes[0])
+        local = []
+        for index in indexes:
+            for session in _conversation(rng, index, turns):
+                start = time.perf_counter()
+                save(db, session)
+                local.append((time.perf_counter() - start) * 1000)
+                time.sleep(think_time)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(list(range(i, sessions, concurrency)),)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--commit-latency-ms", type=float, default=30.0)
+    parser.add_argument("--think-time-ms", type=float, default=5.0)
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    think_time = args.think_time_ms / 1000
+    sync_db = FakeFirestore(commit_latency=args.commit_latency_ms / 1000)
+    sync_latencies = run(save_session_to_firestore, sync_db, args.sessions, args.turns, args.concurrency, args.seed, think_time)
+
+    wb_db = FakeFirestore(commit_latency=args.commit_latency_ms / 1000)
+    write_behind.WRITE_BEHIND_ENABLED = True
+    queue = write_behind.get_write_behind_queue(wb_db)
+    queue.flush_interval = args.flush_interval
+    wb_latencies = run(write_behind.queue_session_save, wb_db, args.sessions, args.turns, args.concurrency, args.seed, think_time)
+    write_behind.flush_session_writes()
+    stats = write_behind.get_write_behind_stats()
+
+    print(f"{'modo':<14}{'commits/sessão':>16}{'docs gravados/sessão':>22}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for label, db, latencies in (("síncrono", sync_db, sync_latencies), ("write-behind", wb_db, wb_latencies)):
+        print(f"{label:<14}{db.batch_commits / args.sessions:>16.2f}{db.writes / args.sessions:>22.2f}"
+              f"{statistics.median(latencies):>10.2f}{_percentile(latencies, 0.99):>10.2f}")
+    print(f"\nwrite-behind: {stats['enqueued']} gravações enfileiradas, {stats['coalesced']} coalescidas, "
+          f"{stats['flushed']} sessões gravadas em {stats['flushes']} flushes (p95 do flush {stats['flush_p95_seconds'] * 1000:.1f} ms)")
+
+    def final_sessions(db):
+        return {doc.id: {k: v for k, v in doc.to_dict().items() if k != "timestamp_utc"} for doc in db.collection('sessions').stream()}
+
+    if final_sessions(sync_db) != final_sessions(wb_db) or load_dashboard_data(sync_db) != load_dashboard_data(wb_db):
+        print("DIVERGÊNCIA: estado final difere entre os dois modos.")
+        sys.exit(1)
+    print("OK: documentos de 'sessions' e contadores do dashboard idênticos nos dois modos.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""Configuração do gunicorn, carregada automaticamente de ./gunicorn.conf.py (ex.: `gunicorn app:app`).
+
+Com `preload_app`, o master importa o app uma única vez e os workers nascem por fork já com os
+módulos carregados. Nenhum cliente é criado no import: cada worker inicializa o Firebase e a sessão
+HTTP depois do fork e se aquece em `post_worker_init` (catálogo, prompt, conexões com os LLMs),
+antes de aceitar a primeira requisição. O aquecimento precisa caber no `timeout`
+do worker (30s por padrão).
+
+Cada worker atende `threads` requisições ao mesmo tempo (gthread): os turnos passam a maior parte
+do tempo esperando o LLM. O limite de chamadas simultâneas por modelo (utils/admission.py) vale por
+worker, então o total do container é (LLM_MAX_CONCURRENCY_PER_MODEL + HEDGE_RESERVED_SLOTS_PER_MODEL)
+x WEB_CONCURRENCY.
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def post_worker_init(worker):
+    from app import warm_up_app
+    warm_up_app()
@@ -0,0 +1,759 @@
+"""Substitutos em memória para serviços externos, usados só em benchmarks e testes (fora da imagem de produção)."""
+import bisect
+import copy
+import functools
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Direções de order_by, com os mesmos valores de firestore.Query.ASCENDING/DESCENDING.
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+
+def sample_latency(latency):
+    """`latency` pode ser um valor fixo em segundos ou uma função sem argumentos que sorteia um valor."""
+    return latency() if callable(latency) else latency
+
+
+def lognormal_latency(p50, p99, rng=random):
+    """Latências log-normais com a mediana e o p99 informados (segundos), como as de APIs de LLM e do Firestore."""
+    sigma = math.log(p99 / p50) / 2.326 if p99 > p50 > 0 else 0.0
+    mu = math.log(p50) if p50 > 0 else float("-inf")
+    return lambda: rng.lognormvariate(mu, sigma) if p50 > 0 else 0.0
+
+
+def scripted_latency(values):
+    """Latências roteirizadas: devolve os valores em sequência, recomeçando ao fim da lista."""
+    values = list(values)
+    lock = threading.Lock()
+    position = [0]
+
+    def next_latency():
+        with lock:
+            value = values[position[0] % len(values)]
+            position[0] += 1
+        return value
+    return next_latency
+
+
+class FakeFirestoreError(RuntimeError):
+    """Falha injetada num commit (equivalente a um ServiceUnavailable/DeadlineExceeded do Firestore)."""
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return _field_value(self._data, field)
+
+
+def _field_value(data, field):
+    value = data or {}
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection.id}/{self.id}"
+
+    def get(self):
+        self._collection._db._simulate_read()
+        with self._collection._db._lock:
+            data = self._collection._docs.get(self.id)
+            self._collection._db.reads += 1
+            return FakeDocumentSnapshot(self, copy.deepcopy(data))
+
+    def set(self, data, merge=False):
+        self._collection._write(self.id, data, merge=merge)
+
+    def update(self, data):
+        if self.id not in self._collection._docs:
+            raise KeyError(f"Documento inexistente: {self.path}")
+        self._collection._write(self.id, _expand_field_paths(data), merge=True)
+
+    def delete(self):
+        self._collection._delete(self.id)
+
+
+class FakeWatch:
+    def __init__(self, collection, callback):
+        self._collection = collection
+        self._callback = callback
+
+    def unsubscribe(self):
+        with self._collection._db._lock:
+            if self in self._collection._watches:
+                self._collection._watches.remove(self)
+
+
+class FakeQuery:
+    _OPERATORS = {
+        '==': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+        '<': lambda a, b: a is not None and a < b,
+        '<=': lambda a, b: a is not None and a <= b,
+        '>': lambda a, b: a is not None and a > b,
+        '>=': lambda a, b: a is not None and a >= b,
+        'in': lambda a, b: a in b,
+    }
+
+    def __init__(self, collection, filters=(), limit_count=None, fields=None, orders=(), cursor=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._limit = limit_count
+        self._fields = fields
+        self._orders = tuple(orders)
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        params = {"filters": self._filters, "limit_count": self._limit, "fields": self._fields,
+                  "orders": self._orders, "cursor": self._cursor}
+        params.update(changes)
+        return FakeQuery(self._collection, **params)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def order_by(self, field, direction=ASCENDING):
+        """Ordenação por `field`, crescente ou decrescente (`ASCENDING`/`DESCENDING`, como em firestore.Query).
+
+        Como no Firestore, o id do documento desempata na direção da última ordenação e
+        documentos sem o campo ficam de fora do resultado.
+        """
+        if direction not in (ASCENDING, DESCENDING):
+            raise ValueError(f"Direção de ordenação inválida: {direction!r}")
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def start_after(self, snapshot):
+        """Cursor: continua depois do documento `snapshot` (da página anterior), na ordem de `order_by`."""
+        if not self._orders:
+            raise ValueError("start_after exige order_by.")
+        return self._copy(cursor=(tuple(snapshot.get(field) for field, _ in self._orders), snapshot.id))
+
+    def _sort_key(self):
+        """Chave de ordenação de (valores, id) que respeita a direção de cada campo."""
+        descending = [direction == DESCENDING for _, direction in self._orders]
+        if not any(descending):
+            return lambda item: item
+
+        def compare(a, b):
+            for value_a, value_b, reverse in zip(a[0] + (a[1],), b[0] + (b[1],), descending + descending[-1:]):
+                if value_a != value_b:
+                    result = -1 if value_a < value_b else 1
+                    return -result if reverse else result
+            return 0
+        return functools.cmp_to_key(compare)
+
+    def _ordered_items(self):
+        """(id, dados) na ordem de `order_by`, a partir do cursor; o índice ordenado fica em cache até a próxima escrita."""
+        collection = self._collection
+        with collection._db._lock:
+            index = collection._order_indexes.get(self._orders)
+            sort_key = self._sort_key()
+            if index is None or index[0] != collection._version:
+                items = []
+                for doc_id, data in collection._docs.items():
+                    values = tuple(_field_value(data, field) for field, _ in self._orders)
+                    if None not in values:
+                        items.append((values, doc_id))
+                items.sort(key=sort_key)
+                index = (collection._version, [sort_key(item) for item in items], [doc_id for _, doc_id in items])
+                collection._order_indexes[self._orders] = index
+            _, keys, doc_ids = index
+            start = bisect.bisect_right(keys, sort_key(self._cursor)) if self._cursor is not None else 0
+            docs = collection._docs
+        for position in range(start, len(doc_ids)):
+            doc_id = doc_ids[position]
+            data = docs.get(doc_id)
+            if data is not None:
+                yield doc_id, data
+
+    def stream(self):
+        self._collection._db._simulate_read()
+        if self._orders:
+            items = self._ordered_items()
+        else:
+            with self._collection._db._lock:
+                items = list(self._collection._docs.items())
+        count = 0
+        for doc_id, data in items:
+            snapshot = FakeDocumentSnapshot(self._collection.document(doc_id), data)
+            if not all(self._OPERATORS[op](snapshot.get(field), value) for field, op, value in self._filters):
+                continue
+            if self._limit is not None and count >= self._limit:
+                break
+            count += 1
+            self._collection._db.reads += 1
+            if self._fields is not None:
+                data = {f: data[f] for f in self._fields if f in data}
+            yield FakeDocumentSnapshot(snapshot.reference, copy.deepcopy(data))
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db, name):
+        super().__init__(self)
+        self._db = db
+        self.id = name
+        self._docs = {}
+        self._watches = []
+        # Versão dos dados (muda a cada escrita) e índices ordenados por order_by, refeitos quando ela muda.
+        self._version = 0
+        self._order_indexes = {}
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self, doc_id or uuid.uuid4().hex)
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self, callback)
+        with self._db._lock:
+            self._watches.append(watch)
+        self._notify([watch])
+        return watch
+
+    def _write(self, doc_id, data, merge=False, notify=True):
+        with self._db._lock:
+            current = self._docs.get(doc_id) if merge else None
+            self._docs[doc_id] = _merge(copy.deepcopy(current) or {}, data)
+            self._version += 1
+            self._db.writes += 1
+            watches = list(self._watches)
+        if notify:
+            self._notify(watches)
+
+    def _delete(self, doc_id):
+        with self._db._lock:
+            self._docs.pop(doc_id, None)
+            self._version += 1
+            self._db.writes += 1
+            watches = list(self._watches)
+        self._notify(watches)
+
+    def _notify(self, watches):
+        if not watches:
+            return
+        with self._db._lock:
+            docs = [FakeDocumentSnapshot(self.document(doc_id), copy.deepcopy(data)) for doc_id, data in self._docs.items()]
+        for watch in watches:
+            watch._callback(docs, [], None)
+
+
+def _merge(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        elif isinstance(value, dict):
+            target[key] = _merge({}, value)
+        else:
+            target[key] = _apply_transform(target.get(key), value)
+    return target
+
+
+def _apply_transform(current, value):
+    """Aplica os sentinelas do Firestore (Increment, ArrayUnion, ArrayRemove) reconhecidos pelo nome da classe."""
+    kind = type(value).__name__
+    if kind == "Increment":
+        return (current or 0) + value.value
+    if kind == "ArrayUnion":
+        result = list(current or [])
+        result.extend(v for v in value.values if v not in result)
+        return result
+    if kind == "ArrayRemove":
+        return [v for v in (current or []) if v not in value.values]
+    return copy.deepcopy(value)
+
+
+def _expand_field_paths(data):
+    """Converte chaves "a.b" de `update()` em dicts aninhados, como o Firestore faz."""
+    expanded = {}
+    for key, value in data.items():
+        target = expanded
+        parts = key.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return expanded
+
+
+class FakeWriteBatch:
+    """Lote de escritas aplicado de uma só vez em `commit()` (limite de 500 operações, como no Firestore)."""
+
+    MAX_OPERATIONS = 500
+
+    def __init__(self, db):
+        self._db = db
+        self._operations = []
+
+    def __len__(self):
+        return len(self._operations)
+
+    def _add(self, operation):
+        if len(self._operations) >= self.MAX_OPERATIONS:
+            raise ValueError("Um lote do Firestore aceita no máximo 500 operações.")
+        self._operations.append(operation)
+
+    def set(self, reference, data, merge=False):
+        self._add(("set", reference, copy.deepcopy(data), merge))
+
+    def update(self, reference, data):
+        self._add(("update", reference, copy.deepcopy(data), True))
+
+    def delete(self, reference):
+        self._add(("delete", reference, None, False))
+
+    def commit(self):
+        latency = sample_latency(self._db.commit_latency)
+        if latency:
+            time.sleep(latency)
+        if self._db.error_rate and random.random() < self._db.error_rate:
+            raise FakeFirestoreError("Falha simulada no commit do lote.")
+        touched = set()
+        with self._db._lock:
+            for kind, reference, data, merge in self._operations:
+                collection = reference._collection
+                if kind == "delete":
+                    collection._docs.pop(reference.id, None)
+                    collection._version += 1
+                    self._db.writes += 1
+                else:
+                    if kind == "update":
+                        data = _expand_field_paths(data)
+                    collection._write(reference.id, data, merge=merge, notify=False)
+                touched.add(collection)
+            self._db.batch_commits += 1
+        for collection in touched:
+            collection._notify(list(collection._watches))
+        self._operations = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Transação com trava pessimista por documento, como nos SDKs de servidor do Firestore.
+
+    Os documentos lidos em `get_all` ficam travados (em ordem de caminho, sem deadlock entre
+    transações) até `_commit`/`_rollback`: outra transação que leia o mesmo documento espera,
+    enquanto transações sobre documentos diferentes seguem em paralelo. As travas são
+    reentrantes, então corrotinas no mesmo event loop não se bloqueiam entre si.
+    Implementa o protocolo que `firestore.transactional` usa para rodar a função decorada.
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._id = None
+        self._held = []
+
+    def _clean_up(self):
+        self._operations = []
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+
+    def get_all(self, references):
+        for path in sorted({reference.path for reference in references} - {path for path, _ in self._held}):
+            lock = self._db._document_lock(path)
+            lock.acquire()
+            self._held.append((path, lock))
+        return [reference.get() for reference in references]
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._release()
+
+    def _rollback(self):
+        self._operations = []
+        self._release()
+
+    def _release(self):
+        self._id = None
+        while self._held:
+            self._held.pop()[1].release()
+
+
+class FakeFirestore:
+    """Implementação mínima do cliente do Firestore (coleções, documentos, consultas e listeners).
+
+    Conta leituras e escritas em `reads`/`writes` para medir o custo de cada fluxo;
+    `commit_latency` e `read_latency` (valores fixos ou distribuições, ver
+    `lognormal_latency`) simulam o tempo de ida e volta de cada commit de lote e de
+    cada leitura; `error_rate` faz uma fração dos commits falhar com FakeFirestoreError.
+    """
+
+    def __init__(self, commit_latency=0.0, read_latency=0.0, error_rate=0.0):
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._document_locks = {}
+        self.commit_latency = commit_latency
+        self.read_latency = read_latency
+        self.error_rate = error_rate
+        self.reads = 0
+        self.writes = 0
+        self.batch_commits = 0
+
+    def collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollectionReference(self, name)
+            return self._collections[name]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def _document_lock(self, path):
+        """Trava usada pelas transações que leem o documento `path`."""
+        with self._lock:
+            return self._document_locks.setdefault(path, threading.RLock())
+
+    def _simulate_read(self):
+        latency = sample_latency(self.read_latency)
+        if latency:
+            time.sleep(latency)
+
+    def reset_counters(self):
+        self.reads = 0
+        self.writes = 0
+        self.batch_commits = 0
+
+
+class _FakeAsyncDocumentReference:
+    def __init__(self, document):
+        self._document = document
+        self.id = document.id
+
+    async def get(self):
+        return self._document.get()
+
+    async def set(self, data, merge=False):
+        self._document.set(data, merge=merge)
+
+    async def update(self, data):
+        self._document.update(data)
+
+    async def delete(self):
+        self._document.delete()
+
+
+class _FakeAsyncCollectionReference:
+    def __init__(self, collection):
+        self._collection = collection
+        self.id = collection.id
+
+    def document(self, doc_id=None):
+        return _FakeAsyncDocumentReference(self._collection.document(doc_id))
+
+
+class _FakeAsyncWriteBatch:
+    def __init__(self, batch):
+        self._batch = batch
+
+    def set(self, reference, data, merge=False):
+        self._batch.set(reference._document, data, merge=merge)
+
+    def update(self, reference, data):
+        self._batch.update(reference._document, data)
+
+    def delete(self, reference):
+        self._batch.delete(reference._document)
+
+    async def commit(self):
+        self._batch.commit()
+
+
+class _FakeAsyncTransaction:
+    _read_only = False
+    _max_attempts = FakeTransaction._max_attempts
+
+    def __init__(self, client, transaction):
+        self._client = client
+        self._transaction = transaction
+
+    @property
+    def _id(self):
+        return self._transaction._id
+
+    def _clean_up(self):
+        self._transaction._clean_up()
+
+    async def _begin(self, retry_id=None):
+        self._transaction._begin(retry_id)
+
+    async def get_all(self, references):
+        # Como no SDK real: aguarda `AsyncClient.get_all`, que é um gerador assíncrono, e falha com TypeError.
+        return await self._client.get_all(references, transaction=self)
+
+    def set(self, reference, data, merge=False):
+        self._transaction.set(reference._document, data, merge=merge)
+
+    async def _commit(self):
+        self._transaction._commit()
+
+    async def _rollback(self):
+        self._transaction._rollback()
+
+
+class FakeAsyncFirestore:
+    """Fachada assíncrona (`firestore_async.client()`) sobre os mesmos dados de um FakeFirestore."""
+
+    def __init__(self, sync_db=None):
+        self.sync_db = sync_db or FakeFirestore()
+
+    def collection(self, name):
+        return _FakeAsyncCollectionReference(self.sync_db.collection(name))
+
+    def batch(self):
+        return _FakeAsyncWriteBatch(self.sync_db.batch())
+
+    def transaction(self):
+        return _FakeAsyncTransaction(self, self.sync_db.transaction())
+
+    async def get_all(self, references, transaction=None):
+        documents = [reference._document for reference in references]
+        snapshots = transaction._transaction.get_all(documents) if transaction else [document.get() for document in documents]
+        for snapshot in snapshots:
+            yield snapshot
+
+
+DEFAULT_FAKE_LLM_RESPONSE = json.dumps({
+    "chat_state": "ajuda_na_escolha",
+    "resposta": "Temos o NovoPhone X12 por R$ 3.499,00. Gostaria de adicioná-lo ao carrinho?",
+    "product_selected_for_cart": {"nome": "NovoPhone X12", "preço": "3.499,00"},
+    "cart": [],
+    "total_value": "0,00",
+    "customer_data": {"name": None, "email": None, "phone": None},
+    "last_input_invalid": False
+}, ensure_ascii=False)
+
+
+class _FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        server = self.server.fake
+        with server._lock:
+            server.connections_opened += 1
+        # Custo de abrir uma conexão nova (handshake TCP/TLS com o provedor real).
+        time.sleep(sample_latency(server.connect_latency))
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        server = self.server.fake
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+        model = body.get("model", "gemini")
+        with server._lock:
+            server.requests_served += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            over_quota = server.max_concurrent_per_model is not None and server.model_in_flight.get(model, 0) >= server.max_concurrent_per_model
+            if over_quota:
+                server.quota_rejections += 1
+            else:
+                server.model_in_flight[model] = server.model_in_flight.get(model, 0) + 1
+        try:
+            if over_quota:
+                # Cota do provedor (como o plano gratuito do OpenRouter): 429 sem processar o pedido.
+                self._json({"error": {"code": 429, "message": "Rate limit exceeded"}}, status=429)
+                return
+            fault = server._next_fault()
+            if fault is not None:
+                self._fault(*fault)
+                return
+            self._respond(server, body)
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+                if not over_quota:
+                    server.model_in_flight[model] -= 1
+
+    def _respond(self, server, body):
+        text = server.response_text
+        chunks = [text[i:i + server.chunk_size] for i in range(0, len(text), server.chunk_size)]
+        time.sleep(sample_latency(server.model_latency.get(body.get("model"), server.latency)))
+        # Contagem aproximada (4 caracteres por token), só para os provedores reportarem uso.
+        prompt_tokens, completion_tokens = len(json.dumps(body)) // 4, len(text) // 4
+        gemini_usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": completion_tokens}
+        openrouter_usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+        if ':streamGenerateContent' in self.path:
+            self._stream([{"candidates": [{"content": {"parts": [{"text": c}], "role": "model"}}], "usageMetadata": gemini_usage} for c in chunks], done_marker=False)
+        elif ':generateContent' in self.path:
+            self._json({"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}], "usageMetadata": gemini_usage})
+        elif self.path.endswith('/chat/completions') and body.get("stream"):
+            events = [{"model": body.get("model"), "choices": [{"delta": {"content": c}}]} for c in chunks]
+            events.append({"model": body.get("model"), "choices": [], "usage": openrouter_usage})
+            self._stream(events, done_marker=True)
+        elif self.path.endswith('/chat/completions'):
+            self._json({"model": body.get("model"), "choices": [{"message": {"role": "assistant", "content": text}}], "usage": openrouter_usage})
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def _fault(self, status, retry_after):
+        if status == "reset":
+            # Fecha o socket sem resposta, simulando queda de conexão.
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+        self._json({"error": {"code": status, "message": "falha injetada"}}, status=status, headers=headers)
+
+    def _json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, events, done_marker):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(self.server.fake.chunk_delay)
+            if done_marker:
+                self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # O cliente fechou a conexão no meio do stream (ex.: tentativa perdedora do hedging).
+            with self.server.fake._lock:
+                self.server.fake.streams_cancelled += 1
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeLLMServer:
+    """Servidor HTTP local que imita as APIs do Gemini e do OpenRouter com respostas fixas.
+
+    Suporta `generateContent`, `streamGenerateContent?alt=sse` e `chat/completions`
+    (com e sem `stream: true`), dividindo `response_text` em pedaços de
+    `chunk_size` caracteres separados por `chunk_delay` segundos. `latency` é fixa ou
+    uma distribuição (ver `lognormal_latency` e `scripted_latency`), e `model_latency`
+    a substitui por modelo do OpenRouter. `connect_latency` é o custo de cada conexão
+    nova. Falhas podem ser injetadas de forma roteirizada (`inject_faults`) ou
+    aleatória (`error_rate`), e `max_concurrent_per_model` impõe uma cota de requisições
+    simultâneas por modelo, respondendo 429 acima dela.
+    """
+
+    def __init__(self, response_text=DEFAULT_FAKE_LLM_RESPONSE, chunk_size=8, chunk_delay=0.0, latency=0.0,
+                 error_rate=0.0, error_status=503, model_latency=None, connect_latency=0.0, max_concurrent_per_model=None):
+        self.response_text = response_text
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.latency = latency
+        self.model_latency = dict(model_latency or {})
+        self.connect_latency = connect_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._faults = []
+        self.requests_served = 0
+        self.streams_cancelled = 0
+        self.connections_opened = 0
+        self.max_concurrent_per_model = max_concurrent_per_model
+        self.model_in_flight = {}
+        self.quota_rejections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    def inject_faults(self, *statuses, retry_after=None):
+        """Enfileira falhas para as próximas requisições (status HTTP ou "reset" para derrubar a conexão)."""
+        with self._lock:
+            self._faults.extend((status, retry_after) for status in statuses)
+
+    def _next_fault(self):
+        with self._lock:
+            if self._faults:
+                return self._faults.pop(0)
+        if self.error_rate and random.random() < self.error_rate:
+            return (self.error_status, None)
+        return None
+
+    def start(self):
+        self._httpd = _FakeHTTPServer(("127.0.0.1", 0), _FakeLLMHandler)
+        self._httpd.fake = self
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def gemini_url(self):
+        return f"{self.base_url}/v1beta/models/fake:generateContent?key=fake"
+
+    @property
+    def gemini_stream_url(self):
+        return f"{self.base_url}/v1beta/models/fake:streamGenerateContent?alt=sse&key=fake"
+
+    @property
+    def openrouter_url(self):
+        return f"{self.base_url}/api/v1/chat/completions"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
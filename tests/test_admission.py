@@ -0,0 +1,321 @@
+import asyncio
+import threading
+import time
+
+import fakeredis
+import pytest
+
+import utils.admission as admission
+from utils.admission import (
+    AdmissionRejected, AsyncFairGate, FairGate, RedisSessionRateLimiter, SessionRateLimiter,
+    SQLiteSessionRateLimiter, create_session_rate_limiter
+)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_limiter(request, tmp_path):
+    """Fábrica de limitadores (1 turno/min, burst 2); no sqlite e no redis todos usam o mesmo armazenamento."""
+    server = fakeredis.FakeServer()
+
+    def make():
+        if request.param == "sqlite":
+            return SQLiteSessionRateLimiter(1, 2, str(tmp_path / "sessions.sqlite3"))
+        if request.param == "redis":
+            return RedisSessionRateLimiter(1, 2, client=fakeredis.FakeStrictRedis(server=server))
+        return SessionRateLimiter(1, 2)
+    make.backend = request.param
+    return make
+
+
+def test_limiter_allows_burst_then_rejects(make_limiter):
+    limiter = make_limiter()
+    limiter.check("a", "m")
+    limiter.check("a", "m")
+    with pytest.raises(AdmissionRejected) as e:
+        limiter.check("a", "m")
+    assert e.value.reason == "session_rate"
+    assert 1 <= e.value.retry_after <= 60
+    # Outra sessão tem o próprio bucket.
+    limiter.check("b", "m")
+
+
+def test_limiter_refund_returns_token(make_limiter):
+    limiter = make_limiter()
+    limiter.check("a", "m")
+    limiter.check("a", "m")
+    limiter.refund("a")
+    limiter.check("a", "m")
+    with pytest.raises(AdmissionRejected):
+        limiter.check("a", "m")
+
+
+def test_refund_never_exceeds_burst(make_limiter):
+    limiter = make_limiter()
+    limiter.check("a", "m")
+    for _ in range(3):
+        limiter.refund("a")
+    limiter.check("a", "m")
+    limiter.check("a", "m")
+    with pytest.raises(AdmissionRejected):
+        limiter.check("a", "m")
+
+
+def test_shared_backends_limit_across_workers(make_limiter):
+    if make_limiter.backend == "memory":
+        pytest.skip("buckets em memória são por processo")
+    # Dois limitadores no mesmo armazenamento fazem o papel de dois workers do gunicorn.
+    worker_1, worker_2 = make_limiter(), make_limiter()
+    worker_1.check("a", "m")
+    worker_2.check("a", "m")
+    with pytest.raises(AdmissionRejected):
+        worker_1.check("a", "m")
+    with pytest.raises(AdmissionRejected):
+        worker_2.check("a", "m")
+
+
+def test_sqlite_limiter_is_atomic_across_threads(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    limiters = [SQLiteSessionRateLimiter(1, 5, path) for _ in range(4)]
+    admitted = []
+
+    def burst(limiter):
+        for _ in range(5):
+            try:
+                limiter.check("a", "m")
+                admitted.append(1)
+            except AdmissionRejected:
+                pass
+
+    threads = [threading.Thread(target=burst, args=(limiter,)) for limiter in limiters]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(admitted) == 5
+
+
+def test_create_session_rate_limiter_follows_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(admission, "SESSION_SQLITE_PATH", str(tmp_path / "sessions.sqlite3"))
+    assert isinstance(create_session_rate_limiter("sqlite"), SQLiteSessionRateLimiter)
+    assert type(create_session_rate_limiter("memory")) is SessionRateLimiter
+    assert type(create_session_rate_limiter("cookie")) is SessionRateLimiter
+    monkeypatch.setattr(admission, "SESSION_BACKEND", "sqlite")
+    assert isinstance(create_session_rate_limiter(), SQLiteSessionRateLimiter)
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condição não atingida"
+        time.sleep(0.005)
+
+
+def test_gate_serves_sessions_round_robin():
+    gate = FairGate("m", limit=1, max_queue=10)
+    gate.acquire("holder", time.monotonic() + 5)
+    order = []
+
+    def turn(session_uuid):
+        gate.acquire(session_uuid, time.monotonic() + 5)
+        order.append(session_uuid)
+        gate.release()
+
+    threads = []
+    # A sessão "a" enfileira três turnos antes de "b" e "c" chegarem.
+    for session_uuid in ("a", "a", "a", "b", "c"):
+        thread = threading.Thread(target=turn, args=(session_uuid,))
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: gate.waiting == len(threads))
+    gate.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["a", "b", "c", "a", "a"]
+    assert gate.active == 0 and gate.waiting == 0
+
+
+def test_gate_rejects_when_queue_full():
+    gate = FairGate("m", limit=1, max_queue=0)
+    gate.acquire("a", time.monotonic() + 5)
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejected) as e:
+        gate.acquire("b", time.monotonic() + 5)
+    assert e.value.reason == "queue_full"
+    assert time.monotonic() - start < 0.1
+
+
+def test_gate_times_out_and_leaves_queue():
+    gate = FairGate("m", limit=1, max_queue=5)
+    gate.acquire("a", time.monotonic() + 5)
+    with pytest.raises(AdmissionRejected) as e:
+        gate.acquire("b", time.monotonic() + 0.05)
+    assert e.value.reason == "timeout"
+    assert gate.waiting == 0 and not gate._queues
+    gate.release()
+    assert gate.active == 0
+
+
+def test_async_gate_serves_sessions_round_robin_on_one_thread():
+    async def run():
+        gate = AsyncFairGate("m", limit=1, max_queue=10)
+        await gate.acquire("holder", time.monotonic() + 5)
+        order, threads = [], set()
+
+        async def turn(session_uuid):
+            await gate.acquire(session_uuid, time.monotonic() + 5)
+            order.append(session_uuid)
+            threads.add(threading.get_ident())
+            gate.release()
+
+        tasks = []
+        for session_uuid in ("a", "a", "a", "b", "c"):
+            tasks.append(asyncio.create_task(turn(session_uuid)))
+            await asyncio.sleep(0)
+        assert gate.waiting == 5
+        gate.release()
+        await asyncio.gather(*tasks)
+        return gate, order, threads
+
+    gate, order, threads = asyncio.run(run())
+    assert order == ["a", "b", "c", "a", "a"]
+    # Ninguém esperou numa thread do executor.
+    assert threads == {threading.get_ident()}
+    assert gate.active == 0 and gate.waiting == 0
+
+
+def test_async_gate_times_out_and_leaves_queue():
+    async def run():
+        gate = AsyncFairGate("m", limit=1, max_queue=5)
+        await gate.acquire("a", time.monotonic() + 5)
+        with pytest.raises(AdmissionRejected) as e:
+            await gate.acquire("b", time.monotonic() + 0.05)
+        assert e.value.reason == "timeout"
+        assert gate.waiting == 0 and not gate._queues
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_async_gate_cancelled_waiter_leaves_queue():
+    async def run():
+        gate = AsyncFairGate("m", limit=1, max_queue=5)
+        await gate.acquire("a", time.monotonic() + 5)
+        task = asyncio.create_task(gate.acquire("b", time.monotonic() + 5))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert gate.waiting == 0 and not gate._queues
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_async_admit_deadline_counts_from_arrival(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL_ENABLED", True)
+    monkeypatch.setattr(admission, "SESSION_BACKEND", "memory")
+    monkeypatch.setattr(admission, "ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL", 1)
+    admission.reset_admission()
+
+    async def run():
+        holder = await admission.async_admit("holder", "m")
+        start = time.monotonic()
+        results = await asyncio.gather(*(admission.async_admit(f"s{i}", "m", timeout=0.1) for i in range(20)),
+                                       return_exceptions=True)
+        elapsed = time.monotonic() - start
+        holder.release()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(run())
+    assert all(isinstance(r, AdmissionRejected) and r.reason == "timeout" for r in results)
+    # Os 20 turnos esperaram juntos, não um atrás do outro no executor.
+    assert elapsed < 1.0
+    admission.reset_admission()
+
+
+@pytest.fixture
+def admission_on(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL_ENABLED", True)
+    monkeypatch.setattr(admission, "SESSION_BACKEND", "memory")
+    monkeypatch.setattr(admission, "SESSION_RATE_LIMIT_PER_MINUTE", 1)
+    monkeypatch.setattr(admission, "SESSION_RATE_LIMIT_BURST", 1)
+    monkeypatch.setattr(admission, "LLM_MAX_CONCURRENCY_PER_MODEL", 1)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_QUEUE", 0)
+    admission.reset_admission()
+    yield
+    admission.reset_admission()
+
+
+def test_admit_refunds_token_when_shed_for_queue_full(admission_on):
+    holder = admission.admit("other", "m")
+    with pytest.raises(AdmissionRejected) as e:
+        admission.admit("a", "m")
+    assert e.value.reason == "queue_full"
+    holder.release()
+    # A ficha de "a" voltou: o próximo turno é atendido em vez de receber 429.
+    with admission.admit("a", "m"):
+        pass
+    with pytest.raises(AdmissionRejected) as e:
+        admission.admit("a", "m")
+    assert e.value.reason == "session_rate"
+
+
+def test_admit_disabled_returns_noop_slot(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL_ENABLED", False)
+    slot = admission.admit("a", "m")
+    assert slot.gate is None
+    slot.release()
+
+
+def test_try_acquire_falls_back_to_reserved_slots():
+    gate = FairGate("m", limit=1, max_queue=5, reserved=1)
+    assert gate.try_acquire() == "normal"
+    assert gate.try_acquire() == "reserved"
+    assert gate.try_acquire() is None
+    gate.release(reserved=True)
+    assert gate.reserved_active == 0 and gate.active == 1
+
+
+def test_reserved_slots_are_not_used_by_queued_turns(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL_ENABLED", True)
+    monkeypatch.setattr(admission, "LLM_MAX_CONCURRENCY_PER_MODEL", 1)
+    monkeypatch.setattr(admission, "HEDGE_RESERVED_SLOTS_PER_MODEL", 1)
+    admission.reset_admission()
+    gate = admission.get_gate("m")
+    gate.acquire("a", time.monotonic() + 5)
+    # A reserva do hedging sai mesmo com o slot normal ocupado...
+    backup = admission.try_admit("m")
+    assert backup is not None and backup.reserved
+    # ...mas um turno comum não passa na frente: ainda espera o slot normal.
+    with pytest.raises(AdmissionRejected) as e:
+        gate.acquire("b", time.monotonic() + 0.05)
+    assert e.value.reason == "timeout"
+    backup.release()
+    assert admission.try_admit("m").reserved
+    gate.release()
+    admission.reset_admission()
+
+
+def test_stream_turn_that_fails_before_streaming_releases_its_slot(monkeypatch):
+    import app as flask_app_module
+    from testing.fakes import FakeFirestore
+    from utils.firebase import seed_initial_products
+    from utils.session_store import MemorySessionStore, ServerSideSessionInterface
+    db = FakeFirestore()
+    seed_initial_products(db)
+    monkeypatch.setattr(flask_app_module.app, "session_interface", ServerSideSessionInterface(MemorySessionStore()))
+    monkeypatch.setattr(flask_app_module, "db", db)
+    monkeypatch.setattr(flask_app_module, "AB_TEST_ENABLED", False)
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL_ENABLED", True)
+    admission.reset_admission()
+
+    def broken_prompt(db):
+        raise RuntimeError("prompt indisponível")
+    monkeypatch.setattr(flask_app_module, "get_base_system_prompt", broken_prompt)
+    client = flask_app_module.app.test_client()
+    client.post("/initialize_chat")
+    assert client.post("/send_message_stream", json={"user_input": "quais celulares vocês têm?"}).status_code == 500
+    assert admission.get_gate(admission.GEMINI_MODEL_LABEL).active == 0
+    admission.reset_admission()
@@ -0,0 +1,201 @@
+import asyncio
+import importlib
+import threading
+
+import firebase_admin
+import pytest
+
+import async_app
+import utils.admission as admission
+from utils.admission import AdmissionRejected
+from utils.catalog import invalidate_catalog_cache
+from utils.session_store import HISTORY_KEY, MemorySessionStore, loads
+from testing.fakes import FakeAsyncFirestore, FakeFirestore
+from utils.firebase import seed_initial_products
+
+
+class RecordingFirestore(FakeFirestore):
+    """Firestore em memória que anota em que thread a coleção 'products' foi lida."""
+
+    def __init__(self):
+        super().__init__()
+        self.product_reads = []
+
+    def collection(self, name):
+        if name == 'products':
+            self.product_reads.append(threading.get_ident())
+        return super().collection(name)
+
+
+@pytest.fixture
+def catalog_db(monkeypatch):
+    db = RecordingFirestore()
+    seed_initial_products(db)
+    db.product_reads.clear()
+    invalidate_catalog_cache()
+    monkeypatch.setattr(async_app, "db", None)
+    monkeypatch.setattr(async_app, "async_db", None)
+    yield db
+    invalidate_catalog_cache()
+
+
+def test_import_does_not_initialize_firebase(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Firebase inicializado no import")
+    monkeypatch.setattr(firebase_admin, "initialize_app", fail)
+    module = importlib.reload(async_app)
+    assert module.db is None and module.async_db is None
+
+
+def test_before_serving_connects_off_event_loop(monkeypatch, catalog_db):
+    connect_threads = []
+
+    def connect():
+        connect_threads.append(threading.get_ident())
+        return catalog_db, FakeAsyncFirestore(catalog_db)
+    monkeypatch.setattr(async_app, "connect_firestore", connect)
+
+    async def serve():
+        await async_app.start_up()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(serve())
+    assert async_app.db is catalog_db
+    assert connect_threads and connect_threads[0] != loop_thread
+    # O catálogo do aquecimento também foi lido fora do event loop.
+    assert catalog_db.product_reads and loop_thread not in catalog_db.product_reads
+
+
+def test_before_serving_keeps_injected_clients(monkeypatch, catalog_db):
+    monkeypatch.setattr(async_app, "db", catalog_db)
+    monkeypatch.setattr(async_app, "async_db", FakeAsyncFirestore(catalog_db))
+    monkeypatch.setattr(async_app, "connect_firestore", lambda: pytest.fail("clientes recriados"))
+    asyncio.run(async_app.start_up())
+    assert async_app.db is catalog_db
+
+
+def test_failed_connection_leaves_worker_without_db(monkeypatch, catalog_db):
+    monkeypatch.setattr(async_app, "connect_firestore", lambda: (None, None))
+    asyncio.run(async_app.start_up())
+    assert async_app.db is None and async_app.async_db is None
+
+
+def test_cold_catalog_is_loaded_in_executor(catalog_db):
+    async def load():
+        return await async_app.load_product_index(catalog_db), threading.get_ident()
+
+    index, loop_thread = asyncio.run(load())
+    assert index is not None
+    assert catalog_db.product_reads and loop_thread not in catalog_db.product_reads
+
+    # Com o catálogo em cache, nenhuma leitura nova (nem ida ao executor).
+    reads = len(catalog_db.product_reads)
+    asyncio.run(async_app.load_product_index(catalog_db))
+    assert len(catalog_db.product_reads) == reads
+
+
+@pytest.fixture
+def chat_app(monkeypatch, catalog_db):
+    store = MemorySessionStore()
+    monkeypatch.setattr(async_app.app, "session_interface", async_app.AsyncServerSideSessionInterface(store))
+    monkeypatch.setattr(async_app, "db", catalog_db)
+    monkeypatch.setattr(async_app, "async_db", FakeAsyncFirestore(catalog_db))
+    monkeypatch.setattr(async_app, "AB_TEST_ENABLED", False)
+
+    async def fake_gemini(history):
+        return '{"chat_state": "ajuda_na_escolha", "resposta": "Temos o NovoPhone X."}'
+    monkeypatch.setattr(async_app, "async_call_gemini_api", fake_gemini)
+    admission.reset_admission()
+    yield store
+    admission.reset_admission()
+
+
+def _converse(*messages):
+    async def run():
+        client = async_app.app.test_client()
+        await client.post("/initialize_chat")
+        responses = []
+        for text in messages:
+            response = await client.post("/send_message", json={"user_input": text})
+            responses.append((response.status_code, response.headers, await response.get_json()))
+        return responses, {cookie.name: cookie.value for cookie in client.cookie_jar}
+    return asyncio.run(run())
+
+
+def test_transcript_stays_on_the_server(chat_app):
+    (status, _, body), = _converse("quais celulares vocês têm?")[0]
+    assert status == 200 and body["bot_response"] == "Temos o NovoPhone X."
+    (session_uuid, (state_blob, history_blobs)), = [(uuid, chat_app.load(uuid)) for uuid in chat_app._data]
+    assert loads(state_blob)["session_uuid"] == session_uuid
+    assert [loads(blob)["role"] for blob in history_blobs][-2:] == ["user", "model"]
+    assert HISTORY_KEY not in loads(state_blob)
+
+
+def test_cookie_carries_only_the_session_id(chat_app):
+    _, cookie = _converse("quais celulares vocês têm?", "e notebooks?")
+    value, = cookie.values()
+    # Só o session_uuid assinado: o tamanho não cresce com a conversa.
+    assert len(value) < 100
+
+
+def test_turn_is_saved_through_the_async_firestore_client(chat_app):
+    _converse("quais celulares vocês têm?")
+    saved = [doc.to_dict() for doc in async_app.db.collection('sessions').stream()]
+    assert len(saved) == 1 and saved[0]["final_state"] == "ajuda_na_escolha"
+
+
+def test_empty_message_is_rejected(chat_app):
+    (status, _, body), = _converse("   ")[0]
+    assert status == 400 and body["bot_response"] == "Por favor, diga algo."
+
+
+def test_rejected_turn_gets_busy_response_without_the_user_message(chat_app, monkeypatch):
+    async def reject(session_uuid, model, timeout=None):
+        raise AdmissionRejected("queue_full", model, 3)
+    monkeypatch.setattr(async_app, "async_admit", reject)
+    (status, headers, body), = _converse("quais celulares vocês têm?")[0]
+    assert status == 503 and headers["Retry-After"] == "3"
+    assert body["retry_after"] == 3
+    (_, history_blobs), = [chat_app.load(uuid) for uuid in chat_app._data]
+    assert all(loads(blob)["role"] != "user" for blob in history_blobs)
+
+
+def test_llm_turn_holds_a_slot_until_it_answers(chat_app, monkeypatch):
+    gate = admission.get_async_gate(admission.GEMINI_MODEL_LABEL)
+    seen = []
+
+    async def fake_gemini(history):
+        seen.append(gate.active)
+        return '{"chat_state": "ajuda_na_escolha", "resposta": "Oi!"}'
+    monkeypatch.setattr(async_app, "async_call_gemini_api", fake_gemini)
+    _converse("quais celulares vocês têm?")
+    assert seen == [1] and gate.active == 0
+
+
+def test_turn_for_a_session_gone_from_the_backend_restarts_the_chat(chat_app):
+    async def run():
+        client = async_app.app.test_client()
+        await client.post("/initialize_chat")
+        chat_app._data.clear()
+        response = await client.post("/send_message", json={"user_input": "quais celulares vocês têm?"})
+        return response.status_code, await response.get_json()
+
+    status, body = asyncio.run(run())
+    assert status == 409 and body["bot_response"].startswith("Sua conversa anterior expirou")
+    assert len(chat_app._data) == 1
+
+
+def test_cache_hit_skips_admission(chat_app, monkeypatch):
+    from utils import response_cache
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "AB_TEST_ENABLED", False)
+    response_cache.clear_response_cache()
+    (status, _, _), = _converse("quais celulares vocês têm?")[0]
+    assert status == 200
+
+    async def saturated(session_uuid, model, timeout=None):
+        raise AssertionError("admissão chamada num acerto do cache")
+    monkeypatch.setattr(async_app, "async_admit", saturated)
+    (status, _, body), = _converse("quais celulares vocês têm?")[0]
+    assert status == 200 and body["bot_response"] == "Temos o NovoPhone X."
+    response_cache.clear_response_cache()
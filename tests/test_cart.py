@@ -0,0 +1,78 @@
+import pytest
+
+from utils.cart import ProductIndex, cart_item, match_cart_intent
+from utils.constants import DEFAULT_PRODUCTS_SEED
+
+
+@pytest.fixture(scope="module")
+def index():
+    return ProductIndex(DEFAULT_PRODUCTS_SEED)
+
+
+def _session(index, cart=("p1",), state="ajuda_na_escolha", selected=None):
+    return {"chat_state": state, "customer_data": {"cart": [cart_item(index.by_id[p]) for p in cart], "product_selected_for_cart": selected}}
+
+
+@pytest.mark.parametrize("text, intent, product_id", [
+    ("adicionar o NovoPhone X12", "add", "p1"),
+    ("adiciona também o fone SoundBuds", "add", "p5"),
+    ("coloca o tablet no carrinho", "add", "p4"),
+    ("quero levar o GameBox", "add", "p8"),
+    ("na verdade remover o TabMaster", "remove", "p4"),
+    ("Retira o NovoPhone, por favor", "remove", "p1"),
+    ("finalizar a compra", "checkout", None),
+    ("Quero fechar o pedido!", "checkout", None),
+    ("qual o total?", "total", None),
+    ("ver o carrinho", "total", None),
+])
+def test_direct_requests_are_resolved_locally(index, text, intent, product_id):
+    match = match_cart_intent(_session(index), text, index)
+    assert match is not None
+    assert match[0] == intent
+    assert (match[1]["id"] if match[1] else None) == product_id
+
+
+@pytest.mark.parametrize("text", [
+    "o NovoPhone X12 inclui carregador?",
+    "o novophone inclui carregador",
+    "tira uma dúvida: o novophone é bom?",
+    "tira uma duvida, o novophone e bom",
+    "bota fé que o tablet é bom?",
+    "o GameBox vem com controle? se vier vou levar",
+    "se o TabMaster vier com capa eu vou levar",
+    "posso pagar em 12x?",
+    "Posso pagar no boleto?",
+    "pagar",
+    "dá pra colocar película no NovoPhone?",
+    "adicionar o NovoPhone?",
+    "não quero adicionar o NovoPhone",
+    "fechar",
+])
+def test_questions_and_loose_mentions_go_to_the_llm(index, text):
+    assert match_cart_intent(_session(index), text, index) is None
+
+
+def test_ambiguous_or_unknown_product_goes_to_the_llm(index):
+    assert match_cart_intent(_session(index), "adicionar o TimeWatch S2 e o TabMaster 10", index) is None
+    assert match_cart_intent(_session(index), "adicionar uma geladeira", index) is None
+
+
+def test_checkout_needs_a_non_empty_cart(index):
+    assert match_cart_intent(_session(index, cart=()), "finalizar a compra", index) is None
+
+
+def test_confirmation_adds_the_offered_product(index):
+    offered = {"nome": "TimeWatch S2", "preço": "1.299,00"}
+    assert match_cart_intent(_session(index, selected=offered), "sim", index) == ("add", index.by_id["p3"])
+    assert match_cart_intent(_session(index), "sim", index) is None
+
+
+def test_confirmation_of_a_product_already_in_the_cart_goes_to_the_llm(index):
+    # O LLM já adicionou o NovoPhone e o schema repete product_selected_for_cart: um "ok" não o duplica.
+    offered = {"nome": "NovoPhone X12", "preço": "3.499,00"}
+    for text in ("ok", "sim"):
+        assert match_cart_intent(_session(index, cart=("p1",), selected=offered), text, index) is None
+
+
+def test_cart_is_frozen_while_collecting_customer_data(index):
+    assert match_cart_intent(_session(index, state="AWAITING_EMAIL"), "remover o NovoPhone", index) is None
@@ -0,0 +1,62 @@
+import pytest
+
+import utils.catalog as catalog
+from testing.fakes import FakeFirestore, FakeFirestoreError
+from utils.firebase import seed_initial_products
+
+
+class FlakyFirestore(FakeFirestore):
+    """Firestore em memória cujas leituras falham enquanto `failing` estiver ligado."""
+
+    failing = False
+
+    def _simulate_read(self):
+        if self.failing:
+            raise FakeFirestoreError("leitura indisponível")
+        super()._simulate_read()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(catalog, "CATALOG_SNAPSHOT_LISTENER_ENABLED", False)
+    catalog.invalidate_catalog_cache()
+    db = FlakyFirestore()
+    seed_initial_products(db)
+    yield db
+    catalog.invalidate_catalog_cache()
+
+
+def test_failed_refresh_keeps_previous_catalog(db):
+    loaded = catalog.get_catalog(db)
+    assert loaded["products"]
+    db.failing = True
+    catalog._background_refresh(db)
+    assert catalog.get_catalog(db) == loaded
+    assert "Nenhum produto" not in catalog.get_catalog(db)["products_string"]
+
+
+def test_empty_refresh_keeps_previous_catalog(db):
+    loaded = catalog.get_catalog(db)
+    for doc in list(db.collection('products').stream()):
+        doc.reference.delete()
+    catalog._background_refresh(db)
+    assert catalog.get_catalog(db) == loaded
+
+
+def test_successful_refresh_replaces_catalog(db):
+    loaded = catalog.get_catalog(db)
+    db.collection('products').document('p1').update({"price": 1.0})
+    catalog._background_refresh(db)
+    refreshed = catalog.get_catalog(db)
+    assert refreshed["version"] != loaded["version"]
+    assert "R$ 1.0" in refreshed["products_string"]
+
+
+def test_failed_first_load_is_not_cached(db):
+    db.failing = True
+    empty = catalog.get_catalog(db)
+    assert empty["products"] == [] and empty["version"] is None
+    assert not catalog.catalog_cached(db)
+    db.failing = False
+    assert catalog.get_catalog(db)["products"]
+    assert catalog.catalog_cached(db)
@@ -0,0 +1,84 @@
+import pytest
+
+import utils.checkout as checkout
+from utils import metrics
+from utils.cart import ProductIndex, cart_item
+from utils.chat import validate_customer_input
+from utils.constants import DEFAULT_PRODUCTS_SEED
+
+
+@pytest.fixture(scope="module")
+def index():
+    return ProductIndex(DEFAULT_PRODUCTS_SEED)
+
+
+@pytest.fixture(autouse=True)
+def fast_path(monkeypatch):
+    metrics.reset_metrics()
+    monkeypatch.setattr(checkout, "CHECKOUT_FAST_PATH_ENABLED", True)
+
+
+def _session(index, state="AWAITING_NAME", cart=("p1",)):
+    return {"session_uuid": "abc123-def", "chat_state": state, "chat_history_for_llm": [],
+            "customer_data": {"name": None, "email": None, "phone": None,
+                              "cart": [cart_item(index.by_id[p]) for p in cart]}}
+
+
+def _turn(session, text, index):
+    """Um turno como na view: zera a flag de entrada inválida, valida e tenta responder sem o LLM."""
+    session["last_input_invalid"] = False
+    state_before = validate_customer_input(session, text)
+    return checkout.answer_locally(session, text, state_before, index)
+
+
+def test_valid_data_is_collected_locally_up_to_the_proposal(index):
+    session = _session(index)
+    assert _turn(session, "Maria Silva", index) == "Obrigada, Maria! Agora, qual é o seu email?"
+    assert session["chat_state"] == "AWAITING_EMAIL"
+    assert _turn(session, "maria@exemplo.com", index).startswith("Perfeito!")
+    assert session["chat_state"] == "AWAITING_PHONE"
+    proposal = _turn(session, "(11) 98765-4321", index)
+    assert proposal.startswith("Tudo certo, Maria! Aqui está sua proposta:")
+    assert "https://marketplace-39A.com.br/abc123" in proposal
+    assert session["chat_state"] == "proposta_final"
+    # Cada resposta local entra no histórico que o LLM verá no turno seguinte.
+    assert [entry["role"] for entry in session["chat_history_for_llm"]] == ["user", "model"] * 3
+
+
+def test_invalid_input_gets_the_template_once(index):
+    session = _session(index, state="AWAITING_EMAIL")
+    assert _turn(session, "maria arroba exemplo", index).startswith("Esse email não parece válido")
+    assert session["chat_state"] == "AWAITING_EMAIL"
+    assert session[checkout.REPROMPTED_KEY] == "AWAITING_EMAIL"
+
+
+def test_second_invalid_input_falls_through_to_the_llm(index):
+    session = _session(index)
+    assert _turn(session, "quero cancelar", index) is not None
+    # "cancelar", uma pergunta ou uma mudança no carrinho: quem decide é o LLM.
+    assert _turn(session, "cancelar", index) is None
+    assert _turn(session, "quanto custa o frete?", index) is None
+    assert session["chat_history_for_llm"][-1] == {"role": "user", "parts": [{"text": "quanto custa o frete?"}]}
+    assert sum(value for name, _, value in metrics.iter_counters() if name == "checkout_llm_fallbacks_total") == 2
+
+
+def test_valid_input_resets_the_reprompt(index):
+    session = _session(index)
+    _turn(session, "oi", index)
+    assert _turn(session, "Maria Silva", index).startswith("Obrigada, Maria!")
+    assert checkout.REPROMPTED_KEY not in session
+    # Nova etapa, nova chance da mensagem padrão.
+    assert _turn(session, "não tenho email", index).startswith("Esse email não parece válido")
+
+
+def test_phone_without_cart_goes_to_the_llm(index):
+    session = _session(index, state="AWAITING_PHONE", cart=())
+    assert _turn(session, "11987654321", index) is None
+    assert session["chat_state"] == "PROPOSAL_READY"
+
+
+def test_disabled_fast_path_always_goes_to_the_llm(index, monkeypatch):
+    monkeypatch.setattr(checkout, "CHECKOUT_FAST_PATH_ENABLED", False)
+    session = _session(index)
+    assert _turn(session, "Maria Silva", index) is None
+    assert session["chat_state"] == "AWAITING_EMAIL"
@@ -0,0 +1,91 @@
+import pytest
+
+import utils.context as context
+from utils.chat import start_new_session
+from utils.context import estimate_messages_tokens, prepare_llm_context
+
+SYSTEM = "Você é 39A-na."
+INSTRUCTION = "Instrução do turno."
+
+
+@pytest.fixture(autouse=True)
+def small_budget(monkeypatch):
+    monkeypatch.setattr(context, "CONTEXT_WINDOW_ENABLED", True)
+    monkeypatch.setattr(context, "CONTEXT_HISTORY_TOKEN_BUDGET", 100)
+    monkeypatch.setattr(context, "CONTEXT_SUMMARY_TOKEN_BUDGET", 60)
+    monkeypatch.setattr(context, "CONTEXT_MIN_RECENT_MESSAGES", 2)
+
+
+def _session():
+    session = {}
+    start_new_session(session)
+    return session
+
+
+def _turn(session, text, reply="Resposta do modelo com algum texto."):
+    history = session["chat_history_for_llm"]
+    history.append({"role": "user", "parts": [{"text": text}]})
+    history.append({"role": "model", "parts": [{"text": reply}]})
+
+
+def test_short_history_is_sent_unchanged():
+    session = _session()
+    _turn(session, "Vocês têm celular?")
+    session["chat_history_for_llm"].append({"role": "user", "parts": [{"text": "Quanto custa?"}]})
+    assert estimate_messages_tokens(session["chat_history_for_llm"]) <= 100
+
+    llm_context = prepare_llm_context(session, SYSTEM, INSTRUCTION)
+    assert llm_context["history"] == session["chat_history_for_llm"]
+    assert llm_context["context_instruction"] == INSTRUCTION
+    assert "history_summary" not in session and "history_summarized_upto" not in session
+
+
+def test_history_at_exact_budget_is_not_windowed(monkeypatch):
+    session = _session()
+    _turn(session, "x" * 40)
+    monkeypatch.setattr(context, "CONTEXT_HISTORY_TOKEN_BUDGET", estimate_messages_tokens(session["chat_history_for_llm"]))
+    llm_context = prepare_llm_context(session, SYSTEM, INSTRUCTION)
+    assert llm_context["context_instruction"] == INSTRUCTION
+
+
+def test_long_history_is_windowed_with_state_and_summary():
+    session = _session()
+    for i in range(12):
+        _turn(session, f"Pergunta {i} sobre o produto " + "detalhe " * 5)
+    full = list(session["chat_history_for_llm"])
+    session["chat_history_for_llm"].append({"role": "user", "parts": [{"text": "E agora?"}]})
+
+    llm_context = prepare_llm_context(session, SYSTEM, INSTRUCTION)
+    assert len(llm_context["history"]) < len(full)
+    assert llm_context["history"][0]["role"] == "user"
+    assert llm_context["history"][-1]["parts"][0]["text"] == "E agora?"
+    assert "ESTADO ATUAL DA VENDA" in llm_context["context_instruction"]
+    assert "RESUMO DA CONVERSA ANTERIOR" in llm_context["context_instruction"]
+    assert session["history_summarized_upto"] > 0
+    assert llm_context["prompt_tokens"] < context.estimate_tokens(SYSTEM + INSTRUCTION) + estimate_messages_tokens(session["chat_history_for_llm"])
+
+
+def test_window_stays_on_once_summarized(monkeypatch):
+    session = _session()
+    for i in range(12):
+        _turn(session, f"Pergunta {i} " + "detalhe " * 5)
+    session["chat_history_for_llm"].append({"role": "user", "parts": [{"text": "Oi"}]})
+    prepare_llm_context(session, SYSTEM, INSTRUCTION)
+    summarized = session["history_summarized_upto"]
+
+    # Mesmo com um orçamento maior, as mensagens já resumidas não voltam ao histórico enviado.
+    monkeypatch.setattr(context, "CONTEXT_HISTORY_TOKEN_BUDGET", 10_000)
+    llm_context = prepare_llm_context(session, SYSTEM, INSTRUCTION)
+    assert session["history_summarized_upto"] == summarized
+    assert len(llm_context["history"]) == len(session["chat_history_for_llm"]) - summarized
+    assert "RESUMO DA CONVERSA ANTERIOR" in llm_context["context_instruction"]
+
+
+def test_disabled_window_always_sends_full_history(monkeypatch):
+    monkeypatch.setattr(context, "CONTEXT_WINDOW_ENABLED", False)
+    session = _session()
+    for i in range(12):
+        _turn(session, "detalhe " * 10)
+    llm_context = prepare_llm_context(session, SYSTEM, INSTRUCTION)
+    assert llm_context["history"] == session["chat_history_for_llm"]
+    assert llm_context["context_instruction"] == INSTRUCTION
@@ -0,0 +1,125 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import utils.dashboard as dashboard
+import utils.firebase as firebase
+from utils.dashboard import (
+    backfill_rollups, dashboard_from_sessions, list_dashboard_models, load_dashboard_data, rollups_available
+)
+from testing.fakes import FakeFirestore
+
+DAY = datetime(2025, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def _legacy_session(uuid, model, state="proposta_final"):
+    return {"session_uuid": uuid, "model_used": model, "final_state": state, "timestamp_utc": DAY}
+
+
+def _scan(db):
+    return dashboard_from_sessions(doc.to_dict() for doc in db.collection('sessions').stream())
+
+
+@pytest.fixture
+def legacy_db():
+    """Base com sessões gravadas antes dos contadores existirem."""
+    db = FakeFirestore()
+    for i, model in enumerate(["modelo-a", "modelo-a", "modelo-b"]):
+        db.collection('sessions').document(f"old{i}").set(_legacy_session(f"old{i}", model))
+    return db
+
+
+@pytest.fixture
+def live_save(monkeypatch):
+    monkeypatch.setattr(firebase, "AB_TEST_ENABLED", False)
+
+    def save(db, uuid):
+        session = {"session_uuid": uuid, "ab_test_group": "A", "chat_state": "ajuda_na_escolha",
+                   "customer_data": {"cart": []}, "total_value": 0.0}
+        firebase.save_session_to_firestore(db, session)
+    return save
+
+
+def test_live_save_before_backfill_keeps_full_scan(legacy_db, live_save):
+    live_save(legacy_db, "new1")
+    assert legacy_db.collection('dashboard_meta').document('models').get().exists
+    assert not rollups_available(legacy_db)
+    assert load_dashboard_data(legacy_db) == _scan(legacy_db)
+    models = {doc.to_dict()["model_used"] for doc in legacy_db.collection('sessions').stream()}
+    assert list_dashboard_models(legacy_db) == sorted(models)
+
+
+def test_backfill_switches_to_rollups(legacy_db, live_save):
+    live_save(legacy_db, "new1")
+    result = backfill_rollups(legacy_db)
+    # A sessão nova já estava nos contadores: o backfill só soma as três antigas.
+    assert result["sessions"] == 4 and result["counted"] == 3
+    assert rollups_available(legacy_db)
+    expected = _scan(legacy_db)
+    rollup_docs = len(list(legacy_db.collection('session_rollups').stream()))
+    legacy_db.reset_counters()
+    assert load_dashboard_data(legacy_db) == expected
+    # Lido dos contadores: o marcador do backfill e os shards de cada (modelo, dia), sem ler 'sessions'.
+    assert legacy_db.reads == 1 + rollup_docs
+    assert list_dashboard_models(legacy_db) == sorted({"modelo-a", "modelo-b", firebase.GEMINI_MODEL_LABEL})
+
+
+def test_saves_after_backfill_stay_consistent(legacy_db, live_save):
+    backfill_rollups(legacy_db)
+    live_save(legacy_db, "new1")
+    live_save(legacy_db, "new1")
+    assert load_dashboard_data(legacy_db) == _scan(legacy_db)
+    assert load_dashboard_data(legacy_db, "modelo-a") == dashboard_from_sessions(
+        doc.to_dict() for doc in legacy_db.collection('sessions').where('model_used', '==', 'modelo-a').stream())
+
+
+def test_empty_backfill_marks_fresh_install():
+    db = FakeFirestore()
+    assert not rollups_available(db)
+    result = backfill_rollups(db)
+    assert result == {"sessions": 0, "counted": 0, "models": []}
+    assert rollups_available(db)
+    assert list_dashboard_models(db) == []
+    assert load_dashboard_data(db) == _scan(db)
+
+
+def test_legacy_session_saved_live_before_backfill_is_counted_once(legacy_db, live_save, monkeypatch):
+    monkeypatch.setattr(firebase, "AB_TEST_ENABLED", False)
+    # Uma sessão antiga recebe um turno antes do backfill: não há contribuição anterior a desfazer.
+    session = {"session_uuid": "old0", "ab_test_group": "A", "chat_state": "AWAITING_NAME",
+               "customer_data": {"cart": []}, "total_value": 0.0}
+    firebase.save_session_to_firestore(legacy_db, session)
+    backfill_rollups(legacy_db)
+    assert load_dashboard_data(legacy_db) == _scan(legacy_db)
+
+
+def test_backfill_is_idempotent_and_keeps_live_increments(legacy_db, live_save):
+    backfill_rollups(legacy_db)
+    live_save(legacy_db, "new1")
+    # Repetir o backfill (ex.: depois de uma falha) não soma de novo nem apaga o que veio ao vivo.
+    assert backfill_rollups(legacy_db)["counted"] == 0
+    assert load_dashboard_data(legacy_db) == _scan(legacy_db)
+
+
+def test_counters_are_sharded_and_summed_on_read(live_save, monkeypatch):
+    monkeypatch.setattr(dashboard, "DASHBOARD_ROLLUP_SHARDS", 4)
+    db = FakeFirestore()
+    backfill_rollups(db)
+    for i in range(40):
+        live_save(db, f"s{i}")
+    docs = [doc.to_dict() for doc in db.collection('session_rollups').stream()]
+    assert 1 < len(docs) <= 4
+    assert {doc["shard"] for doc in docs} <= set(range(4))
+    assert load_dashboard_data(db) == _scan(db)
+
+
+def test_models_doc_is_written_once_per_process(live_save):
+    db = FakeFirestore()
+    backfill_rollups(db)
+    live_save(db, "s1")
+    db.reset_counters()
+    live_save(db, "s2")
+    live_save(db, "s3")
+    # Só as duas sessões e os contadores: o modelo já está em dashboard_meta/models.
+    assert db.writes == 4
+    assert list_dashboard_models(db) == [firebase.GEMINI_MODEL_LABEL]
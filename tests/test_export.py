@@ -0,0 +1,141 @@
+import csv
+import io
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.export import EXPORT_FIELDS, _row, export_sessions, iter_session_pages, iter_sessions_parquet, parse_export_date
+from testing.fakes import FakeFirestore
+
+FIRST_DAY = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _seed(db, totals):
+    for index, total in enumerate(totals):
+        db.collection('sessions').document(f"s{index:03d}").set({
+            "session_uuid": f"s{index:03d}", "model_used": "Gemini-2.0-flash", "final_state": "proposta_final",
+            "cart_items": 1, "total_value": total, "timestamp_utc": FIRST_DAY + timedelta(minutes=index),
+        })
+
+
+def _export_peak(sessions, export_format, page_size=250, row_group_size=1000):
+    """Pico de memória (tracemalloc) ao exportar `sessions` sessões, consumindo os pedaços sem guardá-los."""
+    db = FakeFirestore()
+    _seed(db, [10.0] * sessions)
+    # O índice ordenado é do substituto do Firestore, não da exportação: é montado antes de medir.
+    next(iter_session_pages(db, page_size=1))
+    if export_format == "parquet":
+        chunks = iter_sessions_parquet(iter_session_pages(db, page_size=page_size), row_group_size=row_group_size)
+    else:
+        chunks = export_sessions(db, export_format, page_size=page_size)
+    tracemalloc.start()
+    try:
+        for _ in chunks:
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("export_format", ["csv", "parquet"])
+def test_export_memory_does_not_grow_with_the_collection(export_format):
+    if export_format == "parquet":
+        pytest.importorskip("pyarrow")
+    small, large = _export_peak(5_000, export_format), _export_peak(20_000, export_format)
+    # Só uma página (e no Parquet um row group) fica em memória: 4x mais sessões, mesmo pico.
+    assert large < 1.25 * small
+    assert large < 2_000_000
+
+
+@pytest.mark.parametrize("data, expected", [
+    ({"total_value": "3.499,00"}, 3499.0),
+    ({"total_value": "R$ 1.299,90"}, 1299.9),
+    ({"total_value": 399}, 399.0),
+    ({"total_value": "a combinar"}, None),
+    ({"total_value": True}, None),
+    ({}, None),
+])
+def test_total_value_is_coerced_to_a_number(data, expected):
+    assert _row(data)[EXPORT_FIELDS.index("total_value")] == expected
+
+
+def test_other_fields_are_coerced_to_the_schema_types():
+    row = dict(zip(EXPORT_FIELDS, _row({"session_uuid": 123, "cart_items": "2", "timestamp_utc": datetime(2025, 1, 1, 12)})))
+    assert row["session_uuid"] == "123"
+    assert row["cart_items"] == 2
+    assert row["timestamp_utc"] == datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+    assert _row({"cart_items": "muitos", "timestamp_utc": "ontem"})[3:] == (None, None, None)
+
+
+def test_parquet_export_with_legacy_string_totals_is_complete():
+    parquet = pytest.importorskip("pyarrow.parquet")
+    db = FakeFirestore()
+    # O total em texto cai no segundo row group, depois de o primeiro já ter sido enviado.
+    _seed(db, [10.0] * 5 + ["3.499,00", "lixo", 7])
+    chunks = list(iter_sessions_parquet(iter([[_row(doc.to_dict())] for doc in db.collection('sessions').stream()]), row_group_size=4))
+    table = parquet.read_table(io.BytesIO(b"".join(chunks)))
+    assert table.num_rows == 8
+    assert table.column("total_value").to_pylist() == [10.0] * 5 + [3499.0, None, 7.0]
+
+
+def test_csv_export_normalizes_legacy_totals():
+    db = FakeFirestore()
+    _seed(db, ["3.499,00", 12.5])
+    rows = list(csv.reader(io.StringIO("".join(export_sessions(db, "csv", page_size=1)))))
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    assert [row[4] for row in rows[1:]] == ["3499.0", "12.5"]
+
+
+def _seed_days(db, models):
+    for index, model in enumerate(models):
+        db.collection('sessions').document(f"s{index:03d}").set({
+            "session_uuid": f"s{index:03d}", "model_used": model, "final_state": "proposta_final",
+            "cart_items": 1, "total_value": 10.0 + index, "timestamp_utc": FIRST_DAY + timedelta(days=index),
+        })
+
+
+def _csv_rows(chunks):
+    return list(csv.reader(io.StringIO("".join(chunks))))
+
+
+def test_end_date_is_inclusive():
+    assert parse_export_date("2025-01-02") == datetime(2025, 1, 2, tzinfo=timezone.utc)
+    assert parse_export_date("2025-01-02", end=True) == datetime(2025, 1, 3, tzinfo=timezone.utc)
+    assert parse_export_date("") is None
+
+
+def test_csv_export_pages_through_every_session_in_order():
+    db = FakeFirestore()
+    _seed_days(db, ["Gemini-2.0-flash"] * 7)
+    rows = _csv_rows(export_sessions(db, "csv", page_size=3))
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    assert [row[0] for row in rows[1:]] == [f"s{index:03d}" for index in range(7)]
+
+
+def test_csv_export_applies_date_and_model_filters():
+    db = FakeFirestore()
+    _seed_days(db, ["Gemini-2.0-flash", "GPT-4o", "Gemini-2.0-flash", "Gemini-2.0-flash", "GPT-4o"])
+    rows = _csv_rows(export_sessions(
+        db, "csv", start=parse_export_date("2025-01-02"), end=parse_export_date("2025-01-04", end=True),
+        model="Gemini-2.0-flash", page_size=1,
+    ))
+    assert [row[0] for row in rows[1:]] == ["s002", "s003"]
+
+
+def test_sessions_rewritten_during_the_export_are_not_lost():
+    db = FakeFirestore()
+    _seed(db, [1.0] * 6)
+    pages = iter_session_pages(db, page_size=2)
+    rows = list(next(pages))
+    # Um turno regrava timestamp_utc de uma sessão já exportada e de outra ainda não lida.
+    for session_uuid in ("s000", "s004"):
+        db.collection('sessions').document(session_uuid).update({"timestamp_utc": FIRST_DAY + timedelta(days=1), "total_value": 2.0})
+    for page in pages:
+        rows.extend(page)
+    uuids = [row[0] for row in rows]
+    assert set(uuids) == {f"s{index:03d}" for index in range(6)}
+    assert uuids.count("s000") == 2 and uuids.count("s004") == 1
+    # A última linha de cada sessão é a versão mais recente.
+    latest = {row[0]: row[4] for row in rows}
+    assert latest["s000"] == latest["s004"] == 2.0
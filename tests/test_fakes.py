@@ -0,0 +1,79 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from firebase_admin import firestore
+
+from testing.fakes import FakeFirestore, FakeFirestoreError, lognormal_latency
+
+DAY = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db():
+    db = FakeFirestore()
+    sessions = db.collection('sessions')
+    for i, (minutes, model) in enumerate([(30, "b"), (10, "a"), (20, "b"), (10, "b"), (40, "a")]):
+        sessions.document(f"s{i}").set({"timestamp_utc": DAY + timedelta(minutes=minutes), "model_used": model})
+    sessions.document("sem_timestamp").set({"model_used": "a"})
+    return db
+
+
+def _ids(query):
+    return [doc.id for doc in query.stream()]
+
+
+def test_order_by_ascending_breaks_ties_by_id(db):
+    assert _ids(db.collection('sessions').order_by('timestamp_utc')) == ["s1", "s3", "s2", "s0", "s4"]
+
+
+def test_order_by_descending_uses_firestore_constant(db):
+    query = db.collection('sessions').order_by('timestamp_utc', direction=firestore.Query.DESCENDING)
+    # O desempate pelo id segue a direção da última ordenação; documentos sem o campo ficam de fora.
+    assert _ids(query) == ["s4", "s0", "s2", "s3", "s1"]
+
+
+def test_mixed_directions(db):
+    query = db.collection('sessions').order_by('model_used').order_by('timestamp_utc', direction=firestore.Query.DESCENDING)
+    assert _ids(query) == ["s4", "s1", "s0", "s2", "s3"]
+
+
+def test_start_after_pages_in_descending_order(db):
+    query = db.collection('sessions').order_by('timestamp_utc', direction=firestore.Query.DESCENDING).limit(2)
+    pages, cursor = [], None
+    while True:
+        page = list((query.start_after(cursor) if cursor else query).stream())
+        if not page:
+            break
+        pages.append([doc.id for doc in page])
+        cursor = page[-1]
+    assert pages == [["s4", "s0"], ["s2", "s3"], ["s1"]]
+
+
+def test_descending_index_follows_writes(db):
+    query = db.collection('sessions').order_by('timestamp_utc', direction=firestore.Query.DESCENDING)
+    assert _ids(query)[0] == "s4"
+    db.collection('sessions').document("s5").set({"timestamp_utc": DAY + timedelta(hours=1), "model_used": "a"})
+    assert _ids(query)[0] == "s5"
+
+
+def test_invalid_direction_is_rejected(db):
+    with pytest.raises(ValueError):
+        db.collection('sessions').order_by('timestamp_utc', direction="DESC")
+
+
+def test_lognormal_latency_matches_the_requested_percentiles():
+    sample = lognormal_latency(0.2, 1.0, rng=random.Random(7))
+    latencies = sorted(sample() for _ in range(20000))
+    assert latencies[10000] == pytest.approx(0.2, rel=0.05)
+    assert latencies[19800] == pytest.approx(1.0, rel=0.15)
+    assert lognormal_latency(0, 1.0)() == 0.0
+
+
+def test_failed_commit_applies_none_of_the_batch():
+    db = FakeFirestore(error_rate=1.0)
+    batch = db.batch()
+    batch.set(db.collection('sessions').document("s1"), {"model_used": "a"})
+    with pytest.raises(FakeFirestoreError):
+        batch.commit()
+    assert not db.collection('sessions').document("s1").get().exists
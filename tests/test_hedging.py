@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+
+import pytest
+
+import utils.admission as admission
+import utils.hedging as hedging
+import utils.llm as llm
+from utils import metrics
+from utils.constants import OPENROUTER_MODEL_A, OPENROUTER_MODEL_B
+
+VALID = json.dumps({"chat_state": "ajuda_na_escolha", "resposta": "Olá!"})
+
+
+class FakeStreamResponse:
+    """Resposta HTTP em streaming: `close()` interrompe a leitura bloqueada, como um socket fechado."""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+class Provider:
+    """Substitui stream_openrouter_api: cada modelo responde `text` depois de `delay` segundos.
+
+    Os modelos em `deaf` não param ao ter a resposta fechada (como uma requisição ainda sem cabeçalhos).
+    """
+
+    def __init__(self, script, deaf=()):
+        self.script = script
+        self.deaf = set(deaf)
+        self.responses = {}
+        self.finished = {model: threading.Event() for model in script}
+
+    def stream(self, system_prompt, chat_history, session_data, model_to_use=None, on_response=None):
+        delay, text = self.script[model_to_use]
+        response = FakeStreamResponse()
+        self.responses[model_to_use] = response
+        on_response(response)
+        try:
+            if model_to_use in self.deaf:
+                time.sleep(delay)
+            elif response.closed.wait(delay):
+                yield "Ops! Tive um problema de comunicação com nossa IA."
+                return
+            yield text
+        finally:
+            self.finished[model_to_use].set()
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    metrics.reset_metrics()
+    monkeypatch.setattr(llm, "OPENROUTER_API_KEY", "fake")
+    monkeypatch.setattr(llm, "AB_TEST_ENABLED", True)
+    monkeypatch.setattr(hedging, "HEDGE_BACKUP_MODEL", "")
+    monkeypatch.setattr(hedging, "hedge_delay", lambda model: 0.05)
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL_ENABLED", True)
+    monkeypatch.setattr(admission, "LLM_MAX_CONCURRENCY_PER_MODEL", 1)
+    monkeypatch.setattr(admission, "HEDGE_RESERVED_SLOTS_PER_MODEL", 0)
+    admission.reset_admission()
+
+    def use(script, deaf=()):
+        fake = Provider(script, deaf)
+        monkeypatch.setattr(llm, "stream_openrouter_api", fake.stream)
+        return fake
+    yield use
+    admission.reset_admission()
+
+
+def _session():
+    # Grupo A: o modelo principal é o A e a reserva, o B.
+    return {"session_uuid": "s1", "ab_test_group": "A", "model_turns": {}}
+
+
+def _counter(name, **labels):
+    return sum(value for metric, metric_labels, value in metrics.iter_counters()
+               if metric == name and all(metric_labels.get(k) == v for k, v in labels.items()))
+
+
+def _wait_for(condition, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condição não atingida"
+        time.sleep(0.005)
+
+
+def test_fast_primary_answers_without_hedging(provider):
+    fake = provider({OPENROUTER_MODEL_A: (0.0, VALID), OPENROUTER_MODEL_B: (0.0, VALID)})
+    session = _session()
+    assert hedging.call_llm_hedged("prompt", [], session, True) == VALID
+    assert session["model_turns"] == {OPENROUTER_MODEL_A: 1}
+    assert OPENROUTER_MODEL_B not in fake.responses
+    assert _counter("llm_hedge_fired_total") == 0
+
+
+def test_slow_primary_fires_backup_which_wins_and_cancels_primary(provider):
+    fake = provider({OPENROUTER_MODEL_A: (5.0, VALID), OPENROUTER_MODEL_B: (0.1, VALID)})
+    session = _session()
+    start = time.monotonic()
+    assert hedging.call_llm_hedged("prompt", [], session, True) == VALID
+    assert time.monotonic() - start < 1.0
+    assert session["model_turns"] == {OPENROUTER_MODEL_B: 1}
+    assert _counter("llm_hedge_fired_total") == 1
+    assert _counter("llm_hedge_wins_total", model=OPENROUTER_MODEL_B, role="backup") == 1
+    # A conexão da principal é fechada e a thread dela termina logo, sem esperar os 5s.
+    assert fake.responses[OPENROUTER_MODEL_A].closed.is_set()
+    assert fake.finished[OPENROUTER_MODEL_A].wait(1.0)
+    _wait_for(lambda: _counter("llm_hedge_cancelled_total", model=OPENROUTER_MODEL_A, role="primary") == 1)
+
+
+def test_primary_that_answers_first_after_hedging_wins(provider):
+    fake = provider({OPENROUTER_MODEL_A: (0.15, VALID), OPENROUTER_MODEL_B: (5.0, VALID)})
+    session = _session()
+    assert hedging.call_llm_hedged("prompt", [], session, True) == VALID
+    assert session["model_turns"] == {OPENROUTER_MODEL_A: 1}
+    assert _counter("llm_hedge_wins_total", model=OPENROUTER_MODEL_A, role="primary") == 1
+    assert fake.responses[OPENROUTER_MODEL_B].closed.is_set()
+    assert fake.finished[OPENROUTER_MODEL_B].wait(1.0)
+
+
+def test_invalid_backup_answer_does_not_win(provider):
+    provider({OPENROUTER_MODEL_A: (0.3, VALID), OPENROUTER_MODEL_B: (0.0, "sem json")})
+    session = _session()
+    assert hedging.call_llm_hedged("prompt", [], session, True) == VALID
+    assert session["model_turns"] == {OPENROUTER_MODEL_A: 1}
+
+
+def test_no_free_slot_means_no_hedge(provider):
+    fake = provider({OPENROUTER_MODEL_A: (0.3, VALID), OPENROUTER_MODEL_B: (0.0, VALID)})
+    busy = admission.try_admit(OPENROUTER_MODEL_B)
+    try:
+        session = _session()
+        assert hedging.call_llm_hedged("prompt", [], session, True) == VALID
+    finally:
+        busy.release()
+    assert OPENROUTER_MODEL_B not in fake.responses
+    assert _counter("llm_hedge_fired_total") == 0
+    assert _counter("llm_hedge_skipped_total", reason="busy") == 1
+    assert session["model_turns"] == {OPENROUTER_MODEL_A: 1}
+
+
+def test_turn_slot_is_held_until_the_losing_primary_exits(provider):
+    fake = provider({OPENROUTER_MODEL_A: (0.6, VALID), OPENROUTER_MODEL_B: (0.1, VALID)}, deaf=[OPENROUTER_MODEL_A])
+    gate = admission.get_gate(OPENROUTER_MODEL_A)
+    slot = admission.admit("s1", OPENROUTER_MODEL_A)
+    with slot:
+        hedging.call_llm_hedged("prompt", [], _session(), True, slot)
+    # A reserva venceu, mas a principal ainda está no provedor: o `with` da view não libera o slot.
+    assert not fake.finished[OPENROUTER_MODEL_A].is_set()
+    assert gate.active == 1
+    assert fake.finished[OPENROUTER_MODEL_A].wait(2.0)
+    _wait_for(lambda: gate.active == 0)
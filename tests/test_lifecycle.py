@@ -0,0 +1,115 @@
+import pytest
+
+import app as flask_app_module
+import utils.catalog as catalog
+import utils.lifecycle as lifecycle
+from testing.fakes import FakeFirestore
+from utils.firebase import seed_initial_products
+
+
+class FakeOs:
+    """Substitui o módulo `os` em utils.lifecycle: o teste troca o pid como num fork."""
+
+    def __init__(self, pid=100):
+        self.pid = pid
+
+    def getpid(self):
+        return self.pid
+
+
+@pytest.fixture
+def process(monkeypatch):
+    fake_os = FakeOs()
+    monkeypatch.setattr(lifecycle, "os", fake_os)
+    monkeypatch.setattr(lifecycle, "_client", None)
+    monkeypatch.setattr(lifecycle, "_client_pid", None)
+    monkeypatch.setattr(lifecycle, "_state", {"phase": "cold", "pid": None, "started_at": None,
+                                              "ready_seconds": None, "steps": {}, "error": None})
+    monkeypatch.setattr(lifecycle, "WARMUP_ENABLED", True)
+    monkeypatch.setattr(lifecycle, "SEED_PRODUCTS_ON_STARTUP", False)
+    monkeypatch.setattr(lifecycle, "warm_llm_connections", lambda: 0)
+    monkeypatch.setattr(catalog, "CATALOG_SNAPSHOT_LISTENER_ENABLED", False)
+    catalog.invalidate_catalog_cache()
+    yield fake_os
+    catalog.invalidate_catalog_cache()
+
+
+@pytest.fixture
+def db():
+    db = FakeFirestore()
+    seed_initial_products(db)
+    return db
+
+
+def test_firestore_client_is_created_once_per_process(process, monkeypatch):
+    created = []
+    monkeypatch.setattr(lifecycle, "_create_firestore_client", lambda: created.append(process.pid) or object())
+    first = lifecycle.get_firestore_client()
+    assert lifecycle.get_firestore_client() is first
+    # Depois do fork, o worker cria o próprio cliente.
+    process.pid = 101
+    assert lifecycle.get_firestore_client() is not first
+    assert created == [100, 101]
+
+
+def test_failed_client_is_not_retried_in_the_same_process(process, monkeypatch):
+    created = []
+    monkeypatch.setattr(lifecycle, "_create_firestore_client", lambda: created.append(1))
+    assert lifecycle.get_firestore_client() is None
+    assert lifecycle.get_firestore_client() is None
+    assert created == [1]
+
+
+def test_warm_up_runs_once_and_marks_the_worker_ready(process, db):
+    calls = []
+    state = lifecycle.warm_up(db, extra_steps=[("templates", lambda: calls.append(1))])
+    assert state["ready"] and state["phase"] == "ready"
+    assert list(state["steps"]) == ["catalog", "system_prompt", "product_index", "llm_connections", "templates"]
+    assert all(step["status"] == "ok" for step in state["steps"].values())
+    assert lifecycle.warm_up(db, extra_steps=[("templates", lambda: calls.append(1))])["ready"]
+    assert calls == [1]
+
+
+def test_failed_optional_step_does_not_block_readiness(process, db, monkeypatch):
+    def unreachable():
+        raise ConnectionError("provedor fora do ar")
+    monkeypatch.setattr(lifecycle, "warm_llm_connections", unreachable)
+    state = lifecycle.warm_up(db)
+    assert state["ready"]
+    assert state["steps"]["llm_connections"]["status"] == "error"
+
+
+def test_empty_catalog_fails_the_warm_up(process):
+    state = lifecycle.warm_up(FakeFirestore())
+    assert not state["ready"] and state["phase"] == "failed"
+    assert state["error"] == "Falha ao carregar o catálogo"
+
+
+def test_worker_without_firestore_is_not_ready(process):
+    state = lifecycle.warm_up(None)
+    assert state["phase"] == "failed" and state["steps"] == {}
+
+
+def test_forked_process_starts_cold(process, db):
+    assert lifecycle.warm_up(db)["ready"]
+    process.pid = 101
+    state = lifecycle.readiness()
+    assert state["phase"] == "cold" and not state["ready"] and state["steps"] == {}
+
+
+def test_readyz_warms_a_cold_worker(process, db, monkeypatch):
+    monkeypatch.setattr(flask_app_module, "db", db)
+    client = flask_app_module.app.test_client()
+    response = client.get("/readyz")
+    assert response.status_code == 200 and response.get_json()["phase"] == "ready"
+    assert client.get("/healthz").get_json()["status"] == "ok"
+
+
+def test_readyz_is_503_without_firestore(process, monkeypatch):
+    monkeypatch.setattr(flask_app_module, "db", None)
+    monkeypatch.setattr(flask_app_module, "get_firestore_client", lambda: None)
+    response = flask_app_module.app.test_client().get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["error"] == "Firestore não inicializado"
+    # O estado fica registrado: o próximo /readyz não repete o aquecimento.
+    assert lifecycle.readiness()["phase"] == "failed"
@@ -0,0 +1,53 @@
+import pytest
+import requests
+
+import utils.llm as llm
+from utils.constants import GEMINI_MODEL_LABEL
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+GEMINI_ANSWER = {"candidates": [{"content": {"parts": [{"text": "resposta do gemini"}]}}]}
+
+
+@pytest.fixture
+def failover(monkeypatch):
+    monkeypatch.setattr(llm, "OPENROUTER_API_KEY", "fake")
+    monkeypatch.setattr(llm, "GEMINI_API_KEY", "fake")
+    monkeypatch.setattr(llm, "LLM_FAILOVER_TO_GEMINI", True)
+    monkeypatch.setattr(llm, "AB_TEST_ENABLED", True)
+
+    def use(gemini_outcome):
+        def post(provider, model, url, **kwargs):
+            if provider == "openrouter":
+                raise requests.exceptions.ConnectionError("openrouter fora do ar")
+            if isinstance(gemini_outcome, BaseException):
+                raise gemini_outcome
+            return FakeResponse(gemini_outcome)
+        monkeypatch.setattr(llm, "post_with_retry", post)
+    return use
+
+
+def _session():
+    return {"ab_test_group": "A", "model_turns": {}}
+
+
+def test_successful_failover_counts_the_turn_for_gemini(failover):
+    failover(GEMINI_ANSWER)
+    session = _session()
+    assert llm.call_openrouter_api("prompt", [], session) == "resposta do gemini"
+    assert session["model_turns"] == {GEMINI_MODEL_LABEL: 1}
+
+
+@pytest.mark.parametrize("gemini_outcome", [requests.exceptions.Timeout("gemini lento"), {"candidates": []}])
+def test_failed_failover_counts_no_model(failover, gemini_outcome):
+    failover(gemini_outcome)
+    session = _session()
+    llm.call_openrouter_api("prompt", [], session)
+    assert session["model_turns"] == {}
@@ -0,0 +1,67 @@
+import os
+import re
+
+import pytest
+
+from utils import metrics
+
+WORKER = f'worker="{os.getpid()}"'
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    metrics.reset_metrics()
+    yield
+    metrics.reset_metrics()
+
+
+def _samples(text):
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+
+def test_every_series_carries_worker_pid():
+    metrics.increment("turns_total", route="send_message")
+    metrics.increment("unlabeled_total")
+    metrics.set_gauge("queue_depth", 3)
+    metrics.observe("turn_seconds", 0.2, route="send_message")
+    samples = _samples(metrics.render_prometheus())
+    assert samples
+    for line in samples:
+        assert WORKER in line, line
+    assert f'turns_total{{route="send_message",{WORKER}}} 1' in samples
+    assert f"unlabeled_total{{{WORKER}}} 1" in samples
+    assert f"queue_depth{{{WORKER}}} 3" in samples
+
+
+def test_histogram_buckets_keep_le_last():
+    metrics.observe("turn_seconds", 0.2, buckets=(0.1, 1.0), route="r")
+    text = metrics.render_prometheus()
+    assert f'turn_seconds_bucket{{route="r",{WORKER},le="0.1"}} 0' in text
+    assert f'turn_seconds_bucket{{route="r",{WORKER},le="1.0"}} 1' in text
+    assert f'turn_seconds_bucket{{route="r",{WORKER},le="+Inf"}} 1' in text
+    assert f'turn_seconds_count{{route="r",{WORKER}}} 1' in text
+
+
+def test_type_line_emitted_once_per_metric():
+    metrics.increment("turns_total", route="a")
+    metrics.increment("turns_total", route="b")
+    text = metrics.render_prometheus()
+    assert text.count("# TYPE turns_total counter") == 1
+
+
+def test_label_values_are_escaped():
+    metrics.increment("errors_total", message='quote " and \\ slash\nnewline')
+    text = metrics.render_prometheus()
+    assert re.search(r'message="quote \\" and \\\\ slash\\nnewline"', text)
+
+
+def test_empty_registry_renders_empty_body():
+    assert metrics.render_prometheus() == "\n"
+
+
+def test_histogram_quantile_interpolates_within_bucket():
+    histogram = metrics.Histogram(buckets=(1.0, 2.0))
+    assert histogram.quantile(0.5) is None
+    for value in (1.5, 1.5, 1.5, 1.5):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
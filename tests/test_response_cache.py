@@ -0,0 +1,160 @@
+import json
+
+import pytest
+
+import utils.response_cache as response_cache
+from utils import metrics
+from utils.chat import start_new_session
+from utils.constants import GEMINI_MODEL_LABEL
+
+ANSWER = json.dumps({"chat_state": "ajuda_na_escolha", "resposta": "Temos o NovoPhone X e o NovoPhone Lite."})
+
+
+class Clock:
+    """Substitui o módulo `time` em utils.response_cache: o teste decide quando o tempo passa."""
+
+    def __init__(self):
+        self.now = 1_000.0
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    metrics.reset_metrics()
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "AB_TEST_ENABLED", False)
+    response_cache.clear_response_cache()
+    yield
+    response_cache.clear_response_cache()
+
+
+def _first_turn(text="Quais celulares vocês têm?", group="A"):
+    session = {}
+    start_new_session(session)
+    session["ab_test_group"] = group
+    session["chat_history_for_llm"].append({"role": "user", "parts": [{"text": text}]})
+    return session
+
+
+def test_key_is_catalog_version_model_and_normalized_text():
+    key, cached = response_cache.lookup(_first_turn("Quais  CELULARES vocês têm?!"), "Quais  CELULARES vocês têm?!", "v1")
+    assert cached is None
+    assert key == ("v1", GEMINI_MODEL_LABEL, "quais celulares voces tem")
+
+
+def test_ab_groups_do_not_share_answers(monkeypatch):
+    monkeypatch.setattr(response_cache, "AB_TEST_ENABLED", True)
+    key_a, _ = response_cache.lookup(_first_turn(group="A"), "oi", "v1")
+    response_cache.store(key_a, ANSWER, 1.0)
+    key_b, cached = response_cache.lookup(_first_turn(group="B"), "oi", "v1")
+    assert key_b[1] == "B" and cached is None
+    assert response_cache.lookup(_first_turn(group="A"), "oi", "v1")[1] == ANSWER
+
+
+def test_only_the_first_user_turn_is_cacheable():
+    session = _first_turn()
+    assert response_cache.is_cacheable_turn(session)
+    session["chat_history_for_llm"] += [{"role": "model", "parts": [{"text": "..."}]},
+                                        {"role": "user", "parts": [{"text": "e o mais barato?"}]}]
+    assert not response_cache.is_cacheable_turn(session)
+    assert response_cache.lookup(session, "e o mais barato?", "v1") == (None, None)
+
+
+@pytest.mark.parametrize("change", [
+    lambda session: session.update(chat_state="confirma_carrinho"),
+    lambda session: session["customer_data"]["cart"].append({"id": "p1"}),
+    lambda session: session["customer_data"].update(product_selected_for_cart={"id": "p1"}),
+])
+def test_turns_that_depend_on_session_state_are_not_cached(change):
+    session = _first_turn()
+    change(session)
+    assert not response_cache.is_cacheable_turn(session)
+
+
+@pytest.mark.parametrize("answer", [
+    "texto sem json",
+    json.dumps({"chat_state": "confirma_carrinho", "resposta": "Confirma?"}),
+])
+def test_only_answers_that_keep_the_conversation_open_are_stored(answer):
+    key, _ = response_cache.lookup(_first_turn(), "oi", "v1")
+    response_cache.store(key, answer, 1.0)
+    assert response_cache.lookup(_first_turn(), "oi", "v1")[1] is None
+
+
+def test_hit_after_store_counts_saved_latency():
+    key, cached = response_cache.lookup(_first_turn(), "oi", "v1")
+    assert cached is None
+    response_cache.store(key, ANSWER, 1.5)
+    assert response_cache.lookup(_first_turn(), "Oi!", "v1")[1] == ANSWER
+    stats = response_cache.get_response_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["latency_saved_seconds"] == 1.5
+
+
+def test_new_catalog_version_misses():
+    key, _ = response_cache.lookup(_first_turn(), "oi", "v1")
+    response_cache.store(key, ANSWER, 1.0)
+    assert response_cache.lookup(_first_turn(), "oi", "v2")[1] is None
+
+
+def test_store_stream_passes_chunks_through_and_stores_the_answer():
+    key, _ = response_cache.lookup(_first_turn(), "oi", "v1")
+    chunks = list(response_cache.store_stream(key, iter([ANSWER[:10], ANSWER[10:]])))
+    assert chunks == [ANSWER[:10], ANSWER[10:]]
+    assert response_cache.lookup(_first_turn(), "oi", "v1")[1] == ANSWER
+
+
+@pytest.fixture
+def chat_client(monkeypatch):
+    import app as flask_app_module
+    from testing.fakes import FakeFirestore
+    from utils.firebase import seed_initial_products
+    from utils.session_store import MemorySessionStore, ServerSideSessionInterface
+    db = FakeFirestore()
+    seed_initial_products(db)
+    monkeypatch.setattr(flask_app_module.app, "session_interface", ServerSideSessionInterface(MemorySessionStore()))
+    monkeypatch.setattr(flask_app_module, "db", db)
+    monkeypatch.setattr(flask_app_module, "AB_TEST_ENABLED", False)
+    monkeypatch.setattr(flask_app_module, "HEDGED_REQUESTS_ENABLED", False)
+    monkeypatch.setattr(flask_app_module, "queue_session_save", lambda db, session: None)
+    monkeypatch.setattr(flask_app_module, "call_gemini_api", lambda history: ANSWER)
+    monkeypatch.setattr(flask_app_module, "stream_gemini_api", lambda history: iter([ANSWER]))
+    return flask_app_module
+
+
+@pytest.mark.parametrize("route", ["/send_message", "/send_message_stream"])
+def test_cache_hit_skips_admission(chat_client, monkeypatch, route):
+    def turn():
+        client = chat_client.app.test_client()
+        client.post("/initialize_chat")
+        return client.post(route, json={"user_input": "Quais celulares vocês têm?"})
+
+    first = turn()
+    assert first.status_code == 200 and "NovoPhone X" in first.get_data(as_text=True)
+    assert len(response_cache._cache) == 1
+
+    def saturated(session_uuid, model, timeout=None):
+        raise AssertionError("admissão chamada num acerto do cache")
+    monkeypatch.setattr(chat_client, "admit", saturated)
+    response = turn()
+    assert response.status_code == 200
+    assert "NovoPhone X" in response.get_data(as_text=True)
+
+
+def test_entries_expire_and_are_evicted_lru(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    cache = response_cache.ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", ANSWER, 1.0)
+    cache.put("b", ANSWER, 1.0)
+    cache.get("a")
+    cache.put("c", ANSWER, 1.0)
+    # "b" era o menos usado.
+    assert cache.get("b") is None and cache.get("a") is not None
+    clock.now += 61
+    assert cache.get("a") is None and len(cache) == 1
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+import utils.response_parser as response_parser
+from utils.response_parser import _extract_object, parse_llm_response
+
+RESPOSTA = {"chat_state": "ajuda_na_escolha", "resposta": "Olá!"}
+
+
+class CountingDecoder:
+    """Decodificador que conta as chamadas a raw_decode."""
+
+    def __init__(self):
+        self.calls = 0
+        self._decoder = json.JSONDecoder()
+
+    def raw_decode(self, text, start):
+        self.calls += 1
+        return self._decoder.raw_decode(text, start)
+
+
+@pytest.fixture
+def decoder(monkeypatch):
+    counting = CountingDecoder()
+    monkeypatch.setattr(response_parser, "_decoder", counting)
+    return counting
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps(RESPOSTA),
+    "Claro! Segue:\n```json\n" + json.dumps(RESPOSTA) + "\n```\nQualquer dúvida, chame.",
+    'Formato {com chaves} e {"sem": "resposta"} antes. ' + json.dumps(RESPOSTA) + " {lixo",
+    '{"meta": {"resposta": "Olá!"}}',
+])
+def test_finds_first_object_with_resposta(text):
+    obj = _extract_object(text)
+    assert obj is not None and obj["resposta"] == "Olá!"
+
+
+def test_braces_inside_strings_do_not_change_depth():
+    text = '{"resposta": "use { e } à vontade \\" {", "chat_state": "x"} depois'
+    assert _extract_object(text) == {"resposta": 'use { e } à vontade " {', "chat_state": "x"}
+
+
+def test_closed_inner_object_of_truncated_json_is_found():
+    text = '{"chat_state": "x", "dados": {"resposta": "interna"}, "cart": [{"nome": "Nov'
+    assert _extract_object(text) == {"resposta": "interna"}
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "Desculpe, não entendi.",
+    '{"chat_state": "x", "message": "sem o campo"}',
+    '{"chat_state": "x", "resposta": "trunc',
+    "{" * 5000,
+    '{"a": ' * 5000,
+], ids=["vazio", "texto", "sem_resposta", "resposta_truncada", "chaves_abertas", "aninhado_fundo"])
+def test_returns_none_without_usable_object(text):
+    assert _extract_object(text) is None
+
+
+def test_truncated_nesting_is_decoded_once(decoder):
+    # Antes: raw_decode a partir de cada '{', cada um lendo até o fim do texto (O(n²)).
+    assert _extract_object('{"a": ' * 2000) is None
+    assert decoder.calls == 1
+
+
+def test_truncated_cart_decodes_each_item_once(decoder):
+    items = 500
+    text = '{"chat_state": "x", "cart": [' + '{"nome": "NovoPhone X12", "preço": "3.499,00"}, ' * items + '{"nome": "Nov'
+    assert _extract_object(text) is None
+    assert decoder.calls == 1 + items
+
+
+def test_valid_nested_object_without_resposta_is_not_redecoded(decoder):
+    text = '{"a": ' * 300 + "1" + "}" * 300 + " " + json.dumps(RESPOSTA)
+    assert _extract_object(text) == RESPOSTA
+    assert decoder.calls == 2
+
+
+def test_trailing_comma_is_repaired():
+    parsed = parse_llm_response('{"chat_state": "x", "resposta": "Olá!", "cart": [],}')
+    assert parsed.structured and parsed.resposta == "Olá!"
+
+
+def test_truncated_response_falls_back_to_text():
+    text = '{"chat_state": "x", "resposta": "Temos o Novo'
+    parsed = parse_llm_response(text)
+    assert not parsed.structured and parsed.resposta == text
@@ -0,0 +1,194 @@
+import fakeredis
+import pytest
+
+import utils.session_store as session_store
+from utils.session_store import (
+    HISTORY_KEY, MemorySessionStore, RedisSessionStore, ServerSideSession, ServerSideSessionInterface,
+    SQLiteSessionStore, dumps, loads
+)
+
+
+class Clock:
+    """Substitui o módulo `time` em utils.session_store: o teste decide quando o tempo passa."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class RecordingStore:
+    """Repassa ao backend e guarda cada gravação (método, estado, histórico)."""
+
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def load(self, session_uuid):
+        return self.store.load(session_uuid)
+
+    def replace(self, session_uuid, state_blob, history_blobs):
+        self.writes.append(("replace", state_blob, list(history_blobs)))
+        return self.store.replace(session_uuid, state_blob, history_blobs)
+
+    def append(self, session_uuid, state_blob, history_blobs):
+        self.writes.append(("append", state_blob, list(history_blobs)))
+        return self.store.append(session_uuid, state_blob, history_blobs)
+
+    def delete(self, session_uuid):
+        self.writes.append(("delete", None, []))
+        return self.store.delete(session_uuid)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return RecordingStore(SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl_seconds=60))
+    if request.param == "redis":
+        return RecordingStore(RedisSessionStore(ttl_seconds=60, client=fakeredis.FakeStrictRedis()))
+    return RecordingStore(MemorySessionStore())
+
+
+def _turn(session, text):
+    session[HISTORY_KEY] = session.get(HISTORY_KEY, []) + [{"role": "user", "content": text}]
+
+
+def _reopen(store, session_uuid):
+    state_blob, history_blobs = store.load(session_uuid)
+    state = loads(state_blob)
+    state[HISTORY_KEY] = [loads(blob) for blob in history_blobs]
+    return ServerSideSession(state, session_uuid=session_uuid, state_blob=state_blob, history_len=len(history_blobs))
+
+
+def test_state_is_rewritten_only_when_it_changes(store):
+    interface = ServerSideSessionInterface(store)
+    session = ServerSideSession({"session_uuid": "s1", "chat_state": "inicio"})
+    interface.persist(session)
+    assert [w[0] for w in store.writes] == ["replace"]
+
+    store.writes.clear()
+    interface.persist(session)
+    assert store.writes == []
+
+    _turn(session, "oi")
+    interface.persist(session)
+    # Só o histórico mudou: o estado não é regravado.
+    assert store.writes == [("append", None, [dumps({"role": "user", "content": "oi"})])]
+
+    store.writes.clear()
+    session["chat_state"] = "ajuda_na_escolha"
+    interface.persist(session)
+    (method, state_blob, history), = store.writes
+    assert method == "append" and history == []
+    assert loads(state_blob) == {"session_uuid": "s1", "chat_state": "ajuda_na_escolha"}
+
+
+def test_history_appends_replay_in_order_across_requests(store):
+    interface = ServerSideSessionInterface(store)
+    session = ServerSideSession({"session_uuid": "s1"})
+    interface.persist(session)
+    for text in ("um", "dois", "três", "quatro"):
+        # Cada turno é uma requisição nova, que relê a sessão do backend.
+        session = _reopen(store, "s1")
+        _turn(session, text)
+        interface.persist(session)
+    assert [entry["content"] for entry in _reopen(store, "s1")[HISTORY_KEY]] == ["um", "dois", "três", "quatro"]
+    assert {w[0] for w in store.writes} == {"replace", "append"}
+
+
+def test_truncated_history_is_rewritten_whole(store):
+    interface = ServerSideSessionInterface(store)
+    session = ServerSideSession({"session_uuid": "s1"})
+    for text in ("um", "dois", "três"):
+        _turn(session, text)
+    interface.persist(session)
+    session[HISTORY_KEY] = session[HISTORY_KEY][-1:]
+    interface.persist(session)
+    assert store.writes[-1][0] == "replace"
+    assert [entry["content"] for entry in _reopen(store, "s1")[HISTORY_KEY]] == ["três"]
+
+
+def test_session_missing_from_the_backend_is_recreated(store):
+    interface = ServerSideSessionInterface(store)
+    session = ServerSideSession({"session_uuid": "s1"})
+    _turn(session, "um")
+    interface.persist(session)
+    # Descartada (LRU na memória) ou expirada entre dois turnos.
+    store.store.delete("s1")
+    _turn(session, "dois")
+    session["chat_state"] = "ajuda_na_escolha"
+    interface.persist(session)
+    assert store.writes[-1][0] == "replace"
+    reopened = _reopen(store, "s1")
+    assert [entry["content"] for entry in reopened[HISTORY_KEY]] == ["um", "dois"]
+    assert reopened["chat_state"] == "ajuda_na_escolha"
+
+
+def test_memory_store_append_to_evicted_session_writes_nothing():
+    store = MemorySessionStore(max_sessions=1)
+    store.replace("s1", b"a", [])
+    store.replace("s2", b"b", [])
+    assert store.append("s1", b"c", [b"x"]) is False
+    assert store.load("s1") is None
+
+
+def test_sqlite_sessions_expire_and_are_purged_periodically(monkeypatch, tmp_path):
+    clock = Clock()
+    monkeypatch.setattr(session_store, "time", clock)
+    store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl_seconds=60, purge_interval=300)
+    store.replace("old", b"estado", [b"h1", b"h2"])
+
+    clock.now += 61
+    assert store.load("old") is None
+    # Expirada, a sessão não é estendida: o chamador a regrava inteira.
+    assert store.append("old", None, [b"h3"]) is False
+
+    conn = store._connection()
+    count = lambda table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    assert count("chat_sessions") == 1
+    # A limpeza roda durante uma gravação qualquer, assim que o intervalo vence.
+    clock.now += 300
+    store.replace("new", b"estado", [b"h1"])
+    assert count("chat_sessions") == 1 and count("chat_history") == 1
+    assert store.load("new") == (b"estado", [b"h1"])
+
+
+def test_redis_keys_carry_the_ttl():
+    client = fakeredis.FakeStrictRedis()
+    store = RedisSessionStore(ttl_seconds=60, client=client)
+    store.replace("s1", b"estado", [b"h1"])
+    store.append("s1", None, [b"h2"])
+    for key in RedisSessionStore._keys("s1"):
+        assert 0 < client.ttl(key) <= 60
+
+
+@pytest.fixture
+def chat_client(monkeypatch, tmp_path):
+    import app as flask_app_module
+    from testing.fakes import FakeFirestore
+    store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl_seconds=60)
+    monkeypatch.setattr(flask_app_module.app, "session_interface", ServerSideSessionInterface(store))
+    monkeypatch.setattr(flask_app_module, "db", FakeFirestore())
+    monkeypatch.setattr(flask_app_module, "queue_session_save", lambda db, session: None)
+    return flask_app_module.app.test_client(), store
+
+
+@pytest.mark.parametrize("route", ["/send_message", "/send_message_stream"])
+def test_turn_for_a_session_gone_from_the_backend_restarts_the_chat(chat_client, route):
+    client, store = chat_client
+    client.post("/initialize_chat")
+    (old_uuid,) = [row[0] for row in store._connection().execute("SELECT uuid FROM chat_sessions")]
+    # Expirada, ou o turno caiu em outro container com o próprio arquivo sqlite.
+    store.delete(old_uuid)
+
+    response = client.post(route, json={"user_input": "Maria Silva"})
+    assert response.status_code == 409
+    body = response.get_json()
+    assert body["bot_response"].startswith("Sua conversa anterior expirou")
+    assert body["chat_state"] == "ajuda_na_escolha"
+    (new_uuid,) = [row[0] for row in store._connection().execute("SELECT uuid FROM chat_sessions")]
+    assert new_uuid != old_uuid
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from utils.stream_parser import RespostaStreamExtractor
+
+
+def stream(completion, size=1):
+    extractor = RespostaStreamExtractor()
+    text = "".join(extractor.feed(completion[i:i + size]) for i in range(0, len(completion), size))
+    return text, extractor
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 1000])
+def test_decodes_escapes_across_chunk_boundaries(size):
+    resposta = 'Olá "cliente"\n\ttudo bem? 😀 R$ 3.499,00 \\ / fim'
+    completion = "```json\n" + json.dumps({"resposta": resposta, "chat_state": "ajuda_na_escolha"}) + "\n```"
+    text, extractor = stream(completion, size)
+    assert text == resposta
+    assert extractor.found and extractor.closed
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+@pytest.mark.parametrize("raw, expected", [
+    ("pre\\u00zzo", "pre\\u00zzo"),
+    ("fim\\u", "fim\\u"),
+    ("x\\ud83d", "x\\ud83d"),
+    ("\\ud83d\\u0041", "\\ud83dA"),
+    ("\\ud83d\\n", "\\ud83d\n"),
+    ("\\ude00 ok", "\\ude00 ok"),
+])
+def test_malformed_unicode_escape_is_emitted_raw(raw, expected, size):
+    completion = '{"resposta": "' + raw + '", "chat_state": "ajuda_na_escolha"}'
+    text, extractor = stream(completion, size)
+    assert text == expected
+    # O valor termina nas aspas certas e o restante do objeto continua sendo lido.
+    assert extractor.found and extractor.closed
+    text.encode("utf-8")
+
+
+def test_truncated_escape_waits_for_more_data():
+    extractor = RespostaStreamExtractor()
+    assert extractor.feed('{"resposta": "Pre\\u00') == "Pre"
+    assert extractor.feed("e") == ""
+    assert extractor.feed('7o"}') == "ço"
+    assert extractor.closed
+
+
+def test_high_surrogate_waits_for_low_half():
+    extractor = RespostaStreamExtractor()
+    assert extractor.feed('{"resposta": "\\ud83d') == ""
+    assert extractor.feed("\\ude") == ""
+    assert extractor.feed('00"}') == "😀"
+
+
+def test_non_string_resposta_is_skipped():
+    text, extractor = stream('{"resposta": 42, "outro": {"resposta": "x"}}')
+    assert text == ""
+    assert not extractor.found and extractor.closed
+
+
+def test_preamble_and_nested_field_are_ignored():
+    text, _ = stream('Claro! {"meta": {"resposta": "não"}, "resposta": "sim"}')
+    assert text == "sim"
@@ -0,0 +1,140 @@
+import io
+import time
+
+import pytest
+import requests
+
+import utils.transport as transport
+from utils.transport import CircuitBreaker, CircuitOpenError, post_with_retry
+
+RESET_SECONDS = 0.05
+
+
+def _response(status):
+    response = requests.Response()
+    response.status_code = status
+    response.url = "http://llm.test/"
+    response.raw = io.BytesIO()
+    return response
+
+
+class StubSession:
+    """Sessão HTTP que devolve (ou lança) os resultados roteirizados, um por chamada."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome if isinstance(outcome, requests.Response) else _response(outcome)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker("stub", failure_threshold=2, reset_seconds=RESET_SECONDS)
+    monkeypatch.setitem(transport._breakers, "stub", breaker)
+    return breaker
+
+
+def _use(monkeypatch, session):
+    monkeypatch.setattr(transport, "get_http_session", lambda: session)
+    return session
+
+
+def _call():
+    return post_with_retry("stub", "model", "http://llm.test/", max_retries=0)
+
+
+def _open(monkeypatch, breaker):
+    _use(monkeypatch, StubSession(503, 503))
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            _call()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        _call()
+    time.sleep(RESET_SECONDS * 1.5)
+
+
+def test_opens_after_consecutive_failures_and_closes_on_success(monkeypatch, breaker):
+    _open(monkeypatch, breaker)
+    _use(monkeypatch, StubSession(200))
+    assert _call().status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_half_open_trial_with_client_error_closes_the_circuit(monkeypatch, breaker):
+    _open(monkeypatch, breaker)
+    session = _use(monkeypatch, StubSession(400, 200))
+    with pytest.raises(requests.exceptions.HTTPError):
+        _call()
+    assert breaker.state == "closed"
+    assert _call().status_code == 200
+    assert session.calls == 2
+
+
+def test_half_open_trial_with_unexpected_error_reopens_the_circuit(monkeypatch, breaker):
+    _open(monkeypatch, breaker)
+    _use(monkeypatch, StubSession(requests.exceptions.ChunkedEncodingError("conexão cortada")))
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        _call()
+    assert breaker.state == "open"
+    time.sleep(RESET_SECONDS * 1.5)
+    _use(monkeypatch, StubSession(200))
+    assert _call().status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_abandoned_half_open_trial_expires(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(RESET_SECONDS * 1.5)
+    assert breaker.allow()
+    # A chamada de teste nunca registra resultado: ninguém mais passa até o prazo vencer.
+    assert not breaker.allow()
+    time.sleep(RESET_SECONDS * 1.5)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+
+
+def test_client_errors_are_not_retried(monkeypatch, breaker):
+    session = _use(monkeypatch, StubSession(404, 200))
+    with pytest.raises(requests.exceptions.HTTPError):
+        post_with_retry("stub", "model", "http://llm.test/", max_retries=2)
+    assert session.calls == 1
+    assert breaker.state == "closed"
+
+
+class RecordingSession(StubSession):
+    """StubSession que guarda o timeout de cada tentativa."""
+
+    def __init__(self, *outcomes):
+        super().__init__(*outcomes)
+        self.timeouts = []
+
+    def post(self, url, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        return super().post(url, **kwargs)
+
+
+def test_attempt_timeouts_shrink_to_fit_the_deadline(monkeypatch, breaker):
+    monkeypatch.setattr(transport, "backoff_delay", lambda attempt, response=None: 0.05)
+    session = _use(monkeypatch, RecordingSession(503, 503, 200))
+    assert post_with_retry("stub", "model", "http://llm.test/", max_retries=2, deadline=0.5, timeout=60).status_code == 200
+    first, second, third = session.timeouts
+    assert first <= 0.5 and second <= first - 0.05 and third <= second - 0.05
+
+
+def test_no_retry_when_the_wait_does_not_fit_the_deadline(monkeypatch, breaker):
+    response = _response(429)
+    response.headers["Retry-After"] = "5"
+    session = _use(monkeypatch, StubSession(response, 200))
+    start = time.monotonic()
+    with pytest.raises(requests.exceptions.HTTPError):
+        post_with_retry("stub", "model", "http://llm.test/", max_retries=2, deadline=1)
+    assert session.calls == 1
+    assert time.monotonic() - start < 0.5
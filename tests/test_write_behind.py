@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from utils.dashboard import dashboard_from_rollups, dashboard_from_sessions, ROLLUPS_COLLECTION
+from testing.fakes import FakeAsyncFirestore, FakeFirestore, FakeFirestoreError
+from utils.firebase import async_save_session_to_firestore, save_session_to_firestore
+import utils.write_behind as write_behind
+from utils.write_behind import SessionWriteBehindQueue
+
+
+def _session(state="ajuda_na_escolha"):
+    return {"session_uuid": "s1", "chat_state": state, "ab_test_group": "A",
+            "customer_data": {"cart": []}, "total_value": 0.0}
+
+
+def _states(db):
+    totals = Counter()
+    for doc in db.collection(ROLLUPS_COLLECTION).stream():
+        totals.update(doc.to_dict()["states"])
+    return {state: count for state, count in totals.items() if count}
+
+
+def _assert_rollups_match_sessions(db):
+    sessions = [doc.to_dict() for doc in db.collection('sessions').stream()]
+    assert dashboard_from_rollups(db.collection(ROLLUPS_COLLECTION).stream()) == dashboard_from_sessions(sessions)
+
+
+@pytest.fixture
+def queues():
+    created = []
+
+    def make(db):
+        # Intervalo longo: os testes decidem quando cada fila grava.
+        queue = SessionWriteBehindQueue(db, flush_interval=3600, max_pending=1000)
+        created.append(queue)
+        return queue
+    yield make
+    for queue in created:
+        queue.close()
+
+
+def test_updates_of_a_session_are_coalesced_into_one_write(queues):
+    db = FakeFirestore()
+    queue = queues(db)
+    session = _session()
+    queue.enqueue(session)
+    session["chat_state"] = "AWAITING_NAME"
+    queue.enqueue(session)
+    assert queue.flush() == 1
+    assert queue.flush() == 0
+    assert db.collection('sessions').document("s1").get().to_dict()["final_state"] == "AWAITING_NAME"
+    _assert_rollups_match_sessions(db)
+
+
+def test_final_state_is_written_without_waiting_for_the_interval(queues):
+    db = FakeFirestore()
+    queues(db).enqueue(_session("proposta_final"))
+    deadline = time.monotonic() + 2
+    while not db.collection('sessions').document("s1").get().exists:
+        assert time.monotonic() < deadline, "sessão finalizada não foi gravada"
+        time.sleep(0.01)
+
+
+def test_older_record_from_another_worker_does_not_overwrite_a_newer_one(queues):
+    db = FakeFirestore()
+    worker_a, worker_b = queues(db), queues(db)
+    session = _session("AWAITING_PHONE")
+    # O turno do telefone fica pendente no worker A; o turno seguinte da mesma sessão cai no worker B.
+    worker_a.enqueue(session)
+    session["chat_state"] = "proposta_final"
+    worker_b.enqueue(session)
+    assert worker_b.flush() == 1
+    assert worker_a.flush() == 0
+
+    stored = db.collection('sessions').document("s1").get().to_dict()
+    assert stored["final_state"] == "proposta_final"
+    assert _states(db) == {"proposta_final": 1}
+    _assert_rollups_match_sessions(db)
+
+
+def test_failed_flush_does_not_shift_the_rollups(queues):
+    db = FakeFirestore()
+    worker_a, worker_b = queues(db), queues(db)
+    session = _session()
+    worker_a.enqueue(session)
+    worker_a.flush()
+
+    db.error_rate = 1.0
+    session["chat_state"] = "AWAITING_NAME"
+    worker_a.enqueue(session)
+    assert worker_a.flush() == 0
+    assert worker_a.depth() == 1
+    assert _states(db) == {"ajuda_na_escolha": 1}
+
+    # O worker A morre com o registro pendente; o próximo turno da sessão é gravado pelo worker B.
+    worker_a._pending.clear()
+    db.error_rate = 0.0
+    session["chat_state"] = "AWAITING_EMAIL"
+    worker_b.enqueue(session)
+    assert worker_b.flush() == 1
+    assert _states(db) == {"AWAITING_EMAIL": 1}
+    _assert_rollups_match_sessions(db)
+
+
+def test_saves_queued_after_a_mid_run_flush_are_still_written(monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_ENABLED", True)
+    db = FakeFirestore()
+    session = _session()
+    write_behind.queue_session_save(db, session)
+    write_behind.flush_session_writes()
+    # A fila parada não é reaproveitada: o próximo save ganha uma fila com thread própria.
+    session["chat_state"] = "AWAITING_NAME"
+    write_behind.queue_session_save(db, session)
+    assert write_behind.get_write_behind_queue(db)._thread.is_alive()
+    write_behind.flush_session_writes()
+    assert db.collection('sessions').document("s1").get().to_dict()["final_state"] == "AWAITING_NAME"
+
+
+def test_failed_direct_save_is_recovered_by_the_next_one():
+    db = FakeFirestore(error_rate=1.0)
+    session = _session()
+    save_session_to_firestore(db, session)
+    assert not db.collection('sessions').document("s1").get().exists
+
+    db.error_rate = 0.0
+    session["chat_state"] = "proposta_final"
+    save_session_to_firestore(db, session)
+    save_session_to_firestore(db, session)
+    assert _states(db) == {"proposta_final": 1}
+    _assert_rollups_match_sessions(db)
+
+
+def test_turn_seq_grows_with_each_saved_record():
+    db = FakeFirestore()
+    session = _session()
+    for _ in range(3):
+        save_session_to_firestore(db, session)
+    assert session["turn_seq"] == 3
+    assert db.collection('sessions').document("s1").get().to_dict()["turn_seq"] == 3
+
+
+def test_legacy_document_without_turn_seq_is_overwritten():
+    db = FakeFirestore()
+    db.collection('sessions').document("s1").set({"session_uuid": "s1", "final_state": "ajuda_na_escolha"})
+    session = _session("AWAITING_NAME")
+    save_session_to_firestore(db, session)
+    assert db.collection('sessions').document("s1").get().to_dict()["final_state"] == "AWAITING_NAME"
+
+
+def test_async_save_skips_stale_records():
+    async_db = FakeAsyncFirestore()
+    session = _session("proposta_final")
+    stale = dict(_session("AWAITING_PHONE"), turn_seq=0)
+    asyncio.run(async_save_session_to_firestore(async_db, session))
+    asyncio.run(async_save_session_to_firestore(async_db, stale))
+    db = async_db.sync_db
+    assert db.collection('sessions').document("s1").get().to_dict()["final_state"] == "proposta_final"
+    assert _states(db) == {"proposta_final": 1}
+
+
+def _read_in_transaction(db, doc_id):
+    transaction = db.transaction()
+    transaction._begin()
+    transaction.get_all([db.collection('sessions').document(doc_id)])
+    transaction._rollback()
+
+
+def test_transaction_rolls_back_on_commit_failure():
+    db = FakeFirestore(error_rate=1.0)
+    reference = db.collection('sessions').document("s1")
+    with pytest.raises(FakeFirestoreError):
+        transaction = db.transaction()
+        transaction._begin()
+        transaction.get_all([reference])
+        transaction.set(reference, {"x": 1})
+        transaction._commit()
+    # O documento foi destravado: uma transação de outra thread consegue lê-lo.
+    reader = threading.Thread(target=_read_in_transaction, args=(db, "s1"))
+    reader.start()
+    reader.join(timeout=1)
+    assert not reader.is_alive()
+    assert not reference.get().exists
+
+
+def test_transactions_lock_only_the_documents_they_read():
+    db = FakeFirestore()
+    transaction = db.transaction()
+    transaction._begin()
+    transaction.get_all([db.collection('sessions').document("s1")])
+
+    other_doc = threading.Thread(target=_read_in_transaction, args=(db, "s2"))
+    other_doc.start()
+    other_doc.join(timeout=1)
+    assert not other_doc.is_alive()
+
+    same_doc = threading.Thread(target=_read_in_transaction, args=(db, "s1"))
+    same_doc.start()
+    same_doc.join(timeout=0.1)
+    assert same_doc.is_alive()
+    transaction._rollback()
+    same_doc.join(timeout=1)
+    assert not same_doc.is_alive()
@@ -0,0 +1,536 @@
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from utils import llm, metrics
+from utils.constants import (
+    GEMINI_MODEL_LABEL, ADMISSION_CONTROL_ENABLED,
+    SESSION_RATE_LIMIT_PER_MINUTE, SESSION_RATE_LIMIT_BURST,
+    LLM_MAX_CONCURRENCY_PER_MODEL, HEDGE_RESERVED_SLOTS_PER_MODEL, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL,
+    SESSION_BACKEND, SESSION_SQLITE_PATH, SESSION_REDIS_URL
+)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Sessões com token bucket em memória; as mais antigas são descartadas (voltam com o bucket cheio).
+MAX_TRACKED_SESSIONS = 10000
+# Amostras de tempo de uso de um slot necessárias antes de estimar a espera na fila.
+MIN_HOLD_SAMPLES = 20
+
+
+class AdmissionRejected(Exception):
+    """O turno não foi admitido: `reason` é "session_rate", "queue_full", "deadline" ou "timeout"."""
+
+    def __init__(self, reason, model, retry_after):
+        super().__init__(f"Turno rejeitado ({reason}) para o modelo {model}")
+        self.reason = reason
+        self.model = model
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def refill(tokens, updated, now, rate, burst):
+    """Fichas do bucket em `now`, repostas à taxa de `rate` por segundo desde `updated`, até `burst`."""
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+def wait_for_token(tokens, rate):
+    """Segundos até haver uma ficha inteira."""
+    return (1 - tokens) / rate if rate > 0 else float("inf")
+
+
+class TokenBucket:
+    """`burst` fichas, repostas à taxa de `rate` por segundo; cada turno consome uma."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        """Consome uma ficha; retorna 0 se havia, ou os segundos até a próxima."""
+        self.tokens = refill(self.tokens, self.updated, now, self.rate, self.burst)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return wait_for_token(self.tokens, self.rate)
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class SessionRateLimiter:
+    """Token bucket por session_uuid em memória (por processo), limitado a MAX_TRACKED_SESSIONS sessões.
+
+    Serve aos backends de sessão "memory" e "cookie"; com "sqlite" ou "redis" os buckets ficam no
+    mesmo armazenamento das sessões e valem para todos os workers (ver `create_session_rate_limiter`).
+    """
+
+    def __init__(self, per_minute=SESSION_RATE_LIMIT_PER_MINUTE, burst=SESSION_RATE_LIMIT_BURST):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, session_uuid, model):
+        """Consome uma ficha da sessão ou lança AdmissionRejected("session_rate")."""
+        wait = self._take(session_uuid)
+        if wait:
+            raise AdmissionRejected("session_rate", model, wait)
+
+    def refund(self, session_uuid):
+        """Devolve a ficha de um turno que não chegou a ser atendido."""
+        with self._lock:
+            bucket = self._buckets.get(session_uuid)
+            if bucket is not None:
+                bucket.give_back()
+
+    def _take(self, session_uuid):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(session_uuid, None) or TokenBucket(self.rate, self.burst, now)
+            self._buckets[session_uuid] = bucket
+            if len(self._buckets) > MAX_TRACKED_SESSIONS:
+                self._buckets.popitem(last=False)
+            return bucket.take(now)
+
+
+class SQLiteSessionRateLimiter(SessionRateLimiter):
+    """Buckets numa tabela do SQLite das sessões: compartilhados entre os workers do container."""
+
+    def __init__(self, per_minute=SESSION_RATE_LIMIT_PER_MINUTE, burst=SESSION_RATE_LIMIT_BURST, path=SESSION_SQLITE_PATH):
+        super().__init__(per_minute, burst)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS admission_buckets (uuid TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+
+    def _connection(self):
+        # Uma conexão por thread e por processo, como em SQLiteSessionStore.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _update(self, session_uuid, change):
+        """Aplica `change(fichas) -> (fichas, espera)` ao bucket numa transação; retorna a espera."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated_at FROM admission_buckets WHERE uuid = ?", (session_uuid,)).fetchone()
+            tokens = refill(row[0], row[1], now, self.rate, self.burst) if row else float(self.burst)
+            tokens, wait = change(tokens)
+            conn.execute("INSERT OR REPLACE INTO admission_buckets (uuid, tokens, updated_at) VALUES (?, ?, ?)", (session_uuid, tokens, now))
+            if row is None:
+                # Um bucket parado por mais tempo que uma recarga completa equivale a um bucket novo.
+                idle = self.burst / self.rate if self.rate > 0 else 86400
+                conn.execute("DELETE FROM admission_buckets WHERE updated_at < ?", (now - idle,))
+        return wait
+
+    def _take(self, session_uuid):
+        return self._update(session_uuid, lambda tokens: (tokens - 1, 0.0) if tokens >= 1 else (tokens, wait_for_token(tokens, self.rate)))
+
+    def refund(self, session_uuid):
+        self._update(session_uuid, lambda tokens: (min(self.burst, tokens + 1), 0.0))
+
+
+class RedisSessionRateLimiter(SessionRateLimiter):
+    """Buckets no Redis das sessões (hash por sessão, atualizado por um script Lua atômico)."""
+
+    # ARGV: taxa (fichas/s), burst, agora, custo (1 consome, -1 devolve), TTL da chave.
+    _SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if cost > 0 then
+    if tokens >= 1 then
+        tokens = tokens - 1
+    elseif rate > 0 then
+        wait = (1 - tokens) / rate
+    else
+        wait = -1
+    end
+else
+    tokens = math.min(burst, tokens - cost)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return tostring(wait)
+"""
+
+    def __init__(self, per_minute=SESSION_RATE_LIMIT_PER_MINUTE, burst=SESSION_RATE_LIMIT_BURST, url=SESSION_REDIS_URL, client=None):
+        super().__init__(per_minute, burst)
+        if client is None and redis is None:
+            raise RuntimeError("Pacote 'redis' não instalado; necessário para SESSION_BACKEND=redis.")
+        self.client = client or redis.Redis.from_url(url)
+        self._script = self.client.register_script(self._SCRIPT)
+        self._ttl = max(60, math.ceil(self.burst / self.rate)) if self.rate > 0 else 86400
+
+    def _call(self, session_uuid, cost):
+        wait = float(self._script(keys=[f"admission_bucket:{session_uuid}"], args=[self.rate, self.burst, time.time(), cost, self._ttl]))
+        return float("inf") if wait < 0 else wait
+
+    def _take(self, session_uuid):
+        return self._call(session_uuid, 1)
+
+    def refund(self, session_uuid):
+        self._call(session_uuid, -1)
+
+
+def create_session_rate_limiter(backend=None):
+    """Limitador por sessão no mesmo armazenamento das sessões (padrão: SESSION_BACKEND)."""
+    backend = backend or SESSION_BACKEND
+    per_minute, burst = SESSION_RATE_LIMIT_PER_MINUTE, SESSION_RATE_LIMIT_BURST
+    if backend == "sqlite":
+        return SQLiteSessionRateLimiter(per_minute, burst, SESSION_SQLITE_PATH)
+    if backend == "redis":
+        return RedisSessionRateLimiter(per_minute, burst, SESSION_REDIS_URL)
+    return SessionRateLimiter(per_minute, burst)
+
+
+class _Waiter:
+    def __init__(self, session_uuid):
+        self.session_uuid = session_uuid
+        self.event = threading.Event()
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        self.event.set()
+
+
+class _AsyncWaiter:
+    def __init__(self, session_uuid):
+        self.session_uuid = session_uuid
+        self.future = asyncio.get_running_loop().create_future()
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairGate:
+    """Limite de chamadas simultâneas a um modelo, com fila justa entre sessões.
+
+    Quem não consegue um slot espera numa fila limitada a `max_queue`, atendida em rodízio
+    entre as sessões (uma sessão com vários turnos pendentes não passa na frente das outras).
+    O turno é descartado na hora se a espera estimada já passa do prazo, ou quando o prazo vence.
+    Além de `limit`, há `reserved` slots que só `try_acquire` (a reserva do hedging) ocupa.
+    """
+
+    def __init__(self, model, limit=LLM_MAX_CONCURRENCY_PER_MODEL, max_queue=ADMISSION_MAX_QUEUE,
+                 reserved=HEDGE_RESERVED_SLOTS_PER_MODEL):
+        self.model = model
+        self.limit = limit
+        self.max_queue = max_queue
+        self.reserved = reserved
+        self.active = 0
+        self.reserved_active = 0
+        self.waiting = 0
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+
+    def estimated_wait(self, position):
+        """Espera estimada para o `position`-ésimo da fila, pelo tempo mediano de uso de um slot."""
+        hold = metrics.get_histogram("admission_slot_seconds", model=self.model)
+        if hold.count < MIN_HOLD_SAMPLES:
+            return 0.0
+        return math.ceil(position / self.limit) * hold.quantile(0.5)
+
+    def acquire(self, session_uuid, deadline):
+        """Bloqueia até haver slot ou lança AdmissionRejected; retorna os segundos de espera."""
+        start = time.monotonic()
+        waiter = self._enqueue(session_uuid, start, deadline, _Waiter)
+        if waiter is None:
+            return 0.0
+        waiter.event.wait(max(0.0, deadline - time.monotonic()))
+        self._leave_queue(waiter)
+        return time.monotonic() - start
+
+    def _enqueue(self, session_uuid, start, deadline, waiter_class):
+        """Ocupa um slot livre (retorna None) ou entra na fila da sessão (retorna o `waiter_class` criado)."""
+        with self._lock:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self._update_gauges()
+                return None
+            if self.waiting >= self.max_queue:
+                raise AdmissionRejected("queue_full", self.model, self.estimated_wait(self.waiting + 1))
+            expected = self.estimated_wait(self.waiting + 1)
+            if start + expected > deadline:
+                raise AdmissionRejected("deadline", self.model, expected)
+            waiter = waiter_class(session_uuid)
+            self._queues.setdefault(session_uuid, deque()).append(waiter)
+            self.waiting += 1
+            self._update_gauges()
+            return waiter
+
+    def _leave_queue(self, waiter):
+        """Depois da espera: nada a fazer se o slot foi passado ao `waiter`, senão o tira da fila e lança AdmissionRejected("timeout")."""
+        with self._lock:
+            if waiter.granted:
+                return
+            # Prazo vencido na fila: sai sem ter ocupado slot.
+            queue = self._queues.get(waiter.session_uuid)
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.session_uuid]
+            self.waiting -= 1
+            self._update_gauges()
+            raise AdmissionRejected("timeout", self.model, self.estimated_wait(self.waiting + 1))
+
+    def try_acquire(self):
+        """Ocupa um slot sem esperar: um normal, se houver livre e ninguém esperando, ou um dos reservados.
+
+        Retorna "normal", "reserved" ou None se não houver slot.
+        """
+        with self._lock:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                kind = "normal"
+            elif self.reserved_active < self.reserved:
+                self.reserved_active += 1
+                kind = "reserved"
+            else:
+                return None
+            self._update_gauges()
+            return kind
+
+    def release(self, reserved=False):
+        with self._lock:
+            if reserved:
+                self.reserved_active -= 1
+            elif self._queues:
+                # Passa o slot para a próxima sessão do rodízio, que vai para o fim da fila.
+                session_uuid, queue = next(iter(self._queues.items()))
+                waiter = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(session_uuid)
+                else:
+                    del self._queues[session_uuid]
+                self.waiting -= 1
+                waiter.wake()
+            else:
+                self.active -= 1
+            self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge("admission_in_flight", self.active + self.reserved_active, model=self.model)
+        metrics.set_gauge("admission_queue_depth", self.waiting, model=self.model)
+
+
+class AsyncFairGate(FairGate):
+    """FairGate para o event loop do async_app: a espera na fila é uma future, sem ocupar thread.
+
+    Mesmas regras de fila justa e de prazo; sem slots reservados (o hedging só existe no app Flask).
+    Só deve ser usado de dentro do event loop.
+    """
+
+    def __init__(self, model, limit=ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL, max_queue=ADMISSION_MAX_QUEUE):
+        super().__init__(model, limit, max_queue, reserved=0)
+
+    async def acquire(self, session_uuid, deadline):
+        """Espera (sem bloquear o event loop) até haver slot ou lança AdmissionRejected; retorna os segundos de espera."""
+        start = time.monotonic()
+        waiter = self._enqueue(session_uuid, start, deadline, _AsyncWaiter)
+        if waiter is None:
+            return 0.0
+        try:
+            # shield: um slot passado no mesmo instante em que o prazo vence não se perde com o cancelamento.
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # A requisição foi cancelada (ex.: cliente desconectou) enquanto esperava.
+            if waiter.granted:
+                self.release()
+            else:
+                self._abandon(waiter)
+            raise
+        self._leave_queue(waiter)
+        return time.monotonic() - start
+
+    def _abandon(self, waiter):
+        try:
+            self._leave_queue(waiter)
+        except AdmissionRejected:
+            pass
+
+
+class Slot:
+    """Slot de um modelo, devolvido uma única vez por `release()` (ou ao sair do `with`)."""
+
+    def __init__(self, gate, reserved=False):
+        self.gate = gate
+        self.reserved = reserved
+        self.acquired_at = time.monotonic()
+        self._released = gate is None
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        if not self.reserved:
+            # Só os slots normais entram na estimativa de espera da fila.
+            metrics.observe("admission_slot_seconds", time.monotonic() - self.acquired_at, model=self.gate.model)
+        self.gate.release(reserved=self.reserved)
+
+    def handoff(self):
+        """Passa o slot a outro dono (ex.: a thread de uma tentativa), que passa a ser quem o libera."""
+        successor = Slot(self.gate, self.reserved)
+        successor.acquired_at = self.acquired_at
+        successor._released = self._released
+        self._released = True
+        return successor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_gates = {}
+_async_gates = {}
+_gates_lock = threading.Lock()
+_session_limiter = None
+
+
+def get_gate(model):
+    gate = _gates.get(model)
+    if gate is None:
+        with _gates_lock:
+            gate = _gates.setdefault(model, FairGate(model, LLM_MAX_CONCURRENCY_PER_MODEL, ADMISSION_MAX_QUEUE,
+                                                     HEDGE_RESERVED_SLOTS_PER_MODEL))
+    return gate
+
+
+def get_async_gate(model):
+    gate = _async_gates.get(model)
+    if gate is None:
+        with _gates_lock:
+            gate = _async_gates.setdefault(model, AsyncFairGate(model, ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL, ADMISSION_MAX_QUEUE))
+    return gate
+
+
+def _get_session_limiter():
+    global _session_limiter
+    if _session_limiter is None:
+        with _gates_lock:
+            if _session_limiter is None:
+                _session_limiter = create_session_rate_limiter()
+    return _session_limiter
+
+
+def busy_reply(rejection):
+    """Mensagem e status HTTP de um turno não admitido (429 se a sessão excedeu o limite, 503 se o modelo está saturado)."""
+    if rejection.reason == "session_rate":
+        return "Você está enviando mensagens muito rápido. Aguarde alguns segundos e tente novamente.", 429
+    return "Estamos atendendo muitas conversas neste momento. Tente novamente em alguns segundos.", 503
+
+
+def turn_model(session_data, use_openrouter):
+    """Modelo que atende o turno da sessão: o do grupo A/B se `use_openrouter`, senão o Gemini."""
+    return llm._openrouter_model(session_data) if use_openrouter else GEMINI_MODEL_LABEL
+
+
+def admit(session_uuid, model, timeout=None):
+    """Admite um turno que vai chamar o LLM: consome uma ficha da sessão e ocupa um slot do modelo.
+
+    Retorna um `Slot` (liberar ao fim da chamada) ou lança AdmissionRejected em vez de deixar o
+    turno esperar mais que `timeout` (padrão ADMISSION_QUEUE_TIMEOUT_SECONDS) por um slot.
+    """
+    if not ADMISSION_CONTROL_ENABLED:
+        return Slot(None)
+    timeout = ADMISSION_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+    limiter = _get_session_limiter()
+    try:
+        limiter.check(session_uuid, model)
+        gate = get_gate(model)
+        try:
+            waited = gate.acquire(session_uuid, time.monotonic() + timeout)
+        except AdmissionRejected:
+            # O turno não foi atendido por falta de slot: a ficha da sessão volta.
+            limiter.refund(session_uuid)
+            raise
+    except AdmissionRejected as e:
+        _record_rejection(session_uuid, model, e)
+        raise
+    _record_admission(model, waited)
+    return Slot(gate)
+
+
+async def async_admit(session_uuid, model, timeout=None):
+    """`admit` para o async_app: a espera por slot é assíncrona, num AsyncFairGate com
+    ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL slots, e o prazo conta desde a chegada do turno.
+
+    O limitador por sessão (SQLite/Redis, bloqueantes) é consultado no executor padrão.
+    """
+    if not ADMISSION_CONTROL_ENABLED:
+        return Slot(None)
+    timeout = ADMISSION_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    loop = asyncio.get_running_loop()
+    limiter = _get_session_limiter()
+    try:
+        await loop.run_in_executor(None, limiter.check, session_uuid, model)
+        gate = get_async_gate(model)
+        try:
+            waited = await gate.acquire(session_uuid, deadline)
+        except AdmissionRejected:
+            await loop.run_in_executor(None, limiter.refund, session_uuid)
+            raise
+    except AdmissionRejected as e:
+        _record_rejection(session_uuid, model, e)
+        raise
+    _record_admission(model, waited)
+    return Slot(gate)
+
+
+def _record_rejection(session_uuid, model, rejection):
+    metrics.increment("admission_rejected_total", model=model, reason=rejection.reason)
+    logging.warning(f"Turno da sessão {session_uuid} não admitido ({rejection.reason}); tente em {rejection.retry_after}s.")
+
+
+def _record_admission(model, waited):
+    metrics.increment("admission_admitted_total", model=model, queued=str(waited > 0).lower())
+    metrics.observe("admission_queue_wait_seconds", waited, model=model)
+
+
+def try_admit(model):
+    """Slot do modelo sem esperar nem consumir fichas de sessão, para a requisição de reserva do hedging.
+
+    Usa um slot normal livre ou um dos HEDGE_RESERVED_SLOTS_PER_MODEL; None se todos estiverem ocupados.
+    """
+    if not ADMISSION_CONTROL_ENABLED:
+        return Slot(None)
+    gate = get_gate(model)
+    kind = gate.try_acquire()
+    return Slot(gate, reserved=kind == "reserved") if kind else None
+
+
+def reset_admission():
+    """Descarta filas e buckets (os slots ocupados continuam válidos até serem liberados)."""
+    global _session_limiter
+    with _gates_lock:
+        _gates.clear()
+        _async_gates.clear()
+        _session_limiter = None
@@ -0,0 +1,234 @@
+import logging
+import re
+from decimal import Decimal
+from utils import metrics
+from utils.catalog import get_catalog
+from utils.chat import normalize_user_text
+from utils.constants import CART_ENGINE_ENABLED
+from utils.response_parser import format_brl_price, parse_brl_price
+
+# Intenções reconhecidas localmente (sobre o texto já normalizado, sem acentos). Adicionar, remover
+# e finalizar só valem como pedido direto: verbo no imperativo/infinitivo no início da mensagem,
+# depois de até dois "quero", "pode", "na verdade"... ("o X inclui carregador" é pergunta, não pedido).
+_LEAD = r"^(?:(?:na verdade|entao|agora|ok|beleza|por favor|pode|quero|eu quero|gostaria de|queria|vou)\s+){0,2}"
+_ADD_INTENT = re.compile(_LEAD + r"(?:tambem\s+)?(adiciona|adicionar|adicione|acrescenta|acrescentar|acrescente|coloca|colocar|coloque|poe|levar)\b")
+_REMOVE_INTENT = re.compile(_LEAD + r"(?:tambem\s+)?(remove|remover|remova|retira|retirar|retire|exclui|excluir|exclua|deleta|deletar|delete)\b")
+_CHECKOUT_INTENT = re.compile(_LEAD + r"(finaliza|finalizar|finalize|checkout|(fecha|fechar|feche)\s+((a|minha)\s+compra|(o|meu)\s+pedido))\b")
+_TOTAL_INTENT = re.compile(r"\b(total|ver (o )?carrinho|meu carrinho|o que tem no carrinho)\b")
+_CONFIRM = re.compile(r"^(sim |claro )?(sim|s|pode|pode sim|quero|claro|isso|ok|beleza|com certeza|(pode )?(adiciona|adicionar|coloca|colocar)( ele| ela| esse| este| no carrinho)?)( por favor)?$")
+_NEGATION = re.compile(r"\b(nao|nem|nunca)\b")
+# Palavras que não identificam um produto sozinhas.
+_STOPWORDS = frozenset({"de", "do", "da", "com", "pro", "plus", "max", "smart", "x", "s2", "10", "15", "4k", "55"})
+# Estados de coleta de dados: o carrinho não é alterado enquanto o cliente informa nome/email/telefone.
+_DATA_COLLECTION_STATES = frozenset({"AWAITING_NAME", "AWAITING_EMAIL", "AWAITING_PHONE", "PROPOSAL_READY", "proposta_final", "FINALIZED"})
+
+
+def price_to_cents(price):
+    value = parse_brl_price(price)
+    return int(value * 100) if value is not None else None
+
+
+def format_cents(cents):
+    return format_brl_price(Decimal(cents) / 100)
+
+
+class ProductIndex:
+    """Índice do catálogo por id, por nome normalizado e por apelidos.
+
+    Apelidos são palavras do nome ou da categoria que pertencem a um único produto
+    ("novophone", "ultrabook", "tablet").
+
+    Os preços são convertidos para centavos uma única vez, na montagem do índice.
+    """
+
+    def __init__(self, products):
+        self.by_id = {}
+        self.by_name = {}
+        self.aliases = {}
+        token_owners = {}
+        for product in products:
+            cents = price_to_cents(product.get("price"))
+            if cents is None:
+                logging.warning(f"Produto {product.get('id')} ignorado pelo carrinho: preço inválido {product.get('price')!r}.")
+                continue
+            entry = {"id": product["id"], "name": product["name"], "price_cents": cents}
+            self.by_id[product["id"]] = entry
+            normalized = normalize_user_text(product["name"])
+            self.by_name[normalized] = entry
+            for token in set(normalized.split()) | set(normalize_user_text(product.get("category") or "").split()):
+                if len(token) >= 3 and token not in _STOPWORDS:
+                    token_owners.setdefault(token, set()).add(product["id"])
+        # Só palavras que pertencem a um único produto servem de apelido ("novophone", "ultrabook").
+        self.aliases = {token: self.by_id[next(iter(owners))] for token, owners in token_owners.items() if len(owners) == 1}
+
+    def find(self, text):
+        """Produto mencionado em `text` (já normalizado); None se nenhum ou mais de um."""
+        padded = f" {text} "
+        matches = {self.by_name[name]["id"] for name in self.by_name if f" {name} " in padded}
+        matches.update(self.aliases[word]["id"] for word in text.split() if word in self.aliases)
+        if len(matches) == 1:
+            return self.by_id[matches.pop()]
+        return None
+
+    def resolve_item(self, item):
+        """Produto do catálogo correspondente a um item de carrinho ({"id"?, "nome", "preço"})."""
+        if not isinstance(item, dict):
+            return None
+        if item.get("id") in self.by_id:
+            return self.by_id[item["id"]]
+        name = normalize_user_text(str(item.get("nome") or ""))
+        return self.by_name.get(name) or (self.find(name) if name else None)
+
+
+_index_cache = {"version": None, "index": None}
+
+
+def get_product_index(db):
+    """Índice do catálogo em cache, refeito apenas quando a versão do catálogo muda."""
+    global _index_cache
+    catalog = get_catalog(db)
+    cached = _index_cache
+    if cached["version"] != catalog["version"] or cached["index"] is None:
+        cached = {"version": catalog["version"], "index": ProductIndex(catalog["products"] or [])}
+        _index_cache = cached
+    return cached["index"]
+
+
+def cart_item(product):
+    return {"id": product["id"], "nome": product["name"], "preço": format_cents(product["price_cents"])}
+
+
+def cart_total_cents(cart, index):
+    """Total do carrinho em centavos, com os preços do catálogo (itens desconhecidos usam o preço do item)."""
+    total = 0
+    for item in cart:
+        product = index.resolve_item(item)
+        cents = product["price_cents"] if product else price_to_cents(item.get("preço") if isinstance(item, dict) else None)
+        total += cents or 0
+    return total
+
+
+def reprice_cart(session_data, index):
+    """Corrige o carrinho vindo do LLM com os ids e preços do catálogo e recalcula o total."""
+    if not CART_ENGINE_ENABLED:
+        return
+    customer = session_data["customer_data"]
+    cart = []
+    for item in customer.get("cart") or []:
+        product = index.resolve_item(item)
+        if product is None:
+            logging.warning(f"Item do carrinho fora do catálogo mantido com o preço informado pelo LLM: {item}")
+            cart.append(item)
+        else:
+            cart.append(cart_item(product))
+    total_cents = cart_total_cents(cart, index)
+    if round(float(session_data.get("total_value") or 0) * 100) != total_cents:
+        metrics.increment("cart_total_corrections_total")
+    customer["cart"] = cart
+    session_data["total_value"] = total_cents / 100
+
+
+def describe_cart(cart, index):
+    lines = "\n".join(f"- {item['nome']} - R$ {item['preço']}" for item in cart)
+    return f"{lines}\nTotal: R$ {format_cents(cart_total_cents(cart, index))}"
+
+
+def _add(session_data, product, index):
+    customer = session_data["customer_data"]
+    customer["cart"] = (customer.get("cart") or []) + [cart_item(product)]
+    customer["product_selected_for_cart"] = None
+    session_data["chat_state"] = 'ajuda_na_escolha'
+    return (f"Pronto! O {product['name']} (R$ {format_cents(product['price_cents'])}) foi adicionado ao carrinho.\n"
+            f"Seu carrinho:\n{describe_cart(customer['cart'], index)}\n"
+            "Gostaria de adicionar mais itens ou finalizar a compra?")
+
+
+def _remove(session_data, product, index):
+    customer = session_data["customer_data"]
+    cart = list(customer.get("cart") or [])
+    for position, item in enumerate(cart):
+        resolved = index.resolve_item(item)
+        if resolved and resolved["id"] == product["id"]:
+            del cart[position]
+            break
+    else:
+        return f"O {product['name']} não está no seu carrinho. Posso ajudar com mais alguma coisa?"
+    customer["cart"] = cart
+    session_data["chat_state"] = 'ajuda_na_escolha'
+    if not cart:
+        return f"O {product['name']} foi removido. Seu carrinho está vazio agora. O que você está procurando?"
+    return (f"O {product['name']} foi removido do carrinho.\nSeu carrinho:\n{describe_cart(cart, index)}\n"
+            "Gostaria de adicionar mais itens ou finalizar a compra?")
+
+
+def _total(session_data, index):
+    cart = session_data["customer_data"].get("cart") or []
+    if not cart:
+        return "Seu carrinho está vazio. Que tal dar uma olhada nos nossos produtos?"
+    return f"Seu carrinho:\n{describe_cart(cart, index)}\nGostaria de adicionar mais itens ou finalizar a compra?"
+
+
+def _checkout(session_data):
+    session_data["chat_state"] = 'AWAITING_NAME'
+    return "Ótimo! Vamos finalizar sua compra. Para gerar a proposta, qual é o seu nome completo?"
+
+
+def match_cart_intent(session_data, user_input, index):
+    """Resolve localmente pedidos de carrinho sem ambiguidade; retorna (intenção, produto) ou None.
+
+    Qualquer dúvida (negação, produto não identificado, mais de um produto)
+    devolve None e o turno segue para o LLM.
+    """
+    if session_data.get("chat_state") in _DATA_COLLECTION_STATES:
+        return None
+    text = normalize_user_text(user_input)
+    if not text or _NEGATION.search(text):
+        return None
+    # Perguntas ("posso pagar no boleto?", "vem com controle? se vier vou levar") ficam com o LLM;
+    # só a consulta ao total, que não altera o carrinho, é respondida localmente.
+    question = "?" in user_input
+    cart = session_data["customer_data"].get("cart") or []
+    selected = session_data["customer_data"].get("product_selected_for_cart")
+
+    if _CONFIRM.match(text):
+        # "sim"/"pode adicionar" confirma o produto que o LLM acabou de oferecer. Se ele já está no
+        # carrinho (o schema sempre repete product_selected_for_cart), o "ok" fica com o LLM.
+        product = index.resolve_item(selected) if selected else None
+        if product is None or any(index.resolve_item(item) is product for item in cart):
+            return None
+        return ("add", product)
+    if question:
+        return ("total", None) if _TOTAL_INTENT.search(text) and not index.find(text) else None
+    if _REMOVE_INTENT.match(text):
+        product = index.find(text)
+        return ("remove", product) if product else None
+    if _ADD_INTENT.match(text):
+        product = index.find(text)
+        return ("add", product) if product else None
+    if _CHECKOUT_INTENT.match(text):
+        return ("checkout", None) if cart else None
+    if _TOTAL_INTENT.search(text) and not index.find(text):
+        return ("total", None)
+    return None
+
+
+def handle_cart_intent(session_data, user_input, index):
+    """Responde localmente a adicionar/remover/total/finalizar; retorna o texto ou None para usar o LLM."""
+    if not CART_ENGINE_ENABLED:
+        return None
+    match = match_cart_intent(session_data, user_input, index)
+    if match is None:
+        return None
+    intent, product = match
+    if intent == "add":
+        reply = _add(session_data, product, index)
+    elif intent == "remove":
+        reply = _remove(session_data, product, index)
+    elif intent == "total":
+        reply = _total(session_data, index)
+    else:
+        reply = _checkout(session_data)
+    session_data["total_value"] = cart_total_cents(session_data["customer_data"]["cart"], index) / 100
+    session_data["chat_history_for_llm"].append({"role": "model", "parts": [{"text": reply}]})
+    metrics.increment("cart_local_replies_total", intent=intent)
+    return reply
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from utils.constants import CATALOG_CACHE_TTL_SECONDS, CATALOG_SNAPSHOT_LISTENER_ENABLED
+from utils.firebase import load_products_from_firestore, parse_product_docs
+
+# Cache do catálogo por processo: cada worker do gunicorn mantém a sua cópia,
+# atualizada pelo listener on_snapshot da coleção 'products'.
+_lock = threading.Lock()
+_cache = {
+    "db": None,
+    "products": None,
+    "products_string": None,
+    "version": None,
+    "loaded_at": 0.0,
+    "watch": None,
+    "refreshing": False,
+}
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "snapshot_refreshes": 0, "errors": 0}
+_refresh_listeners = []
+
+
+def render_products_string(products_list):
+    products_string = "\n".join([f"- {p['category']}: {p['name']} - R$ {p['price']}" for p in products_list])
+    if not products_string: products_string = "Nenhum produto disponível no momento."
+    return products_string
+
+
+def compute_catalog_version(products_list):
+    """Hash estável do catálogo, usado para invalidar caches derivados."""
+    payload = json.dumps(sorted(products_list, key=lambda p: str(p.get('id'))), sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def on_catalog_refresh(callback):
+    """Registra uma função chamada com a nova versão sempre que o catálogo muda."""
+    _refresh_listeners.append(callback)
+
+
+def _store(db, products_list, source):
+    version = compute_catalog_version(products_list)
+    with _lock:
+        changed = version != _cache["version"]
+        _cache.update({
+            "db": db,
+            "products": products_list,
+            "products_string": render_products_string(products_list),
+            "version": version,
+            "loaded_at": time.monotonic(),
+        })
+        _stats["refreshes"] += 1
+        if source == "snapshot":
+            _stats["snapshot_refreshes"] += 1
+    if changed:
+        logging.info(f"Catálogo atualizado ({source}): {len(products_list)} produtos, versão {version}.")
+        for callback in list(_refresh_listeners):
+            try:
+                callback(version)
+            except Exception as e:
+                logging.error(f"Erro ao notificar atualização do catálogo: {e}")
+
+
+def _on_products_snapshot(col_snapshot, changes, read_time):
+    # Executado na thread do listener do Firestore: nenhuma leitura extra é necessária.
+    try:
+        _store(_cache["db"], parse_product_docs(col_snapshot), "snapshot")
+    except Exception as e:
+        _stats["errors"] += 1
+        logging.error(f"Erro ao processar snapshot de produtos: {e}")
+
+
+def _start_listener(db):
+    if not CATALOG_SNAPSHOT_LISTENER_ENABLED or _cache["watch"] is not None:
+        return
+    try:
+        _cache["watch"] = db.collection('products').on_snapshot(_on_products_snapshot)
+        logging.info("Listener de produtos do Firestore iniciado.")
+    except Exception as e:
+        _stats["errors"] += 1
+        logging.error(f"Não foi possível iniciar o listener de produtos: {e}")
+
+
+def _load(db, source):
+    """Lê o catálogo e o guarda no cache; uma leitura que falhou ou veio vazia não substitui o anterior.
+
+    Retorna se o cache foi atualizado. Sem atualização, `loaded_at` fica como estava e a
+    próxima chamada de get_catalog tenta de novo.
+    """
+    products_list = load_products_from_firestore(db)
+    if not products_list:
+        _stats["errors"] += 1
+        kept = "mantendo o catálogo anterior" if catalog_cached(db) else "nada em cache"
+        logging.warning(f"Leitura do catálogo ({source}) falhou ou veio vazia; {kept}.")
+        return False
+    _store(db, products_list, source)
+    return True
+
+
+def _background_refresh(db):
+    try:
+        _load(db, "ttl")
+    finally:
+        _cache["refreshing"] = False
+
+
+def _snapshot():
+    return {
+        "products": _cache["products"],
+        "products_string": _cache["products_string"],
+        "version": _cache["version"],
+    }
+
+
+def get_catalog(db):
+    """Retorna produtos, string de produtos e versão do catálogo a partir do cache.
+
+    Apenas a primeira chamada (ou uma troca de cliente do Firestore) faz leitura
+    síncrona; depois disso o listener mantém o cache e o TTL expirado dispara
+    uma atualização em segundo plano, servindo a versão atual enquanto isso.
+    Se a primeira leitura falhar ou vier vazia, devolve um catálogo vazio (versão
+    None) sem guardá-lo, e a chamada seguinte lê de novo.
+    """
+    if catalog_cached(db):
+        if time.monotonic() - _cache["loaded_at"] < CATALOG_CACHE_TTL_SECONDS:
+            _stats["hits"] += 1
+            return _snapshot()
+        _stats["stale_hits"] += 1
+        with _lock:
+            start_refresh = not _cache["refreshing"]
+            _cache["refreshing"] = True
+        if start_refresh:
+            threading.Thread(target=_background_refresh, args=(db,), daemon=True).start()
+        return _snapshot()
+
+    with _lock:
+        if _cache["db"] is not db:
+            stop_listener()
+    _stats["misses"] += 1
+    loaded = _load(db, "load")
+    if db:
+        _start_listener(db)
+    if not loaded and not catalog_cached(db):
+        return {"products": [], "products_string": render_products_string([]), "version": None}
+    return _snapshot()
+
+
+def catalog_cached(db):
+    """Se get_catalog(db) responde da memória, sem leitura síncrona do Firestore."""
+    return _cache["products"] is not None and _cache["db"] is db
+
+
+def stop_listener():
+    watch = _cache["watch"]
+    _cache["watch"] = None
+    if watch is not None:
+        try:
+            watch.unsubscribe()
+        except Exception as e:
+            logging.error(f"Erro ao encerrar listener de produtos: {e}")
+
+
+def invalidate_catalog_cache():
+    """Descarta o cache (e o listener), forçando uma nova leitura na próxima chamada."""
+    with _lock:
+        stop_listener()
+        _cache.update({"db": None, "products": None, "products_string": None, "version": None, "loaded_at": 0.0})
+
+
+def get_catalog_cache_stats():
+    stats = dict(_stats)
+    stats["version"] = _cache["version"]
+    stats["listener_active"] = _cache["watch"] is not None
+    stats["age_seconds"] = round(time.monotonic() - _cache["loaded_at"], 3) if _cache["products"] is not None else None
+    return stats
@@ -0,0 +1,131 @@
+import re
+import uuid
+import random
+import logging
+import unicodedata
+from utils.constants import AB_TEST_ENABLED
+from utils.response_parser import parse_llm_response
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_EMAIL = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+_NON_DIGIT = re.compile(r"\D")
+
+INITIAL_GREETING = "Olá! Bem-vindo ao Marketplace de Eletrônicos. Sou 39A-na, sua assistente virtual. O que você está procurando hoje?"
+
+def normalize_user_text(text):
+    """Minúsculas, sem acentos, pontuação ou espaços repetidos: "Quanto custa o NovoPhone?!" -> "quanto custa o novophone"."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text)).strip()
+
+def start_new_session(session_data):
+    """Reinicia o estado da conversa, sorteia o grupo do teste A/B e retorna a saudação inicial."""
+    session_data.clear()
+    session_data["customer_data"] = {
+        "name": None, "email": None, "phone": None, 
+        "product_selected_for_cart": None, 
+        "cart": []
+    }
+    session_data["chat_state"] = 'ajuda_na_escolha' 
+    session_data["chat_history_for_llm"] = []
+    session_data["last_input_invalid"] = False
+    session_data["session_uuid"] = str(uuid.uuid4())
+    session_data["session_saved"] = False
+    session_data["total_value"] = 0.0
+
+    if AB_TEST_ENABLED:
+        session_data["ab_test_group"] = random.choice(['A', 'B'])
+        logging.info(f"Nova sessão iniciada. Teste A/B ativo. Grupo atribuído: {session_data['ab_test_group']}")
+    else:
+        session_data["ab_test_group"] = 'A' 
+        logging.info("Nova sessão iniciada. Teste A/B inativo. Usando modelo padrão do grupo A.")
+
+    session_data["chat_history_for_llm"].append({"role": "model", "parts": [{"text": INITIAL_GREETING}]})
+    return INITIAL_GREETING
+
+def restart_lost_session(session_data):
+    """Inicia uma conversa nova se a sessão não tem estado (expirada ou ausente do backend de sessões).
+
+    Retorna a mensagem para o usuário, com a saudação inicial, ou None se a sessão está íntegra.
+    """
+    if session_data.get("chat_state"):
+        return None
+    logging.warning(f"Sessão {session_data.get('session_uuid') or 'sem estado'} não encontrada; iniciando uma nova conversa.")
+    return "Sua conversa anterior expirou e foi reiniciada. " + start_new_session(session_data)
+
+def record_model_answer(session_data, model):
+    """Conta os turnos respondidos por cada modelo (com failover ou hedging, nem sempre o modelo do grupo A/B)."""
+    turns = dict(session_data.get("model_turns") or {})
+    turns[model] = turns.get(model, 0) + 1
+    session_data["model_turns"] = turns
+
+def validate_customer_input(session_data, user_input):
+    """Registra a mensagem do usuário e valida nome/email/telefone nos estados de coleta de dados.
+
+    Retorna o estado da conversa antes da validação.
+    """
+    session_data["chat_history_for_llm"].append({"role": "user", "parts": [{"text": user_input}]})
+
+    current_state_before_llm = session_data["chat_state"]
+    customer = session_data["customer_data"]
+
+    if current_state_before_llm == 'AWAITING_NAME':
+        words = user_input.split()
+        if len(user_input) > 3 and len(words) >= 2 and words[0][0].isupper() and all(word[0].isalpha() or word[0].isdigit()==False for word in words if len(word)>0): # Verifica se todas as palavras começam com letra
+            customer["name"] = user_input
+            session_data["chat_state"] = 'AWAITING_EMAIL'
+        else:
+            session_data["last_input_invalid"] = True
+    elif current_state_before_llm == 'AWAITING_EMAIL':
+        if _EMAIL.fullmatch(user_input):
+            customer["email"] = user_input
+            session_data["chat_state"] = 'AWAITING_PHONE'
+        else:
+            session_data["last_input_invalid"] = True
+    elif current_state_before_llm == 'AWAITING_PHONE':
+        cleaned_phone = _NON_DIGIT.sub('', user_input)
+        if 10 <= len(cleaned_phone) <= 11:
+            customer["phone"] = user_input
+            session_data["chat_state"] = 'PROPOSAL_READY'
+        else:
+            session_data["last_input_invalid"] = True
+    return current_state_before_llm
+
+_STATE_FIELDS = {'AWAITING_NAME': "name", 'AWAITING_EMAIL': "email", 'AWAITING_PHONE': "phone"}
+
+def discard_user_turn(session_data, state_before):
+    """Desfaz `validate_customer_input` num turno que não foi atendido (ex.: rejeitado por excesso de carga)."""
+    history = session_data["chat_history_for_llm"]
+    if history and history[-1]["role"] == "user":
+        history.pop()
+    if session_data["chat_state"] != state_before and state_before in _STATE_FIELDS:
+        session_data["customer_data"][_STATE_FIELDS[state_before]] = None
+    session_data["chat_state"] = state_before
+    session_data["last_input_invalid"] = False
+
+def build_gemini_history(system_prompt, context_instruction, chat_history):
+    llm_payload_history = []
+    llm_payload_history.append({"role": "user", "parts": [{"text": system_prompt + "\n\n" + context_instruction}]})
+    llm_payload_history.append({"role": "model", "parts": [{"text": "Entendido."}]})
+    llm_payload_history.extend(chat_history)
+    return llm_payload_history
+
+def apply_llm_response(session_data, bot_response):
+    """Aplica a resposta estruturada do LLM ao estado da sessão e retorna o texto para o usuário."""
+    parsed = parse_llm_response(bot_response)
+    if parsed.errors:
+        logging.warning(f"Campos inválidos na resposta do LLM: {'; '.join(parsed.errors)}")
+    if parsed.structured:
+        customer = session_data["customer_data"]
+        session_data["chat_state"] = parsed.chat_state or session_data["chat_state"]
+        customer["product_selected_for_cart"] = parsed.product_selected_for_cart.to_dict() if parsed.product_selected_for_cart else None
+        customer["cart"] = [item.to_dict() for item in parsed.cart]
+        session_data["last_input_invalid"] = parsed.last_input_invalid
+        # Float para continuar serializável na sessão e no Firestore.
+        session_data["total_value"] = float(parsed.total_value)
+    session_data["chat_history_for_llm"].append({"role": "model", "parts": [{"text": parsed.resposta}]})
+
+    if parsed.has_link:
+        session_data["chat_state"] = "proposta_final"
+    return parsed.resposta
@@ -0,0 +1,69 @@
+from utils import metrics
+from utils.cart import describe_cart, handle_cart_intent
+from utils.constants import CHECKOUT_FAST_PATH_ENABLED
+
+CHECKOUT_URL = "https://marketplace-39A.com.br/{proposal_id}"
+_DATA_STATES = ('AWAITING_NAME', 'AWAITING_EMAIL', 'AWAITING_PHONE')
+# Estado em que o usuário já recebeu a mensagem padrão de entrada inválida.
+REPROMPTED_KEY = "checkout_reprompted_state"
+
+# Respostas da coleta de dados, por (estado antes do turno, entrada válida?).
+_REPLIES = {
+    ('AWAITING_NAME', True): "Obrigada, {first_name}! Agora, qual é o seu email?",
+    ('AWAITING_NAME', False): "Não consegui entender seu nome. Por favor, informe seu nome completo (nome e sobrenome), começando com letra maiúscula. Ex.: Maria Silva.",
+    ('AWAITING_EMAIL', True): "Perfeito! Por último, qual é o seu telefone com DDD?",
+    ('AWAITING_EMAIL', False): "Esse email não parece válido. Poderia verificar e enviar novamente? Ex.: nome@exemplo.com.",
+    ('AWAITING_PHONE', False): "Esse telefone não parece válido. Por favor, informe o número com DDD (10 ou 11 dígitos). Ex.: (11) 98765-4321.",
+}
+
+
+def build_proposal(session_data, index):
+    """Proposta final com os itens do carrinho, o total e o link de checkout (falso)."""
+    customer = session_data["customer_data"]
+    proposal_id = session_data["session_uuid"].split("-")[0]
+    greeting = " ".join(["Tudo certo,"] + (customer.get("name") or "").split()[:1]).rstrip(",")
+    return (f"{greeting}! Aqui está sua proposta:\n"
+            f"{describe_cart(customer['cart'], index)}\n"
+            "Pagamento em até 12x sem juros, com garantia estendida disponível.\n"
+            f"Finalize sua compra em: {CHECKOUT_URL.format(proposal_id=proposal_id)}")
+
+
+def handle_data_collection(session_data, state_before, index):
+    """Responde localmente aos turnos de nome/email/telefone já validados por validate_customer_input.
+
+    Uma entrada inválida recebe a mensagem padrão só uma vez por etapa: se a seguinte também
+    não for um dado válido, o usuário provavelmente quer outra coisa (desistir, perguntar, mudar
+    o carrinho) e o turno segue para o LLM. Retorna None (e o turno segue para o LLM) nesse
+    caso, fora desses estados ou quando não há carrinho para montar a proposta.
+    """
+    if not CHECKOUT_FAST_PATH_ENABLED or state_before not in _DATA_STATES:
+        session_data.pop(REPROMPTED_KEY, None)
+        return None
+    customer = session_data["customer_data"]
+    valid = not session_data.get("last_input_invalid")
+    if valid:
+        session_data.pop(REPROMPTED_KEY, None)
+    elif session_data.get(REPROMPTED_KEY) == state_before:
+        metrics.increment("checkout_llm_fallbacks_total", step=state_before)
+        return None
+    else:
+        session_data[REPROMPTED_KEY] = state_before
+    if state_before == 'AWAITING_PHONE' and valid:
+        if not customer.get("cart"):
+            return None
+        reply = build_proposal(session_data, index)
+        session_data["chat_state"] = "proposta_final"
+    else:
+        name_parts = (customer.get("name") or "").split()
+        reply = _REPLIES[(state_before, valid)].format(first_name=name_parts[0] if name_parts else "")
+    session_data["chat_history_for_llm"].append({"role": "model", "parts": [{"text": reply}]})
+    metrics.increment("checkout_local_replies_total", step=state_before, valid=str(valid).lower())
+    return reply
+
+
+def answer_locally(session_data, user_input, state_before, index):
+    """Resposta sem LLM para o turno (coleta de dados ou pedido de carrinho), ou None."""
+    reply = handle_data_collection(session_data, state_before, index)
+    if reply is None:
+        reply = handle_cart_intent(session_data, user_input, index)
+    return reply
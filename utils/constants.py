@@ -5,17 +5,128 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GEMINI_API_KEY:
     print("ALERTA: GOOGLE_API_KEY não encontrada.")
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+GEMINI_MODEL_LABEL = "Gemini-2.0-flash"
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash")
+GEMINI_API_URL = f"{GEMINI_API_BASE_URL}:generateContent?key={GEMINI_API_KEY}"
+GEMINI_STREAM_API_URL = f"{GEMINI_API_BASE_URL}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
 
 AB_TEST_ENABLED = False
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
 
 OPENROUTER_MODEL_A = "deepseek/deepseek-r1-0528:free"
 OPENROUTER_MODEL_B = "microsoft/phi-4-reasoning:free" 
 if not OPENROUTER_API_KEY:
     print("ALERTA: OPENROUTER_API_KEY não encontrada nas variáveis de ambiente.")
 
+# Respostas em streaming (SSE) para a interface do chat.
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "false").lower() == "true"
+
+# Pool do httpx.AsyncClient compartilhado no app assíncrono (async_app.py).
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "200"))
+
+# Transporte HTTP dos LLMs: pool keep-alive, retentativas e circuit breaker por provedor.
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "4"))
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", "32"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+LLM_RETRY_AFTER_MAX_SECONDS = float(os.getenv("LLM_RETRY_AFTER_MAX_SECONDS", "20"))
+# Prazo total de uma chamada ao LLM, somando tentativas e esperas entre elas.
+LLM_REQUEST_DEADLINE_SECONDS = float(os.getenv("LLM_REQUEST_DEADLINE_SECONDS", "60"))
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "30"))
+LLM_FAILOVER_TO_GEMINI = os.getenv("LLM_FAILOVER_TO_GEMINI", "true").lower() == "true"
+
+# Requisições "hedged" (opcional): se o modelo da sessão não responder até o p95 da sua
+# latência, dispara o mesmo turno num segundo modelo e usa a primeira resposta válida.
+HEDGED_REQUESTS_ENABLED = os.getenv("HEDGED_REQUESTS_ENABLED", "false").lower() == "true"
+HEDGE_DELAY_PERCENTILE = float(os.getenv("HEDGE_DELAY_PERCENTILE", "0.95"))
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "4"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_BACKUP_MODEL = os.getenv("HEDGE_BACKUP_MODEL", "")
+
+# Sessão do chat no servidor: "sqlite" (padrão, compartilhado entre workers), "redis",
+# "memory" (LRU, apenas desenvolvimento) ou "cookie" (cookie assinado do Flask).
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "/tmp/chat_sessions.sqlite3")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_MEMORY_MAX_SESSIONS = int(os.getenv("SESSION_MEMORY_MAX_SESSIONS", "10000"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+SESSION_PURGE_INTERVAL_SECONDS = int(os.getenv("SESSION_PURGE_INTERVAL_SECONDS", "600"))
+
+# Orçamento de contexto por turno: janela deslizante do histórico + resumo das mensagens antigas.
+CONTEXT_WINDOW_ENABLED = os.getenv("CONTEXT_WINDOW_ENABLED", "true").lower() == "true"
+CONTEXT_HISTORY_TOKEN_BUDGET = int(os.getenv("CONTEXT_HISTORY_TOKEN_BUDGET", "1200"))
+CONTEXT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CONTEXT_SUMMARY_TOKEN_BUDGET", "300"))
+CONTEXT_MIN_RECENT_MESSAGES = int(os.getenv("CONTEXT_MIN_RECENT_MESSAGES", "4"))
+
+# Gravação tardia (write-behind) das sessões: as gravações de cada sessão são coalescidas
+# e enviadas em lote a cada intervalo, ao atingir o limite de pendentes ou num estado final.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+WRITE_BEHIND_FLUSH_INTERVAL_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_SECONDS", "5"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "100"))
+
+# Cache de respostas (opcional) para a primeira pergunta da conversa em 'ajuda_na_escolha'
+# com carrinho vazio; a chave inclui a versão do catálogo e o cache é limpo quando 'products' muda.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+
+# Carrinho calculado no servidor: preços do catálogo em centavos e pedidos de carrinho
+# sem ambiguidade ("adicionar X", "remover X", "qual o total", "finalizar") respondidos sem o LLM.
+CART_ENGINE_ENABLED = os.getenv("CART_ENGINE_ENABLED", "true").lower() == "true"
+
+# Coleta de nome/email/telefone e proposta final respondidas por templates, sem o LLM
+# (desligar para comparar com o fluxo em que o LLM escreve essas mensagens).
+CHECKOUT_FAST_PATH_ENABLED = os.getenv("CHECKOUT_FAST_PATH_ENABLED", "true").lower() == "true"
+
+# Observabilidade: spans por etapa do turno (no-op por padrão; "otel" usa o OpenTelemetry
+# se instalado), log de turnos lentos, profiler por amostragem e volume de logs.
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACE_SLOW_TURN_SECONDS = float(os.getenv("TRACE_SLOW_TURN_SECONDS", "5"))
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_OUTPUT_DIR = os.getenv("PROFILER_OUTPUT_DIR", "/tmp/chat_profiles")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "").upper()
+LOG_SESSION_DUMP = os.getenv("LOG_SESSION_DUMP", "false").lower() == "true"
+
+# Exportação de 'sessions' (CSV/Parquet) por páginas com cursor: documentos por página e
+# linhas por row group do Parquet (limitam a memória usada, seja qual for o tamanho da coleção).
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+EXPORT_PARQUET_ROW_GROUP_SIZE = int(os.getenv("EXPORT_PARQUET_ROW_GROUP_SIZE", "10000"))
+
+# Inicialização de cada worker: os clientes (Firebase, HTTP) são criados no próprio processo, depois do fork,
+# e o aquecimento carrega catálogo e prompt e abre conexões com os provedores antes do primeiro turno.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_LLM_CONNECTIONS = int(os.getenv("WARMUP_LLM_CONNECTIONS", "2"))
+WARMUP_LLM_TIMEOUT_SECONDS = float(os.getenv("WARMUP_LLM_TIMEOUT_SECONDS", "5"))
+SEED_PRODUCTS_ON_STARTUP = os.getenv("SEED_PRODUCTS_ON_STARTUP", "true").lower() == "true"
+
+# Controle de admissão das chamadas ao LLM: token bucket por sessão (no armazenamento das sessões,
+# compartilhado entre os workers), limite de chamadas simultâneas por modelo em cada worker
+# e fila justa entre sessões, com prazo máximo de espera.
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+SESSION_RATE_LIMIT_PER_MINUTE = float(os.getenv("SESSION_RATE_LIMIT_PER_MINUTE", "12"))
+SESSION_RATE_LIMIT_BURST = int(os.getenv("SESSION_RATE_LIMIT_BURST", "4"))
+LLM_MAX_CONCURRENCY_PER_MODEL = int(os.getenv("LLM_MAX_CONCURRENCY_PER_MODEL", "2"))
+# Slots extras por modelo que só as requisições de reserva do hedging usam: com os slots normais
+# ocupados, um turno lento ainda consegue disparar a reserva.
+HEDGE_RESERVED_SLOTS_PER_MODEL = int(os.getenv("HEDGE_RESERVED_SLOTS_PER_MODEL", "1"))
+# No async_app a espera por slot não ocupa thread, e um processo atende centenas de conversas.
+ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL = int(os.getenv("ASYNC_LLM_MAX_CONCURRENCY_PER_MODEL", "100"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+
+# Cada contador do dashboard (modelo, dia) é dividido em tantos documentos, somados na leitura: um
+# documento do Firestore aguenta cerca de 1 gravação por segundo.
+DASHBOARD_ROLLUP_SHARDS = int(os.getenv("DASHBOARD_ROLLUP_SHARDS", "1"))
+
+# Cache do catálogo em memória (por processo). O listener on_snapshot mantém o
+# cache atualizado; o TTL é apenas uma rede de segurança caso o listener caia.
+CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+CATALOG_SNAPSHOT_LISTENER_ENABLED = os.getenv("CATALOG_SNAPSHOT_LISTENER_ENABLED", "true").lower() == "true"
+
 DEFAULT_PRODUCTS_SEED = [
     {"id": "p1", "name": "NovoPhone X12", "price": "3.499,00", "category": "Smartphone"},
     {"id": "p2", "name": "UltraBook Pro 15", "price": "7.999,00", "category": "Laptop"},
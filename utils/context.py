@@ -0,0 +1,112 @@
+import logging
+import math
+from utils import metrics
+from utils.constants import (
+    CONTEXT_WINDOW_ENABLED, CONTEXT_HISTORY_TOKEN_BUDGET,
+    CONTEXT_SUMMARY_TOKEN_BUDGET, CONTEXT_MIN_RECENT_MESSAGES
+)
+
+# Aproximação de tokens para português sem depender de tokenizer: ~4 caracteres por token.
+CHARS_PER_TOKEN = 4
+SUMMARY_SNIPPET_CHARS = 160
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def message_text(message):
+    return "".join(part.get("text", "") for part in message.get("parts", []))
+
+
+def estimate_messages_tokens(messages):
+    return sum(estimate_tokens(message_text(m)) for m in messages)
+
+
+def _summary_line(message):
+    speaker = "Cliente" if message.get("role") == "user" else "39A-na"
+    text = " ".join(message_text(message).split())
+    if len(text) > SUMMARY_SNIPPET_CHARS:
+        text = text[:SUMMARY_SNIPPET_CHARS].rstrip() + "…"
+    return f"- {speaker}: {text}"
+
+
+def _fold_into_summary(summary_lines, messages):
+    """Acrescenta as mensagens ao resumo e descarta as linhas mais antigas acima do orçamento."""
+    lines = summary_lines + [_summary_line(m) for m in messages]
+    while len(lines) > 1 and sum(estimate_tokens(line) for line in lines) > CONTEXT_SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+    return lines
+
+
+def select_history_window(session_data):
+    """Janela deslizante do histórico dentro do orçamento de tokens.
+
+    As mensagens que saem da janela são incorporadas uma única vez ao resumo
+    corrente (`history_summary`), e `history_summarized_upto` marca até onde o
+    histórico já foi resumido. Retorna (mensagens da janela, linhas do resumo).
+    """
+    history = session_data["chat_history_for_llm"]
+    summarized_upto = session_data.get("history_summarized_upto", 0)
+
+    start, used = len(history), 0
+    while start > summarized_upto:
+        tokens = estimate_tokens(message_text(history[start - 1]))
+        if used + tokens > CONTEXT_HISTORY_TOKEN_BUDGET and len(history) - start >= CONTEXT_MIN_RECENT_MESSAGES:
+            break
+        used += tokens
+        start -= 1
+    # A janela sempre começa numa mensagem do usuário, mantendo a alternância de papéis.
+    while start < len(history) - 1 and history[start].get("role") != "user":
+        start += 1
+
+    summary = session_data.get("history_summary", [])
+    if start > summarized_upto:
+        summary = _fold_into_summary(summary, history[summarized_upto:start])
+        session_data["history_summary"] = summary
+        session_data["history_summarized_upto"] = start
+    return history[start:], summary
+
+
+def build_state_context(session_data):
+    """Estado fixado da venda (carrinho e cliente), enviado como dado estruturado a cada turno."""
+    customer = session_data["customer_data"]
+    cart = customer.get("cart") or []
+    cart_lines = "\n".join(f"  - {item.get('nome')} - R$ {item.get('preço')}" for item in cart if isinstance(item, dict)) or "  (vazio)"
+    return (
+        "ESTADO ATUAL DA VENDA (fonte da verdade, prevalece sobre o histórico):\n"
+        f"- chat_state: {session_data['chat_state']}\n"
+        f"- carrinho:\n{cart_lines}\n"
+        f"- total_value: {session_data.get('total_value')}\n"
+        f"- cliente: nome={customer.get('name')}, email={customer.get('email')}, telefone={customer.get('phone')}"
+    )
+
+
+def prepare_llm_context(session_data, system_prompt, context_instruction):
+    """Monta o contexto do turno para os dois provedores, respeitando o orçamento de tokens.
+
+    Enquanto o histórico inteiro cabe em CONTEXT_HISTORY_TOKEN_BUDGET ele é enviado como está:
+    a janela, o estado fixado e o resumo só entram a partir do turno em que o orçamento é
+    ultrapassado (antes disso deixariam o prompt maior que o histórico completo).
+
+    Retorna um dict com `history` (mensagens enviadas), `context_instruction`
+    (instrução do turno + estado fixado + resumo) e `prompt_tokens` (estimativa
+    de tokens de entrada), que também é registrada em `last_prompt_tokens`.
+    """
+    history = session_data["chat_history_for_llm"]
+    windowed = CONTEXT_WINDOW_ENABLED and (
+        session_data.get("history_summarized_upto", 0) > 0
+        or estimate_messages_tokens(history) > CONTEXT_HISTORY_TOKEN_BUDGET
+    )
+    if windowed:
+        history, summary = select_history_window(session_data)
+        parts = [context_instruction, build_state_context(session_data)]
+        if summary:
+            parts.append("RESUMO DA CONVERSA ANTERIOR:\n" + "\n".join(summary))
+        context_instruction = "\n\n".join(parts)
+
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(context_instruction) + estimate_messages_tokens(history)
+    session_data["last_prompt_tokens"] = prompt_tokens
+    metrics.observe("llm_prompt_tokens", prompt_tokens, buckets=metrics.TOKEN_BUCKETS)
+    logging.info(f"Turno com ~{prompt_tokens} tokens de entrada ({len(history)} mensagens no histórico enviado).")
+    return {"history": history, "context_instruction": context_instruction, "prompt_tokens": prompt_tokens}
@@ -0,0 +1,226 @@
+import logging
+import random
+import threading
+import weakref
+from collections import defaultdict
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from utils.constants import DASHBOARD_ROLLUP_SHARDS
+
+# Contadores pré-agregados do dashboard, mantidos por save_session_to_firestore:
+#   session_rollups/{modelo}__{dia}__{shard} -> {"model", "day", "shard", "states": {final_state: n}}
+#   dashboard_meta/models                    -> {"models": [modelos distintos]}
+# Cada (modelo, dia) tem até DASHBOARD_ROLLUP_SHARDS documentos, somados na leitura. A sessão
+# que já entrou nos contadores tem `rollup_counted` no seu documento. dashboard_meta/backfill,
+# gravado por backfill_rollups ao terminar, indica que as sessões anteriores aos contadores
+# também foram contadas.
+ROLLUPS_COLLECTION = 'session_rollups'
+META_COLLECTION = 'dashboard_meta'
+MODELS_DOC = 'models'
+BACKFILL_DOC = 'backfill'
+COUNTED_FIELD = 'rollup_counted'
+UNKNOWN_MODEL = 'Desconhecido'
+UNKNOWN_STATE = 'UNKNOWN'
+
+# Modelos que este processo já gravou em dashboard_meta/models de cada banco (evita um ArrayUnion por gravação).
+_announced_models = weakref.WeakKeyDictionary()
+_announced_lock = threading.Lock()
+
+
+def rollup_key(record):
+    """Chave (modelo, dia UTC, estado final) com que o documento da sessão entra nos contadores."""
+    timestamp = record.get('timestamp_utc')
+    day = timestamp.strftime('%Y-%m-%d') if isinstance(timestamp, datetime) else None
+    return [record.get('model_used') or UNKNOWN_MODEL, day, record.get('final_state') or UNKNOWN_STATE]
+
+
+def rollup_doc_id(model, day, shard=0):
+    # IDs de documento do Firestore não podem conter '/', presente nos nomes de modelo do OpenRouter.
+    return f"{model.replace('/', '|')}__{day}__{shard}"
+
+
+def _add_increments(db, writer, model, day, states):
+    """Soma `states` ({estado: delta}) num shard aleatório do contador (modelo, dia)."""
+    shard = random.randrange(max(1, DASHBOARD_ROLLUP_SHARDS))
+    writer.set(db.collection(ROLLUPS_COLLECTION).document(rollup_doc_id(model, day, shard)),
+               {"model": model, "day": day, "shard": shard,
+                "states": {state: firestore.Increment(delta) for state, delta in states.items()}}, merge=True)
+
+
+def _add_models(db, writer, models):
+    new_models = sorted(set(models) - _announced_models.get(db, set()))
+    if new_models:
+        writer.set(db.collection(META_COLLECTION).document(MODELS_DOC), {"models": firestore.ArrayUnion(new_models)}, merge=True)
+
+
+def models_announced(db, models):
+    """Marca os modelos como gravados em dashboard_meta/models, depois que a gravação foi confirmada."""
+    with _announced_lock:
+        _announced_models.setdefault(db, set()).update(models)
+
+
+def add_rollup_writes(db, writer, previous_key, new_key):
+    """Acrescenta ao lote a troca de contribuição da sessão: -1 na chave anterior, +1 na nova.
+
+    Sessões são regravadas a cada turno; como só a diferença entre a chave do documento
+    já gravado e a do novo é aplicada, regravações não contam a sessão duas vezes.
+    `previous_key` é None se o documento gravado ainda não entrou nos contadores (sem
+    `rollup_counted`). Sessões sem timestamp não entram nos contadores (assim como na
+    varredura completa). Retorna se a sessão passa a estar contada.
+    """
+    previous_key = list(previous_key) if previous_key else None
+    if previous_key == new_key:
+        return bool(new_key[1])
+    if previous_key and previous_key[1]:
+        model, day, state = previous_key
+        _add_increments(db, writer, model, day, {state: -1})
+    if new_key[1]:
+        model, day, state = new_key
+        _add_increments(db, writer, model, day, {state: 1})
+        _add_models(db, writer, [model])
+    return bool(new_key[1])
+
+
+def _charts(counts):
+    """Monta os dados dos gráficos a partir de {(modelo, dia): {estado: n}}."""
+    states_by_model = defaultdict(lambda: defaultdict(int))
+    time_series_by_model = defaultdict(dict)
+    for (model, day), states in counts.items():
+        total = 0
+        for state, count in states.items():
+            if count > 0:
+                states_by_model[model][state] += count
+                total += count
+        if day is not None and total > 0:
+            time_series_by_model[model][day] = (total, max(states.get('proposta_final', 0), 0))
+
+    sorted_states = sorted({state for states in states_by_model.values() for state in states})
+    bar_chart_datasets = []
+    for model_label in sorted(states_by_model):
+        bar_chart_datasets.append({
+            "label": model_label,
+            "data": [states_by_model[model_label].get(state, 0) for state in sorted_states]
+        })
+
+    time_series_datasets = []
+    for model_label in sorted(time_series_by_model):
+        dataset = {"label": model_label, "data": []}
+        for date_str in sorted(time_series_by_model[model_label]):
+            total, finalized = time_series_by_model[model_label][date_str]
+            dataset["data"].append({"x": date_str, "y": round(finalized / total * 100, 2)})
+        time_series_datasets.append(dataset)
+
+    return {
+        "bar_chart_data": {"labels": sorted_states, "datasets": bar_chart_datasets},
+        "time_series_data": {"datasets": time_series_datasets}
+    }
+
+
+def dashboard_from_sessions(sessions):
+    """Cálculo por varredura completa de 'sessions' (usado na migração e para conferir os contadores)."""
+    counts = defaultdict(lambda: defaultdict(int))
+    for session in sessions:
+        model, day, state = rollup_key(session)
+        counts[(model, day)][state] += 1
+    return _charts(counts)
+
+
+def dashboard_from_rollups(rollup_docs):
+    """Soma os shards de cada (modelo, dia) e monta os gráficos."""
+    counts = defaultdict(lambda: defaultdict(int))
+    for doc in rollup_docs:
+        data = doc.to_dict() if hasattr(doc, 'to_dict') else doc
+        states = counts[(data.get('model', UNKNOWN_MODEL), data.get('day'))]
+        for state, count in (data.get('states') or {}).items():
+            states[state] += count
+    return _charts(counts)
+
+
+def rollups_available(db):
+    """Se o backfill já terminou (dashboard_meta/models aparece na primeira gravação, antes dele)."""
+    return db.collection(META_COLLECTION).document(BACKFILL_DOC).get().exists
+
+
+def load_dashboard_data(db, model=None):
+    """Dados do dashboard lidos dos contadores; cai na varredura completa se ainda não houve backfill."""
+    if rollups_available(db):
+        query = db.collection(ROLLUPS_COLLECTION)
+        if model:
+            query = query.where('model', '==', model)
+        return dashboard_from_rollups(query.stream())
+
+    logging.warning("Contadores do dashboard ausentes; usando varredura completa de 'sessions' (rode 'flask backfill-rollups').")
+    query = db.collection('sessions')
+    if model:
+        query = query.where('model_used', '==', model)
+    return dashboard_from_sessions(doc.to_dict() for doc in query.stream())
+
+
+def list_dashboard_models(db):
+    if rollups_available(db):
+        snapshot = db.collection(META_COLLECTION).document(MODELS_DOC).get()
+        return sorted((snapshot.get('models') if snapshot.exists else None) or [])
+    sessions_ref = db.collection('sessions').select(['model_used']).stream()
+    return sorted(set(session.get('model_used') for session in sessions_ref if session.get('model_used')))
+
+
+@firestore.transactional
+def _count_sessions(transaction, db, references):
+    """Soma aos contadores as sessões de `references` que ainda não entraram neles e as marca como contadas.
+
+    Roda numa transação sobre os documentos das sessões: uma gravação ao vivo da mesma sessão
+    (que também lê o documento na transação) fica antes ou depois, nunca no meio, então a
+    sessão é contada uma única vez e nenhum incremento ao vivo é sobrescrito.
+    """
+    counts = defaultdict(lambda: defaultdict(int))
+    counted = 0
+    for snapshot in transaction.get_all(references):
+        data = snapshot.to_dict() if snapshot.exists else None
+        if not data or data.get(COUNTED_FIELD):
+            continue
+        model, day, state = rollup_key(data)
+        if day is None:
+            continue
+        counts[(model, day)][state] += 1
+        transaction.update(snapshot.reference, {COUNTED_FIELD: True})
+        counted += 1
+    for (model, day), states in counts.items():
+        _add_increments(db, transaction, model, day, states)
+    models = {model for model, _ in counts}
+    _add_models(db, transaction, models)
+    return counted, models
+
+
+def backfill_rollups(db, batch_size=150):
+    """Soma aos contadores as sessões gravadas antes deles (as que não têm `rollup_counted`).
+
+    Não sobrescreve nem apaga contadores: cada lote de sessões é contado numa transação, com
+    incrementos, então o backfill pode rodar com o app no ar e ser repetido (ou retomado depois
+    de uma falha) sem contar sessões duas vezes. Cada lote ocupa até 2 escritas por sessão, mais
+    o documento de modelos (limite de 500 por transação).
+    """
+    scanned = counted = 0
+    models = set()
+    pending = []
+
+    def flush():
+        nonlocal counted
+        batch_counted, batch_models = _count_sessions(db.transaction(), db, pending)
+        models_announced(db, batch_models)
+        counted += batch_counted
+        models.update(batch_models)
+        pending.clear()
+
+    for doc in db.collection('sessions').stream():
+        scanned += 1
+        if doc.to_dict().get(COUNTED_FIELD):
+            continue
+        pending.append(doc.reference)
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    # O fim do backfill só é marcado depois de todos os lotes de sessões contados.
+    db.collection(META_COLLECTION).document(BACKFILL_DOC).set({"completed_at": datetime.now(timezone.utc), "sessions": scanned})
+    logging.info(f"Backfill dos contadores concluído: {scanned} sessões lidas, {counted} somadas aos contadores.")
+    return {"sessions": scanned, "counted": counted, "models": sorted(models)}
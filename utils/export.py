@@ -0,0 +1,220 @@
+import csv
+import io
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from utils import metrics
+from utils.constants import EXPORT_PAGE_SIZE, EXPORT_PARQUET_ROW_GROUP_SIZE
+from utils.response_parser import parse_brl_price
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:  # Está no requirements.txt; sem ele, só a exportação em CSV fica disponível.
+    pyarrow = None
+    parquet = None
+
+# Colunas exportadas de cada documento de 'sessions', nesta ordem.
+EXPORT_FIELDS = ("session_uuid", "model_used", "final_state", "cart_items", "total_value", "timestamp_utc")
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def parse_export_date(value, end=False):
+    """Converte 'AAAA-MM-DD' para o datetime UTC do início do dia (do dia seguinte se `end`, que é inclusivo)."""
+    if not value:
+        return None
+    day = date.fromisoformat(value)
+    if end:
+        day += timedelta(days=1)
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def iter_session_pages(db, start=None, end=None, model=None, page_size=EXPORT_PAGE_SIZE):
+    """Percorre 'sessions' em páginas de `page_size` documentos, ordenadas por timestamp_utc.
+
+    Usa cursores (`start_after` do último documento + `limit`), então nenhuma página
+    depende do tamanho da coleção. `start`/`end` filtram timestamp_utc em [start, end);
+    `model` filtra model_used (exige o índice composto model_used + timestamp_utc).
+
+    Não é um snapshot: cada turno regrava timestamp_utc com o horário atual, então uma sessão
+    gravada durante a exportação vai para o fim da ordem. Se ainda não tinha sido lida, sai uma
+    vez, já atualizada; se já tinha, sai de novo mais adiante. Cada linha traz o timestamp que a
+    sessão tinha quando sua página foi lida, e a última linha de cada session_uuid é a mais recente.
+    Com `end`, uma sessão regravada antes de ser lida cujo novo timestamp passa de `end` sai da
+    faixa e não é exportada. (O filtro de data no Firestore exige ordenar pelo mesmo campo, então
+    não dá para paginar por outro.)
+    """
+    query = db.collection('sessions')
+    if model:
+        query = query.where('model_used', '==', model)
+    if start:
+        query = query.where('timestamp_utc', '>=', start)
+    if end:
+        query = query.where('timestamp_utc', '<', end)
+    query = query.order_by('timestamp_utc').select(list(EXPORT_FIELDS)).limit(page_size)
+
+    last = None
+    while True:
+        page = (query.start_after(last) if last is not None else query).get()
+        if not page:
+            return
+        metrics.increment("session_export_pages_total")
+        yield [_row(doc.to_dict()) for doc in page]
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def _text(value):
+    return str(value)
+
+
+def _count(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+def _money(value):
+    # Sessões antigas gravavam o total como texto em reais ("3.499,00").
+    amount = parse_brl_price(value)
+    return float(amount) if amount is not None else None
+
+
+def _timestamp(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+# Conversão de cada coluna para o tipo do esquema (o mesmo no CSV e no Parquet). Um valor que não
+# converte vira vazio: uma sessão com dado ruim não pode interromper um arquivo que já começou a ser enviado.
+_COERCE = {
+    "session_uuid": _text,
+    "model_used": _text,
+    "final_state": _text,
+    "cart_items": _count,
+    "total_value": _money,
+    "timestamp_utc": _timestamp,
+}
+
+
+def _row(data):
+    return tuple(_coerce(field, data.get(field)) for field in EXPORT_FIELDS)
+
+
+def _coerce(field, value):
+    if value is None:
+        return None
+    coerced = _COERCE[field](value)
+    if coerced is None:
+        metrics.increment("session_export_invalid_values_total", field=field)
+    return coerced
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def iter_sessions_csv(pages):
+    """Gera o CSV página a página (cabeçalho no primeiro pedaço)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in pages:
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Arquivo só de escrita que acumula os bytes do Parquet até serem repassados ao cliente."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ("session_uuid", pyarrow.string()),
+        ("model_used", pyarrow.string()),
+        ("final_state", pyarrow.string()),
+        ("cart_items", pyarrow.int64()),
+        ("total_value", pyarrow.float64()),
+        ("timestamp_utc", pyarrow.timestamp("us", tz="UTC")),
+    ])
+
+
+def iter_sessions_parquet(pages, row_group_size=EXPORT_PARQUET_ROW_GROUP_SIZE):
+    """Gera o Parquet em pedaços: um row group a cada `row_group_size` linhas, repassado assim que é escrito."""
+    if pyarrow is None:
+        raise RuntimeError("Pacote 'pyarrow' não instalado; necessário para exportar em Parquet.")
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = parquet.ParquetWriter(sink, schema)
+    pending = []
+    try:
+        for rows in pages:
+            pending.extend(rows)
+            if len(pending) >= row_group_size:
+                writer.write_table(_parquet_table(pending, schema))
+                pending = []
+                yield sink.drain()
+        if pending:
+            writer.write_table(_parquet_table(pending, schema))
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _parquet_table(rows, schema):
+    columns = list(zip(*rows))
+    return pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+def export_sessions(db, export_format="csv", start=None, end=None, model=None, page_size=EXPORT_PAGE_SIZE):
+    """Gerador com o conteúdo da exportação de 'sessions' (str para CSV, bytes para Parquet)."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportação desconhecido: {export_format}")
+    if export_format == "parquet" and pyarrow is None:
+        raise RuntimeError("Pacote 'pyarrow' não instalado; necessário para exportar em Parquet.")
+    logging.info(f"Exportando sessões ({export_format}) de {start or 'início'} a {end or 'hoje'}, modelo {model or 'todos'}.")
+    pages = iter_session_pages(db, start, end, model, page_size)
+    if export_format == "parquet":
+        return iter_sessions_parquet(pages)
+    return iter_sessions_csv(pages)
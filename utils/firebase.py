@@ -1,6 +1,10 @@
 import logging
-from utils.constants import DEFAULT_PRODUCTS_SEED, AB_TEST_ENABLED, OPENROUTER_MODEL_A, OPENROUTER_MODEL_B
+from firebase_admin import firestore
+from utils.constants import DEFAULT_PRODUCTS_SEED, AB_TEST_ENABLED, OPENROUTER_MODEL_A, OPENROUTER_MODEL_B, GEMINI_MODEL_LABEL
 from datetime import datetime, timezone
+from utils import metrics
+from utils.dashboard import COUNTED_FIELD, rollup_key, add_rollup_writes, models_announced
+from utils.tracing import traced
 
 def seed_initial_products(db):
     if not db:
@@ -19,49 +23,156 @@ def seed_initial_products(db):
     except Exception as e:
         logging.error(f"Erro no seed de produtos: {e}")
 
+PRODUCT_REQUIRED_FIELDS = ('id', 'name', 'price', 'category')
+
+def parse_product_docs(docs):
+    """Converte snapshots de 'products' em dicts, descartando documentos incompletos."""
+    products_list = []
+    for doc in docs:
+        product = doc.to_dict()
+        if product and all(k in product for k in PRODUCT_REQUIRED_FIELDS):
+            products_list.append(product)
+    return products_list
+
+@traced("firestore.load_products")
 def load_products_from_firestore(db):
+    """Produtos da coleção 'products', ou None se a leitura falhar (para o chamador manter o que já tem)."""
     if not db:
         logging.error("Firestore não inicializado. Não é possível carregar produtos.")
-        return []
+        return None
     try:
         products_ref = db.collection('products')
-        docs = products_ref.stream()
-        products_list = [doc.to_dict() for doc in docs if all(k in doc.to_dict() for k in ['id', 'name', 'price', 'category'])]
+        products_list = parse_product_docs(products_ref.stream())
         if not products_list: logging.warning("Nenhum produto carregado do Firestore.")
         return products_list
     except Exception as e:
         logging.error(f"Erro ao carregar produtos do Firestore: {e}")
-        return []
+        return None
+
+def build_session_record(session_data):
+    """Monta o documento de 'sessions' a partir do estado atual da sessão e avança `turn_seq`.
+
+    `turn_seq` viaja com a sessão (compartilhada entre os workers), então ordena os registros
+    da mesma sessão mesmo quando são gravados por processos diferentes.
+    """
+    turn_seq = int(session_data.get("turn_seq") or 0) + 1
+    session_data["turn_seq"] = turn_seq
+    ab_group = session_data.get("ab_test_group")
+
+    if AB_TEST_ENABLED and ab_group == 'B':
+        model_used = OPENROUTER_MODEL_B
+    elif AB_TEST_ENABLED:
+        model_used = OPENROUTER_MODEL_A
+    else:
+        model_used = GEMINI_MODEL_LABEL  # Modelo padrão se A/B não estiver ativo
+    assigned_model = model_used
+
+    # Com failover ou hedging, o dashboard conta a sessão para o modelo que respondeu mais turnos.
+    model_turns = session_data.get("model_turns") or {}
+    if model_turns:
+        model_used = max(model_turns, key=lambda model: (model_turns[model], model == assigned_model))
+
+    return {
+        "session_uuid": session_data["session_uuid"],
+        "final_state": session_data["chat_state"],
+        "model_used": model_used,
+        "assigned_model": assigned_model,
+        "model_turns": dict(model_turns),
+        "timestamp_utc": datetime.now(timezone.utc),
+        "cart_items": len(session_data["customer_data"]["cart"]),
+        "total_value": session_data["total_value"],
+        "turn_seq": turn_seq
+    }
+
+def is_stale_record(stored, record):
+    """O documento gravado já é de um turno igual ou posterior ao do registro (documentos antigos não têm `turn_seq`)."""
+    return stored is not None and (stored.get("turn_seq") or 0) >= record["turn_seq"]
+
+def add_session_writes(db, writer, record, stored):
+    """Acrescenta ao lote/transação o documento da sessão e a troca de contribuição nos contadores.
+
+    A contribuição anterior é a do documento efetivamente gravado (`stored`, lido na mesma
+    transação), e não a que a sessão acredita ter gravado: uma gravação que falhou ou que foi
+    superada por outro worker não desloca os contadores. Um documento anterior aos contadores
+    (sem `rollup_counted`) não tem contribuição a desfazer.
+    """
+    previous_key = rollup_key(stored) if stored and stored.get(COUNTED_FIELD) else None
+    counted = add_rollup_writes(db, writer, previous_key, rollup_key(record))
+    writer.set(db.collection('sessions').document(record["session_uuid"]), dict(record, **{COUNTED_FIELD: counted}))
+
+def _announce_models(db, written):
+    models_announced(db, {key[0] for key in map(rollup_key, written) if key[1]})
+
+@firestore.transactional
+def _write_session_records(transaction, db, records):
+    references = [db.collection('sessions').document(record["session_uuid"]) for record in records]
+    stored = {snapshot.id: snapshot.to_dict() for snapshot in transaction.get_all(references) if snapshot.exists}
+    written = []
+    for record in records:
+        current = stored.get(record["session_uuid"])
+        if not is_stale_record(current, record):
+            add_session_writes(db, transaction, record, current)
+            written.append(record)
+    return written
+
+def write_session_records(db, records):
+    """Grava registros de sessões (um por sessão) numa transação, descartando os que já foram superados.
 
+    Retorna quantos foram gravados. Cada registro ocupa até 4 escritas (limite de 500 por transação).
+    """
+    written = _write_session_records(db.transaction(), db, records)
+    _announce_models(db, written)
+    stale = len(records) - len(written)
+    if stale:
+        metrics.increment("session_writes_stale_total", stale)
+        logging.info(f"{stale} registros de sessão descartados: o Firestore já tinha um turno mais recente.")
+    return len(written)
+
+@firestore.async_transactional
+async def _async_write_session_records(transaction, async_db, records):
+    references = [async_db.collection('sessions').document(record["session_uuid"]) for record in records]
+    # AsyncTransaction.get_all aguarda um gerador assíncrono e falha no SDK real; a leitura
+    # transacional é feita pelo cliente, passando a transação.
+    stored = {snapshot.id: snapshot.to_dict() async for snapshot in async_db.get_all(references, transaction=transaction) if snapshot.exists}
+    written = []
+    for record in records:
+        current = stored.get(record["session_uuid"])
+        if not is_stale_record(current, record):
+            add_session_writes(async_db, transaction, record, current)
+            written.append(record)
+    return written
+
+@traced("firestore.save_session")
 def save_session_to_firestore(db,session_data):
     """Salva o estado final da sessão atual no Firestore."""
     if not db or not session_data.get("session_uuid"):
         return
 
     try:
-        session_uuid = session_data["session_uuid"]
-        ab_group = session_data.get("ab_test_group")
-        
-        if AB_TEST_ENABLED and ab_group == 'B':
-            model_used = OPENROUTER_MODEL_B
-        elif AB_TEST_ENABLED:
-            model_used = OPENROUTER_MODEL_A
-        else:
-            model_used = "Gemini-2.0-flash"  # Modelo padrão se A/B não estiver ativo
-        
-
-        data_to_save = {
-            "session_uuid": session_uuid,
-            "final_state": session_data["chat_state"],
-            "model_used": model_used,
-            "timestamp_utc": datetime.now(timezone.utc),
-            "cart_items": len(session_data["customer_data"]["cart"]),
-            "total_value": session_data["total_value"]
-        }
-
-        sessions_ref = db.collection('sessions')
-        sessions_ref.document(session_uuid).set(data_to_save)
-        logging.info(f"Sessão {session_uuid} salva no Firestore.")
+        data_to_save = build_session_record(session_data)
+        session_uuid = data_to_save["session_uuid"]
+
+        # Documento da sessão e contadores do dashboard são gravados na mesma transação (atômica).
+        if write_session_records(db, [data_to_save]):
+            logging.info(f"Sessão {session_uuid} salva no Firestore.")
+
+    except Exception as e:
+        logging.error(f"Erro ao salvar sessão {session_data.get('session_uuid')} no Firestore: {e}")
+
+async def async_save_session_to_firestore(async_db, session_data):
+    """Versão de `save_session_to_firestore` para o cliente assíncrono do Firestore."""
+    if not async_db or not session_data.get("session_uuid"):
+        return
 
+    try:
+        data_to_save = build_session_record(session_data)
+        session_uuid = data_to_save["session_uuid"]
+
+        written = await _async_write_session_records(async_db.transaction(), async_db, [data_to_save])
+        _announce_models(async_db, written)
+        if written:
+            logging.info(f"Sessão {session_uuid} salva no Firestore.")
+        else:
+            metrics.increment("session_writes_stale_total")
     except Exception as e:
         logging.error(f"Erro ao salvar sessão {session_data.get('session_uuid')} no Firestore: {e}")
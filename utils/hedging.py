@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from utils import admission, llm, metrics
+from utils.chat import build_gemini_history, record_model_answer
+from utils.constants import (
+    GEMINI_MODEL_LABEL, OPENROUTER_MODEL_A, OPENROUTER_MODEL_B, LLM_POOL_MAXSIZE,
+    HEDGE_DELAY_PERCENTILE, HEDGE_DEFAULT_DELAY_SECONDS, HEDGE_MIN_DELAY_SECONDS,
+    HEDGE_MIN_SAMPLES, HEDGE_BACKUP_MODEL
+)
+from utils.response_parser import parse_llm_response
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Threads das tentativas do processo atual (recriadas após fork); duas por turno no máximo."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=2 * LLM_POOL_MAXSIZE, thread_name_prefix="llm-hedge")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def hedge_delay(model):
+    """Espera antes da requisição de reserva: o p95 (HEDGE_DELAY_PERCENTILE) das respostas completas do modelo.
+
+    Até haver HEDGE_MIN_SAMPLES amostras, usa HEDGE_DEFAULT_DELAY_SECONDS.
+    """
+    histogram = metrics.get_histogram("llm_hedge_attempt_seconds", model=model)
+    if histogram.count < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY_SECONDS
+    return max(HEDGE_MIN_DELAY_SECONDS, histogram.quantile(HEDGE_DELAY_PERCENTILE))
+
+
+def backup_model(primary):
+    """Modelo de reserva para `primary`: HEDGE_BACKUP_MODEL ("gemini" ou um modelo do OpenRouter)
+    ou, por padrão, o outro modelo do teste A/B (e OPENROUTER_MODEL_A para o Gemini).
+
+    Retorna None se não houver reserva com chave de API configurada.
+    """
+    if HEDGE_BACKUP_MODEL:
+        candidate = GEMINI_MODEL_LABEL if HEDGE_BACKUP_MODEL.lower() == "gemini" else HEDGE_BACKUP_MODEL
+    elif primary == GEMINI_MODEL_LABEL:
+        candidate = OPENROUTER_MODEL_A
+    else:
+        candidate = OPENROUTER_MODEL_B if primary == OPENROUTER_MODEL_A else OPENROUTER_MODEL_A
+    if candidate == primary:
+        return None
+    if not (llm.GEMINI_API_KEY if candidate == GEMINI_MODEL_LABEL else llm.OPENROUTER_API_KEY):
+        return None
+    return candidate
+
+
+class _Attempt:
+    """Uma chamada em streaming a um modelo, que pode ser cancelada de outra thread.
+
+    `cancel()` fecha a resposta HTTP em andamento: a leitura bloqueada na thread da tentativa
+    termina na hora e a conexão com o provedor é encerrada. Se a resposta ainda não chegou,
+    ela é fechada assim que chegar.
+    """
+
+    def __init__(self, model, role, system_prompt, chat_history):
+        self.model = model
+        self.role = role
+        self.cancelled = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+        if model == GEMINI_MODEL_LABEL:
+            self._chunks = lambda: llm.stream_gemini_api(build_gemini_history(system_prompt, "", chat_history),
+                                                         on_response=self._attach)
+        else:
+            # Sem a sessão: a tentativa roda fora do contexto da requisição e o modelo já está definido.
+            self._chunks = lambda: llm.stream_openrouter_api(system_prompt, chat_history, None, model_to_use=model,
+                                                             on_response=self._attach)
+
+    def _attach(self, response):
+        with self._lock:
+            self._response = response
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            response.close()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            response = self._response
+        if response is not None:
+            response.close()
+
+    def run(self):
+        """Retorna (texto, resposta estruturada válida?) ou None se cancelada."""
+        start = time.perf_counter()
+        chunks = self._chunks()
+        parts = []
+        try:
+            for chunk in chunks:
+                if self.cancelled.is_set():
+                    break
+                parts.append(chunk)
+        finally:
+            chunks.close()
+        if self.cancelled.is_set():
+            metrics.increment("llm_hedge_cancelled_total", model=self.model, role=self.role)
+            # Tempo censurado (a resposta demoraria pelo menos isso): mantém o p95 honesto.
+            metrics.observe("llm_hedge_attempt_seconds", time.perf_counter() - start, model=self.model)
+            return None
+        text = "".join(parts)
+        valid = parse_llm_response(text).structured
+        if valid:
+            metrics.observe("llm_hedge_attempt_seconds", time.perf_counter() - start, model=self.model)
+        return text, valid
+
+
+def call_llm_hedged(system_prompt, chat_history, session_data, use_openrouter, slot=None):
+    """Chama o modelo da sessão (o do grupo A/B se `use_openrouter`, senão o Gemini) e, se não houver
+    resposta válida em `hedge_delay`, dispara o mesmo turno no modelo de reserva; devolve a primeira
+    resposta estruturada válida e cancela a outra tentativa.
+
+    `system_prompt` já inclui a instrução do turno (como em `call_openrouter_api`). O modelo vencedor é
+    registrado em `model_turns` da sessão, que decide o `model_used` gravado em 'sessions'.
+
+    `slot` é o slot de admissão do turno: ele passa para a thread da tentativa principal e só é
+    liberado quando ela termina, mesmo que a reserva vença e esta função retorne antes.
+    """
+    primary = llm._openrouter_model(session_data) if use_openrouter else GEMINI_MODEL_LABEL
+    backup = backup_model(primary)
+    attempts = {}
+    executor = _get_executor()
+    first = _Attempt(primary, "primary", system_prompt, chat_history)
+    attempts[executor.submit(_run_with_slot, first, slot.handoff() if slot is not None else None)] = first
+
+    done, pending = wait(attempts, timeout=hedge_delay(primary))
+    fallback_text = None
+    for future in done:
+        text, valid = future.result()
+        if valid:
+            return _finish(session_data, attempts, first, text, hedged=False)
+        fallback_text = text
+
+    # A reserva só sai se o modelo dela tiver slot livre: com a fila cheia, o hedge só aumentaria a carga.
+    slot = admission.try_admit(backup) if backup is not None else None
+    if slot is not None:
+        # Sem resposta no prazo (ou resposta inválida): dispara a reserva em paralelo.
+        metrics.increment("llm_hedge_fired_total", primary=primary, backup=backup)
+        logging.info(f"Hedging: {primary} sem resposta válida após o prazo; disparando {backup}.")
+        second = _Attempt(backup, "backup", system_prompt, chat_history)
+        future = executor.submit(_run_with_slot, second, slot)
+        attempts[future] = second
+        pending = set(pending) | {future}
+    elif backup is not None:
+        metrics.increment("llm_hedge_skipped_total", primary=primary, backup=backup, reason="busy")
+
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result is None:
+                continue
+            text, valid = result
+            if valid:
+                return _finish(session_data, attempts, attempts[future], text, hedged=slot is not None)
+            if fallback_text is None or attempts[future] is first:
+                fallback_text = text
+
+    metrics.increment("llm_hedge_no_valid_response_total", primary=primary)
+    return fallback_text
+
+
+def _run_with_slot(attempt, slot):
+    if slot is None:
+        return attempt.run()
+    with slot:
+        return attempt.run()
+
+
+def _finish(session_data, attempts, winner, text, hedged):
+    for attempt in attempts.values():
+        if attempt is not winner:
+            attempt.cancel()
+    metrics.increment("llm_hedge_wins_total", model=winner.model, role=winner.role if hedged else "unhedged")
+    record_model_answer(session_data, winner.model)
+    return text
@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import firebase_admin
+from firebase_admin import credentials
+from firebase_admin import firestore
+from utils import llm, metrics
+from utils.cart import get_product_index
+from utils.catalog import get_catalog, get_catalog_cache_stats
+from utils.firebase import seed_initial_products
+from utils.transport import get_http_session
+from utils.constants import WARMUP_ENABLED, WARMUP_LLM_CONNECTIONS, WARMUP_LLM_TIMEOUT_SECONDS, SEED_PRODUCTS_ON_STARTUP
+
+# Cliente do Firestore do processo atual: criado na primeira chamada, nunca no import (nem no master
+# do gunicorn com preload_app), já que os canais gRPC não sobrevivem a um fork.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+_state = {"phase": "cold", "pid": None, "started_at": None, "ready_seconds": None, "steps": {}, "error": None}
+_warm_up_lock = threading.Lock()
+_process_started = time.monotonic()
+
+
+def get_firestore_client():
+    """Cliente do Firestore do processo (inicializa o Firebase Admin SDK na primeira chamada).
+
+    Retorna None se a inicialização falhar; a falha não é repetida no mesmo processo.
+    """
+    global _client, _client_pid
+    if _client_pid != os.getpid():
+        with _client_lock:
+            if _client_pid != os.getpid():
+                _client, _client_pid = _create_firestore_client(), os.getpid()
+    return _client
+
+
+def _create_firestore_client():
+    try:
+        if firebase_admin._DEFAULT_APP_NAME in firebase_admin._apps:
+            # App herdado de outro processo (inicializado antes do fork): o cliente dele não serve aqui.
+            firebase_admin.delete_app(firebase_admin.get_app())
+        firebase_admin.initialize_app(credentials.ApplicationDefault())
+        client = firestore.client()
+        logging.info(f"Firebase Admin SDK inicializado com sucesso (pid {os.getpid()}).")
+        return client
+    except Exception as e:
+        logging.error(f"ERRO CRÍTICO: Falha ao inicializar o Firebase Admin SDK: {e}")
+        return None
+
+
+def warm_llm_connections(connections=None, timeout=WARMUP_LLM_TIMEOUT_SECONDS):
+    """Abre `connections` conexões keep-alive com cada provedor configurado, que ficam no pool da sessão HTTP.
+
+    Usa HEAD na URL do provedor: qualquer resposta HTTP serve, o que importa é o handshake TCP/TLS
+    já feito quando o primeiro turno chegar. Retorna o número de conexões abertas.
+    """
+    connections = WARMUP_LLM_CONNECTIONS if connections is None else connections
+    urls = []
+    if llm.GEMINI_API_KEY:
+        urls.append(llm.GEMINI_API_URL)
+    if llm.OPENROUTER_API_KEY:
+        urls.append(llm.OPENROUTER_API_URL)
+    if not urls or connections <= 0:
+        return 0
+    session = get_http_session()
+
+    def open_connection(url):
+        try:
+            session.head(url, timeout=timeout).close()
+            return 1
+        except Exception as e:
+            logging.warning(f"Aquecimento: não foi possível conectar ao provedor ({type(e).__name__}).")
+            return 0
+
+    # Em paralelo: em sequência, cada HEAD reaproveitaria a conexão aberta pelo anterior.
+    with ThreadPoolExecutor(max_workers=len(urls) * connections) as pool:
+        return sum(pool.map(open_connection, [url for url in urls for _ in range(connections)]))
+
+
+def _load_catalog(db):
+    if not get_catalog(db)["products"]:
+        raise RuntimeError("catálogo vazio")
+
+
+def warm_up_steps(db):
+    """Etapas padrão do aquecimento de um worker, na ordem em que rodam."""
+    steps = []
+    if SEED_PRODUCTS_ON_STARTUP:
+        steps.append(("seed_products", lambda: seed_initial_products(db)))
+    steps += [
+        ("catalog", lambda: _load_catalog(db)),
+        ("system_prompt", lambda: llm.get_base_system_prompt(db)),
+        ("product_index", lambda: get_product_index(db)),
+        ("llm_connections", warm_llm_connections),
+    ]
+    return steps
+
+
+def warm_up(db, extra_steps=()):
+    """Aquece o processo atual uma única vez: catálogo, prompt do sistema, índice de produtos e conexões.
+
+    Chamado pelo hook `post_worker_init` do gunicorn (gunicorn.conf.py), antes de o worker aceitar
+    requisições. Sem o Firestore o worker segue atendendo, mas não fica pronto (/readyz responde 503).
+    Com WARMUP_ENABLED desligado nenhuma etapa roda e o worker fica pronto se tiver o Firestore.
+    """
+    with _warm_up_lock:
+        if _state["pid"] == os.getpid() and _state["phase"] != "cold":
+            return readiness()
+        _state.update({"phase": "warming", "pid": os.getpid(), "started_at": time.time(), "steps": {}, "error": None})
+        start = time.perf_counter()
+        steps = ((warm_up_steps(db) if db else []) + list(extra_steps)) if WARMUP_ENABLED else []
+        for name, step in steps:
+            step_start = time.perf_counter()
+            try:
+                step()
+                status = "ok"
+            except Exception as e:
+                logging.error(f"Aquecimento: etapa {name} falhou: {e}")
+                status = "error"
+            seconds = time.perf_counter() - step_start
+            _state["steps"][name] = {"status": status, "seconds": round(seconds, 4)}
+            metrics.observe("startup_warmup_seconds", seconds, step=name)
+
+        if not db:
+            _state.update({"phase": "failed", "error": "Firestore não inicializado"})
+        elif _state["steps"].get("catalog", {}).get("status") == "error":
+            _state.update({"phase": "failed", "error": "Falha ao carregar o catálogo"})
+        else:
+            _state["phase"] = "ready"
+        _state["ready_seconds"] = round(time.perf_counter() - start, 4)
+        metrics.set_gauge("startup_ready", 1 if _state["phase"] == "ready" else 0)
+        logging.info(f"Aquecimento do worker {os.getpid()}: {_state['phase']} em {_state['ready_seconds']}s.")
+        return readiness()
+
+
+def readiness():
+    """Estado do aquecimento deste processo (usado por /readyz)."""
+    current = _state["pid"] == os.getpid()
+    return {
+        "ready": current and _state["phase"] == "ready",
+        "phase": _state["phase"] if current else "cold",
+        "pid": os.getpid(),
+        "warm_up_seconds": _state["ready_seconds"] if current else None,
+        "steps": dict(_state["steps"]) if current else {},
+        "error": _state["error"] if current else None,
+        "catalog_version": get_catalog_cache_stats()["version"] if current else None,
+    }
+
+
+def liveness():
+    """O processo está de pé (usado por /healthz); não toca em Firestore nem nos provedores."""
+    return {"status": "ok", "pid": os.getpid(), "uptime_seconds": round(time.monotonic() - _process_started, 3)}
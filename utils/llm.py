@@ -1,18 +1,31 @@
+import json
 import logging
 import requests
-from utils.firebase import load_products_from_firestore
+from utils import metrics
+from utils.catalog import get_catalog
+from utils.chat import build_gemini_history, record_model_answer
+from utils.transport import post_with_retry
 from utils.constants import (
-    GEMINI_API_KEY, GEMINI_API_URL,
+    GEMINI_API_KEY, GEMINI_API_URL, GEMINI_STREAM_API_URL, GEMINI_MODEL_LABEL,
     OPENROUTER_API_KEY, OPENROUTER_API_URL,
     OPENROUTER_MODEL_A, OPENROUTER_MODEL_B,
-    AB_TEST_ENABLED
+    AB_TEST_ENABLED, LLM_FAILOVER_TO_GEMINI
 )
 
+# Prompt renderizado por versão do catálogo; só é refeito quando o catálogo muda.
+_system_prompt_cache = {"version": None, "prompt": None}
+
 def get_base_system_prompt(db):
-    products_list = load_products_from_firestore(db)
-    products_string = "\n".join([f"- {p['category']}: {p['name']} - R$ {p['price']}" for p in products_list])
-    if not products_string: products_string = "Nenhum produto disponível no momento."
+    global _system_prompt_cache
+    catalog = get_catalog(db)
+    cached = _system_prompt_cache
+    if cached["version"] != catalog["version"] or cached["prompt"] is None:
+        # Troca o dict inteiro para que leituras concorrentes nunca vejam versão e prompt misturados.
+        cached = {"version": catalog["version"], "prompt": render_system_prompt(catalog["products_string"])}
+        _system_prompt_cache = cached
+    return cached["prompt"]
 
+def render_system_prompt(products_string):
     return f"""Você é 39A-na, assistente de vendas virtual do "Marketplace" de eletrônicos.
                 Seu objetivo: ajudar clientes a encontrar produtos, adicioná-los ao carrinho, e se desejarem finalizar a compra, coletar Nome, Email e Telefone para gerar uma proposta comercial COM UM LINK DE CHECKOUT FALSO.
                 Mantenha tom amigável e profissional, sempre em português brasileiro.
@@ -61,20 +74,38 @@ def build_llm_prompt_context_instruction(session_data):
     session_data["last_input_invalid"] = False
     return instruction
 
-def call_gemini_api(prompt_history):
-    if not GEMINI_API_KEY:
-        logging.error("API Key Gemini não configurada.")
-        return "ERRO INTERNO: IA indisponível."
-    payload = {
+def _gemini_payload(prompt_history):
+    return {
         "contents": prompt_history,
         "generationConfig": {"temperature": 0.65, "maxOutputTokens": 500}
     }
+
+def record_token_usage(provider, model, result):
+    """Registra os tokens informados pelo provedor (`usageMetadata` do Gemini, `usage` do OpenRouter)."""
+    usage = result.get("usageMetadata") or result.get("usage")
+    if not isinstance(usage, dict):
+        return
+    prompt_tokens = usage.get("promptTokenCount", usage.get("prompt_tokens"))
+    completion_tokens = usage.get("candidatesTokenCount", usage.get("completion_tokens"))
+    for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if isinstance(tokens, int):
+            metrics.increment("llm_tokens_total", tokens, provider=provider, model=model, kind=kind)
+            metrics.observe("llm_tokens_per_request", tokens, buckets=metrics.TOKEN_BUCKETS, provider=provider, kind=kind)
+
+def call_gemini_api(prompt_history, session_data=None):
+    """Chama o Gemini; com `session_data`, conta o turno para o Gemini só se ele responder."""
+    if not GEMINI_API_KEY:
+        logging.error("API Key Gemini não configurada.")
+        return "ERRO INTERNO: IA indisponível."
+    payload = _gemini_payload(prompt_history)
     headers = {'Content-Type': 'application/json'}
     try:
-        response = requests.post(GEMINI_API_URL, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
+        response = post_with_retry("gemini", GEMINI_MODEL_LABEL, GEMINI_API_URL, headers=headers, json=payload, timeout=60)
         result = response.json()
+        record_token_usage("gemini", GEMINI_MODEL_LABEL, result)
         if result.get("candidates") and result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts"):
+            if session_data is not None:
+                record_model_answer(session_data, GEMINI_MODEL_LABEL)
             return result["candidates"][0]["content"]["parts"][0]["text"]
         # ... (resto do tratamento de erro da API)
         logging.error(f"Resposta API Gemini inesperada: {result}")
@@ -83,11 +114,7 @@ def call_gemini_api(prompt_history):
         logging.error(f"Erro API Gemini: {e}")
         return "Ops! Problema com nossa IA. Tente novamente."
 
-def call_openrouter_api(system_prompt, chat_history, session_data):
-    if not OPENROUTER_API_KEY:
-        logging.error("API Key do OpenRouter não configurada.")
-        return "ERRO INTERNO: A configuração da IA está ausente."
-
+def _openrouter_model(session_data):
     ab_group = session_data.get("ab_test_group")
     if AB_TEST_ENABLED and ab_group == 'B':
         model_to_use = OPENROUTER_MODEL_B
@@ -95,30 +122,43 @@ def call_openrouter_api(system_prompt, chat_history, session_data):
     else:
         model_to_use = OPENROUTER_MODEL_A
         logging.info(f"Sessão no grupo A. Usando modelo: {model_to_use}")
+    return model_to_use
 
-    headers = {
+def _openrouter_headers():
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
         "HTTP-Referer": "http://localhost:5001", 
         "X-Title": "Marketplace Chatbot"
     }
 
+def _openrouter_payload(model_to_use, system_prompt, chat_history):
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend(chat_history)
 
-    payload = {
+    return {
         "model": model_to_use,
         "messages": messages,
         "temperature": 0.2,
         "max_tokens": 600
     }
 
+def call_openrouter_api(system_prompt, chat_history, session_data):
+    if not OPENROUTER_API_KEY:
+        logging.error("API Key do OpenRouter não configurada.")
+        return "ERRO INTERNO: A configuração da IA está ausente."
+
+    model_to_use = _openrouter_model(session_data)
+    headers = _openrouter_headers()
+    payload = _openrouter_payload(model_to_use, system_prompt, chat_history)
+
     try:
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
+        response = post_with_retry("openrouter", model_to_use, OPENROUTER_API_URL, headers=headers, json=payload, timeout=60)
         result = response.json()
+        record_token_usage("openrouter", model_to_use, result)
 
         if result.get("choices") and result["choices"][0].get("message") and result["choices"][0]["message"].get("content"):
+            record_model_answer(session_data, model_to_use)
             return result["choices"][0]["message"]["content"].strip()
         else:
             logging.error(f"Resposta da API OpenRouter inesperada: {result}")
@@ -127,7 +167,79 @@ def call_openrouter_api(system_prompt, chat_history, session_data):
         logging.error(f"Erro de comunicação com a API OpenRouter: {e}")
         if e.response is not None:
             logging.error(f"Detalhes do erro da API: {e.response.text}")
+        if LLM_FAILOVER_TO_GEMINI and GEMINI_API_KEY:
+            logging.warning(f"Usando Gemini como alternativa ao modelo {model_to_use}.")
+            metrics.increment("llm_failover_total", from_model=model_to_use, to_model=GEMINI_MODEL_LABEL)
+            # O system_prompt recebido já inclui a instrução e o estado do turno.
+            return call_gemini_api(build_gemini_history(system_prompt, "", chat_history), session_data)
         return "Ops! Tive um problema de comunicação com nossa IA. Poderia tentar novamente?"
     except Exception as e:
         logging.error(f"Erro inesperado ao chamar a API OpenRouter: {e}")
         return "Desculpe, ocorreu um erro interno ao tentar processar sua solicitação."
+
+def _iter_sse_data(response):
+    """Itera sobre os campos `data:` de uma resposta Server-Sent Events."""
+    response.encoding = 'utf-8'
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith("data:"):
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            yield data
+
+def stream_gemini_api(prompt_history, on_response=None):
+    """Versão em streaming de `call_gemini_api`: gera os pedaços de texto conforme chegam.
+
+    `on_response` recebe a resposta HTTP assim que ela chega (ex.: para outra thread poder fechá-la).
+    """
+    if not GEMINI_API_KEY:
+        logging.error("API Key Gemini não configurada.")
+        yield "ERRO INTERNO: IA indisponível."
+        return
+    headers = {'Content-Type': 'application/json'}
+    try:
+        with post_with_retry("gemini", GEMINI_MODEL_LABEL, GEMINI_STREAM_API_URL, headers=headers, json=_gemini_payload(prompt_history), timeout=60, stream=True) as response:
+            if on_response is not None:
+                on_response(response)
+            usage = {}
+            for data in _iter_sse_data(response):
+                result = json.loads(data)
+                # Cada pedaço traz o uso acumulado; vale o do último.
+                usage = result if "usageMetadata" in result else usage
+                for candidate in result.get("candidates", [])[:1]:
+                    for part in (candidate.get("content") or {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+            record_token_usage("gemini", GEMINI_MODEL_LABEL, usage)
+    except Exception as e:
+        logging.error(f"Erro API Gemini (streaming): {e}")
+        yield "Ops! Problema com nossa IA. Tente novamente."
+
+def stream_openrouter_api(system_prompt, chat_history, session_data, model_to_use=None, on_response=None):
+    """Versão em streaming de `call_openrouter_api` (`stream: true`); `model_to_use` substitui o modelo do grupo A/B.
+
+    `on_response` como em `stream_gemini_api`.
+    """
+    if not OPENROUTER_API_KEY:
+        logging.error("API Key do OpenRouter não configurada.")
+        yield "ERRO INTERNO: A configuração da IA está ausente."
+        return
+    model_to_use = model_to_use or _openrouter_model(session_data)
+    payload = _openrouter_payload(model_to_use, system_prompt, chat_history)
+    payload["stream"] = True
+    try:
+        with post_with_retry("openrouter", model_to_use, OPENROUTER_API_URL, headers=_openrouter_headers(), json=payload, timeout=60, stream=True) as response:
+            if on_response is not None:
+                on_response(response)
+            usage = {}
+            for data in _iter_sse_data(response):
+                result = json.loads(data)
+                usage = result if result.get("usage") else usage
+                for choice in result.get("choices", [])[:1]:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+            record_token_usage("openrouter", model_to_use, usage)
+    except Exception as e:
+        logging.error(f"Erro na API OpenRouter (streaming): {e}")
+        yield "Ops! Tive um problema de comunicação com nossa IA. Poderia tentar novamente?"
@@ -0,0 +1,71 @@
+import logging
+import httpx
+from utils.constants import (
+    GEMINI_API_KEY, GEMINI_API_URL, GEMINI_MODEL_LABEL,
+    OPENROUTER_API_KEY, OPENROUTER_API_URL,
+    ASYNC_HTTP_MAX_CONNECTIONS
+)
+from utils.llm import _gemini_payload, _openrouter_model, _openrouter_headers, _openrouter_payload, record_token_usage
+
+# Cliente HTTP compartilhado pelo processo (um por event loop do servidor ASGI):
+# mantém as conexões com os provedores abertas entre os turnos.
+_client = None
+
+def get_async_http_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS // 4),
+        )
+    return _client
+
+async def close_async_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def async_call_gemini_api(prompt_history):
+    if not GEMINI_API_KEY:
+        logging.error("API Key Gemini não configurada.")
+        return "ERRO INTERNO: IA indisponível."
+    headers = {'Content-Type': 'application/json'}
+    try:
+        response = await get_async_http_client().post(GEMINI_API_URL, headers=headers, json=_gemini_payload(prompt_history))
+        response.raise_for_status()
+        result = response.json()
+        record_token_usage("gemini", GEMINI_MODEL_LABEL, result)
+        if result.get("candidates") and result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts"):
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+        logging.error(f"Resposta API Gemini inesperada: {result}")
+        return "Desculpe, não consegui processar (resposta IA inesperada)."
+    except Exception as e:
+        logging.error(f"Erro API Gemini: {e}")
+        return "Ops! Problema com nossa IA. Tente novamente."
+
+async def async_call_openrouter_api(system_prompt, chat_history, session_data):
+    if not OPENROUTER_API_KEY:
+        logging.error("API Key do OpenRouter não configurada.")
+        return "ERRO INTERNO: A configuração da IA está ausente."
+
+    model_to_use = _openrouter_model(session_data)
+    payload = _openrouter_payload(model_to_use, system_prompt, chat_history)
+    try:
+        response = await get_async_http_client().post(OPENROUTER_API_URL, headers=_openrouter_headers(), json=payload)
+        response.raise_for_status()
+        result = response.json()
+        record_token_usage("openrouter", model_to_use, result)
+
+        if result.get("choices") and result["choices"][0].get("message") and result["choices"][0]["message"].get("content"):
+            return result["choices"][0]["message"]["content"].strip()
+        logging.error(f"Resposta da API OpenRouter inesperada: {result}")
+        return "Desculpe, não consegui processar a sua solicitação (resposta da IA foi inesperada)."
+    except httpx.HTTPError as e:
+        logging.error(f"Erro de comunicação com a API OpenRouter: {e}")
+        if isinstance(e, httpx.HTTPStatusError):
+            logging.error(f"Detalhes do erro da API: {e.response.text}")
+        return "Ops! Tive um problema de comunicação com nossa IA. Poderia tentar novamente?"
+    except Exception as e:
+        logging.error(f"Erro inesperado ao chamar a API OpenRouter: {e}")
+        return "Desculpe, ocorreu um erro interno ao tentar processar sua solicitação."
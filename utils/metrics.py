@@ -0,0 +1,176 @@
+import bisect
+import os
+import threading
+
+# Registro de métricas em memória do processo (contadores e histogramas com rótulos).
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000, 16000, 32000)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Histogram:
+    """Histograma de buckets fixos, no formato cumulativo do Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self):
+        return self._count
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative, running = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+    def quantile(self, q):
+        """Estimativa do quantil por interpolação linear dentro do bucket; None se vazio."""
+        snap = self.snapshot()
+        if not snap["count"]:
+            return None
+        target = q * snap["count"]
+        lower_bound, lower_count = 0.0, 0
+        for bound, cumulative in snap["buckets"]:
+            if cumulative >= target:
+                if bound == float("inf"):
+                    return lower_bound
+                in_bucket = cumulative - lower_count
+                fraction = (target - lower_count) / in_bucket if in_bucket else 1.0
+                return lower_bound + (bound - lower_bound) * fraction
+            lower_bound, lower_count = bound, cumulative
+        return lower_bound
+
+
+def increment(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def get_counter(name, **labels):
+    return _counters.get(_key(name, labels), 0)
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def get_gauge(name, **labels):
+    return _gauges.get(_key(name, labels), 0)
+
+
+def get_histogram(name, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+    key = _key(name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, Histogram(buckets))
+    return histogram
+
+
+def observe(name, value, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+    get_histogram(name, buckets=buckets, **labels).observe(value)
+
+
+def iter_counters():
+    """Gera (nome, rótulos, valor) de todos os contadores registrados."""
+    with _lock:
+        items = list(_counters.items())
+    for (name, labels), value in items:
+        yield name, dict(labels), value
+
+
+def iter_gauges():
+    """Gera (nome, rótulos, valor) de todos os gauges registrados."""
+    with _lock:
+        items = list(_gauges.items())
+    for (name, labels), value in items:
+        yield name, dict(labels), value
+
+
+def iter_histograms():
+    """Gera (nome, rótulos, histograma) de todos os histogramas registrados."""
+    with _lock:
+        items = list(_histograms.items())
+    for (name, labels), histogram in items:
+        yield name, dict(labels), histogram
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    items = sorted(labels.items()) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in items) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def render_prometheus():
+    """Todas as métricas do processo no formato de texto do Prometheus (v0.0.4).
+
+    O registro é por processo: cada worker do gunicorn conta só as próprias requisições e um
+    scrape de `/metrics` cai em um worker qualquer. Toda série leva o rótulo `worker` (PID do
+    processo), para que as séries de workers diferentes não se misturem nem pareçam reinícios
+    do contador; somas entre workers (`sum without (worker)`) cobrem só os workers já raspados.
+    """
+    lines = []
+    seen = set()
+    worker = [("worker", str(os.getpid()))]
+
+    def type_line(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for name, labels, value in sorted(iter_counters(), key=lambda item: item[0]):
+        type_line(name, "counter")
+        lines.append(f"{name}{_format_labels(labels, worker)} {value}")
+    for name, labels, value in sorted(iter_gauges(), key=lambda item: item[0]):
+        type_line(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels, worker)} {value}")
+    for name, labels, histogram in sorted(iter_histograms(), key=lambda item: item[0]):
+        type_line(name, "histogram")
+        snap = histogram.snapshot()
+        for bound, cumulative in snap["buckets"]:
+            lines.append(f"{name}_bucket{_format_labels(labels, worker + [('le', _format_bound(bound))])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels, worker)} {snap['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels, worker)} {snap['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from utils import metrics
+from utils.catalog import on_catalog_refresh
+from utils.chat import normalize_user_text
+from utils.response_parser import parse_llm_response
+from utils.constants import (
+    AB_TEST_ENABLED, GEMINI_MODEL_LABEL,
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS
+)
+
+
+def is_cacheable_turn(session_data):
+    """Só a primeira pergunta da conversa, em 'ajuda_na_escolha' e com carrinho vazio.
+
+    Nesses turnos a resposta depende apenas do texto do usuário e do catálogo
+    embutido no prompt de sistema, não do histórico nem do estado da sessão.
+    """
+    if session_data.get("chat_state") != 'ajuda_na_escolha':
+        return False
+    customer = session_data.get("customer_data") or {}
+    if customer.get("cart") or customer.get("product_selected_for_cart"):
+        return False
+    user_turns = sum(1 for message in session_data.get("chat_history_for_llm", []) if message.get("role") == "user")
+    return user_turns == 1
+
+
+def is_cacheable_response(bot_response):
+    """Só guarda respostas estruturadas que mantêm a conversa em 'ajuda_na_escolha' sem mexer no carrinho."""
+    parsed = parse_llm_response(bot_response or "")
+    return parsed.structured and not parsed.errors and parsed.chat_state == 'ajuda_na_escolha' and not parsed.cart
+
+
+def _model_key(session_data):
+    # Cada modelo do teste A/B responde de um jeito; as respostas não são compartilhadas entre grupos.
+    return session_data.get("ab_test_group") if AB_TEST_ENABLED else GEMINI_MODEL_LABEL
+
+
+class ResponseCache:
+    """Cache LRU com TTL das respostas do LLM, indexado por (versão do catálogo, modelo, texto normalizado)."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["stored_at"] > self.ttl_seconds:
+                del self._entries[key]
+                metrics.increment("response_cache_expired_total")
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response, latency):
+        with self._lock:
+            self._entries[key] = {"response": response, "latency": latency, "stored_at": time.monotonic()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.increment("response_cache_evictions_total")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = ResponseCache()
+
+
+def _on_catalog_change(version):
+    # A versão já faz parte da chave; limpar apenas libera as entradas que nunca mais seriam usadas.
+    _cache.clear()
+
+
+on_catalog_refresh(_on_catalog_change)
+
+
+def lookup(session_data, user_input, catalog_version):
+    """Retorna (chave, resposta em cache); a chave é None quando o turno não é elegível ao cache."""
+    if not RESPONSE_CACHE_ENABLED or not is_cacheable_turn(session_data):
+        return None, None
+    key = (catalog_version, _model_key(session_data), normalize_user_text(user_input))
+    entry = _cache.get(key)
+    if entry is None:
+        metrics.increment("response_cache_misses_total")
+        return key, None
+    metrics.increment("response_cache_hits_total")
+    metrics.increment("response_cache_latency_saved_seconds", entry["latency"])
+    return key, entry["response"]
+
+
+def store(key, bot_response, latency):
+    """Guarda a resposta obtida depois de um `lookup` sem acerto (nada a fazer se a chave é None)."""
+    if key is not None and is_cacheable_response(bot_response):
+        _cache.put(key, bot_response, latency)
+
+
+def store_stream(key, chunks):
+    """Repassa os pedaços da resposta em streaming e, ao fim, guarda a resposta completa com `store`."""
+    start = time.perf_counter()
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    store(key, "".join(parts), time.perf_counter() - start)
+
+
+def clear_response_cache():
+    _cache.clear()
+
+
+def get_response_cache_stats():
+    hits = metrics.get_counter("response_cache_hits_total")
+    misses = metrics.get_counter("response_cache_misses_total")
+    return {
+        "enabled": RESPONSE_CACHE_ENABLED,
+        "entries": len(_cache),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        "latency_saved_seconds": round(metrics.get_counter("response_cache_latency_saved_seconds"), 3),
+        "evictions": metrics.get_counter("response_cache_evictions_total"),
+    }
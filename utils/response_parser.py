@@ -0,0 +1,253 @@
+import json
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+from typing import Optional
+from utils import metrics
+
+# Blocos de raciocínio de modelos como o DeepSeek-R1; um <think> sem fechamento descarta o resto do texto.
+_THINK_BLOCK = re.compile(r"<think>.*?(?:</think>|$)", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_URL = re.compile(r"https?://")
+_PRICE_CHARS = re.compile(r"[^\d,.\-]")
+_CENTS = Decimal("0.01")
+_decoder = json.JSONDecoder()
+# Dentro de um objeto: strings inteiras (inclusive sem o fechamento, até o fim do texto) ou chaves.
+_OBJECT_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?:"|\Z)|[{}]', re.DOTALL)
+
+
+def parse_brl_price(value):
+    """Converte preços como "3.499,00", "R$ 1.299,9", "3499.00" ou 3499 em Decimal; None se inválido."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        try:
+            return Decimal(str(value)).quantize(_CENTS, ROUND_HALF_UP)
+        except InvalidOperation:
+            return None
+    if not isinstance(value, str):
+        return None
+    return _parse_price_string(value)
+
+
+@lru_cache(maxsize=1024)
+def _parse_price_string(value):
+    # Os preços se repetem (vêm do catálogo), então o resultado imutável é memorizado.
+    text = _PRICE_CHARS.sub("", value)
+    if "," in text:
+        # Formato brasileiro: ponto separa milhares, vírgula separa centavos.
+        text = text.replace(".", "").replace(",", ".")
+    elif text.count(".") > 1 or (text.count(".") == 1 and len(text.rsplit(".", 1)[1]) == 3):
+        # "3.499" ou "1.299.000": pontos como separadores de milhares.
+        text = text.replace(".", "")
+    try:
+        return Decimal(text).quantize(_CENTS, ROUND_HALF_UP)
+    except InvalidOperation:
+        return None
+
+
+def format_brl_price(value):
+    """Decimal("3499.00") -> "3.499,00"."""
+    return f"{value:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+# Dataclasses comuns, não `frozen`: o __init__ congelado custa ~1 µs a mais por resposta e ninguém
+# altera os resultados depois de criados.
+@dataclass
+class CartItem:
+    nome: str
+    price: Decimal
+
+    def to_dict(self):
+        return {"nome": self.nome, "preço": format_brl_price(self.price)}
+
+
+@dataclass
+class ParsedResponse:
+    """Resposta do LLM validada. `structured` é falso quando não havia JSON utilizável."""
+    resposta: str
+    structured: bool
+    chat_state: Optional[str] = None
+    cart: tuple = ()
+    product_selected_for_cart: Optional[CartItem] = None
+    total_value: Optional[Decimal] = None
+    customer_data: dict = field(default_factory=dict)
+    last_input_invalid: bool = False
+    has_link: bool = False
+    errors: tuple = ()
+
+
+def _find_resposta(value):
+    """Primeiro dict com "resposta" em `value`, em pré-ordem (a ordem em que aparecem no texto)."""
+    if isinstance(value, dict):
+        if "resposta" in value:
+            return value
+        children = value.values()
+    elif isinstance(value, list):
+        children = value
+    else:
+        return None
+    for child in children:
+        found = _find_resposta(child)
+        if found is not None:
+            return found
+    return None
+
+
+def _decode_at(text, start):
+    """(dict com "resposta" no JSON que começa em `start` ou None, fim do JSON); o fim é `start` se inválido."""
+    try:
+        obj, end = _decoder.raw_decode(text, start)
+        return _find_resposta(obj), end
+    except (json.JSONDecodeError, RecursionError):
+        # RecursionError: aninhamento fundo demais para o decodificador (lixo, não uma resposta).
+        return None, start
+
+
+def _extract_object(text):
+    """Primeiro objeto JSON com "resposta" no texto, ignorando preâmbulo, cercas de código e lixo no fim.
+
+    Cada objeto de nível 0 é decodificado uma vez; se for inválido (truncado, vírgula sobrando),
+    uma única varredura acompanha a profundidade das chaves, ignorando as que estão dentro de
+    strings, e só os objetos internos já fechados são decodificados, na ordem em que começam.
+    Um '{' sem fechamento não é decodificado de novo a partir de cada chave seguinte.
+    """
+    top = text.find("{")
+    while top != -1:
+        found, end = _decode_at(text, top)
+        if found is not None:
+            return found
+        if end > top:
+            # Objeto válido sem "resposta" em nenhum nível: segue para o próximo.
+            top = text.find("{", end)
+            continue
+        opened, starts, pos = [top], [], len(text)
+        for match in _OBJECT_TOKEN.finditer(text, top + 1):
+            token = match.group()
+            if token == "{":
+                opened.append(match.start())
+            elif token == "}":
+                starts.append(opened.pop())
+                if not opened:
+                    pos = match.end()
+                    break
+        skip_until = top + 1
+        for start in sorted(starts):
+            if start < skip_until:
+                continue
+            found, end = _decode_at(text, start)
+            if found is not None:
+                return found
+            # Os objetos dentro de um JSON válido já foram examinados por _find_resposta.
+            skip_until = max(skip_until, end)
+        if opened:
+            return None
+        top = text.find("{", pos)
+    return None
+
+
+def _parse_cart_item(value, errors, field_name):
+    if not isinstance(value, dict):
+        errors.append(f"{field_name}: item não é um objeto")
+        return None
+    nome = value.get("nome")
+    price = parse_brl_price(value.get("preço", value.get("preco")))
+    if not isinstance(nome, str) or not nome.strip():
+        errors.append(f"{field_name}: item sem nome")
+        return None
+    if price is None:
+        errors.append(f"{field_name}: preço inválido para {nome!r}")
+        return None
+    return CartItem(nome.strip(), price)
+
+
+def _validate_resposta(value, errors):
+    return value if isinstance(value, str) else None
+
+
+def _validate_chat_state(value, errors):
+    if isinstance(value, str) and value.strip():
+        return value.strip()
+    if value is not None:
+        errors.append("chat_state: valor inválido")
+    return None
+
+
+def _validate_cart(value, errors):
+    if value is None:
+        return ()
+    if not isinstance(value, list):
+        errors.append("cart: não é uma lista")
+        return ()
+    items = (_parse_cart_item(item, errors, "cart") for item in value)
+    return tuple(item for item in items if item is not None)
+
+
+def _validate_selected(value, errors):
+    if not value or (isinstance(value, dict) and not value.get("nome")):
+        return None
+    return _parse_cart_item(value, errors, "product_selected_for_cart")
+
+
+def _validate_total(value, errors):
+    if value is None or value == "":
+        return None
+    total = parse_brl_price(value)
+    if total is None:
+        errors.append(f"total_value: valor inválido {value!r}")
+    return total
+
+
+def _validate_customer(value, errors):
+    if not isinstance(value, dict):
+        return {}
+    return {key: value[key] for key in ("name", "email", "phone") if isinstance(value.get(key), str) and value[key].strip()}
+
+
+def _validate_flag(value, errors):
+    return value is True or (isinstance(value, str) and value.strip().lower() == "true")
+
+
+# Esquema compilado: campo do JSON -> (atributo de ParsedResponse, validador).
+_SCHEMA = (
+    ("resposta", "resposta", _validate_resposta),
+    ("chat_state", "chat_state", _validate_chat_state),
+    ("cart", "cart", _validate_cart),
+    ("product_selected_for_cart", "product_selected_for_cart", _validate_selected),
+    ("total_value", "total_value", _validate_total),
+    ("customer_data", "customer_data", _validate_customer),
+    ("last_input_invalid", "last_input_invalid", _validate_flag),
+)
+
+
+def parse_llm_response(raw):
+    """Extrai e valida a resposta estruturada do LLM numa única passada pelo texto.
+
+    Nunca levanta exceção: sem um objeto JSON com "resposta" em texto, devolve o
+    texto (sem blocos <think>) como resposta não estruturada. Campos inválidos
+    são descartados e descritos em `errors`; `total_value` ausente ou inválido é
+    recalculado a partir do carrinho.
+    """
+    text = raw if isinstance(raw, str) else str(raw)
+    if "<think" in text or "<THINK" in text:
+        text = _THINK_BLOCK.sub("", text)
+    text = text.strip()
+
+    obj = _extract_object(text) if "{" in text else None
+    if obj is None and "{" in text and _TRAILING_COMMA.search(text):
+        obj = _extract_object(_TRAILING_COMMA.sub(r"\1", text))
+    values = {}
+    errors = []
+    if obj is not None:
+        for key, attribute, validate in _SCHEMA:
+            values[attribute] = validate(obj.get(key), errors)
+
+    if obj is None or values["resposta"] is None:
+        metrics.increment("llm_response_parse_total", outcome="unstructured")
+        return ParsedResponse(resposta=text, structured=False, has_link=bool(_URL.search(text)))
+
+    if values["total_value"] is None:
+        values["total_value"] = sum((item.price for item in values["cart"]), Decimal("0.00"))
+    metrics.increment("llm_response_parse_total", outcome="invalid_fields" if errors else "ok")
+    return ParsedResponse(structured=True, has_link=bool(_URL.search(values["resposta"])), errors=tuple(errors), **values)
@@ -0,0 +1,346 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.datastructures import CallbackDict
+from utils.constants import (
+    SESSION_BACKEND, SESSION_SQLITE_PATH, SESSION_REDIS_URL,
+    SESSION_MEMORY_MAX_SESSIONS, SESSION_TTL_SECONDS, SESSION_PURGE_INTERVAL_SECONDS
+)
+
+try:
+    import msgpack
+except ImportError:  # msgpack é opcional: sem ele, serializa em JSON compacto.
+    msgpack = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+HISTORY_KEY = "chat_history_for_llm"
+
+
+def dumps(value):
+    if msgpack is not None:
+        return msgpack.packb(value, use_bin_type=True)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(blob):
+    if msgpack is not None:
+        return msgpack.unpackb(blob, raw=False)
+    return json.loads(blob)
+
+
+class MemorySessionStore:
+    """Sessões em memória com descarte LRU. Apenas para desenvolvimento (não é compartilhado entre workers).
+
+    Como nos outros backends, `append` retorna False (sem gravar nada) se a sessão não existe
+    mais (descartada ou expirada), para o chamador regravá-la inteira com `replace`.
+    """
+
+    def __init__(self, max_sessions=SESSION_MEMORY_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_uuid):
+        with self._lock:
+            record = self._data.get(session_uuid)
+            if record is None:
+                return None
+            self._data.move_to_end(session_uuid)
+            return record["state"], list(record["history"])
+
+    def replace(self, session_uuid, state_blob, history_blobs):
+        with self._lock:
+            self._data[session_uuid] = {"state": state_blob, "history": list(history_blobs)}
+            self._data.move_to_end(session_uuid)
+            while len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+
+    def append(self, session_uuid, state_blob, history_blobs):
+        with self._lock:
+            record = self._data.get(session_uuid)
+            if record is None:
+                return False
+            if state_blob is not None:
+                record["state"] = state_blob
+            record["history"].extend(history_blobs)
+            self._data.move_to_end(session_uuid)
+            return True
+
+    def delete(self, session_uuid):
+        with self._lock:
+            self._data.pop(session_uuid, None)
+
+
+class SQLiteSessionStore:
+    """Sessões em SQLite (modo WAL), compartilhadas entre os workers de um mesmo container.
+
+    As sessões expiradas são apagadas na criação e depois, no máximo a cada `purge_interval`
+    segundos, durante as gravações.
+    """
+
+    def __init__(self, path=SESSION_SQLITE_PATH, ttl_seconds=SESSION_TTL_SECONDS, purge_interval=SESSION_PURGE_INTERVAL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._purge_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS chat_sessions (uuid TEXT PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS chat_history (uuid TEXT NOT NULL, seq INTEGER NOT NULL, entry BLOB NOT NULL, PRIMARY KEY (uuid, seq))")
+            conn.execute("CREATE INDEX IF NOT EXISTS chat_sessions_updated_at ON chat_sessions (updated_at)")
+        self.purge_expired()
+
+    def _connection(self):
+        # Uma conexão por thread e por processo (conexões SQLite não sobrevivem a um fork).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def load(self, session_uuid):
+        conn = self._connection()
+        row = conn.execute("SELECT state, updated_at FROM chat_sessions WHERE uuid = ?", (session_uuid,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        history = [entry for (entry,) in conn.execute("SELECT entry FROM chat_history WHERE uuid = ? ORDER BY seq", (session_uuid,))]
+        return row[0], history
+
+    def replace(self, session_uuid, state_blob, history_blobs):
+        self._maybe_purge()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO chat_sessions (uuid, state, updated_at) VALUES (?, ?, ?)", (session_uuid, state_blob, time.time()))
+            conn.execute("DELETE FROM chat_history WHERE uuid = ?", (session_uuid,))
+            conn.executemany("INSERT INTO chat_history (uuid, seq, entry) VALUES (?, ?, ?)",
+                             [(session_uuid, seq, blob) for seq, blob in enumerate(history_blobs)])
+
+    def append(self, session_uuid, state_blob, history_blobs):
+        self._maybe_purge()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # Só estende uma sessão ainda válida: expirada ou apagada, o chamador a regrava inteira.
+            if state_blob is not None:
+                cursor = conn.execute("UPDATE chat_sessions SET state = ?, updated_at = ? WHERE uuid = ? AND updated_at >= ?",
+                                      (state_blob, now, session_uuid, now - self.ttl_seconds))
+            else:
+                cursor = conn.execute("UPDATE chat_sessions SET updated_at = ? WHERE uuid = ? AND updated_at >= ?",
+                                      (now, session_uuid, now - self.ttl_seconds))
+            if cursor.rowcount == 0:
+                return False
+            if history_blobs:
+                next_seq = conn.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM chat_history WHERE uuid = ?", (session_uuid,)).fetchone()[0]
+                conn.executemany("INSERT INTO chat_history (uuid, seq, entry) VALUES (?, ?, ?)",
+                                 [(session_uuid, next_seq + i, blob) for i, blob in enumerate(history_blobs)])
+        return True
+
+    def delete(self, session_uuid):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM chat_sessions WHERE uuid = ?", (session_uuid,))
+            conn.execute("DELETE FROM chat_history WHERE uuid = ?", (session_uuid,))
+
+    def _maybe_purge(self):
+        if time.monotonic() < self._next_purge or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_purge = time.monotonic() + self.purge_interval
+            self.purge_expired()
+        except Exception as e:
+            logging.error(f"Erro ao apagar sessões expiradas do SQLite: {e}")
+        finally:
+            self._purge_lock.release()
+
+    def purge_expired(self):
+        conn = self._connection()
+        cutoff = time.time() - self.ttl_seconds
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM chat_history WHERE uuid IN (SELECT uuid FROM chat_sessions WHERE updated_at < ?)", (cutoff,))
+            conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (cutoff,))
+
+
+class RedisSessionStore:
+    """Sessões em Redis (ou compatível): estado em uma chave e histórico em uma lista (RPUSH)."""
+
+    def __init__(self, url=SESSION_REDIS_URL, ttl_seconds=SESSION_TTL_SECONDS, client=None):
+        if client is None and redis is None:
+            raise RuntimeError("Pacote 'redis' não instalado; necessário para SESSION_BACKEND=redis.")
+        self.client = client or redis.Redis.from_url(url)
+        self.ttl_seconds = int(ttl_seconds)
+
+    @staticmethod
+    def _keys(session_uuid):
+        return f"chat_session:{session_uuid}:state", f"chat_session:{session_uuid}:history"
+
+    def load(self, session_uuid):
+        state_key, history_key = self._keys(session_uuid)
+        pipe = self.client.pipeline()
+        pipe.get(state_key)
+        pipe.lrange(history_key, 0, -1)
+        state_blob, history = pipe.execute()
+        if state_blob is None:
+            return None
+        return state_blob, history
+
+    def replace(self, session_uuid, state_blob, history_blobs):
+        state_key, history_key = self._keys(session_uuid)
+        pipe = self.client.pipeline()
+        pipe.set(state_key, state_blob, ex=self.ttl_seconds)
+        pipe.delete(history_key)
+        if history_blobs:
+            pipe.rpush(history_key, *history_blobs)
+        pipe.expire(history_key, self.ttl_seconds)
+        pipe.execute()
+
+    def append(self, session_uuid, state_blob, history_blobs):
+        state_key, history_key = self._keys(session_uuid)
+        pipe = self.client.pipeline()
+        pipe.exists(state_key)
+        if state_blob is not None:
+            pipe.set(state_key, state_blob, ex=self.ttl_seconds)
+        else:
+            pipe.expire(state_key, self.ttl_seconds)
+        if history_blobs:
+            pipe.rpush(history_key, *history_blobs)
+        pipe.expire(history_key, self.ttl_seconds)
+        # Se o estado já tinha expirado, o que foi gravado aqui é parcial; o chamador regrava a sessão inteira.
+        return bool(pipe.execute()[0])
+
+    def delete(self, session_uuid):
+        self.client.delete(*self._keys(session_uuid))
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """Cria o backend configurado em SESSION_BACKEND; retorna None para manter o cookie assinado do Flask."""
+    if backend == "cookie":
+        return None
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "redis":
+        return RedisSessionStore()
+    raise ValueError(f"SESSION_BACKEND desconhecido: {backend}")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, session_uuid=None, state_blob=None, history_len=0):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.modified = False
+        self.loaded_uuid = session_uuid
+        self.state_blob = state_blob
+        self.history_len = history_len
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Sessão do Flask guardada no servidor e identificada pelo `session_uuid`.
+
+    O cookie carrega apenas o `session_uuid` assinado. A cada resposta só o que
+    mudou é gravado: o estado (sem o histórico), se diferente do carregado, e as
+    novas mensagens do histórico, anexadas ao final.
+    """
+
+    salt = "chat-session-uuid"
+
+    def __init__(self, store):
+        self.store = store
+
+    def _serializer(self, app):
+        return URLSafeSerializer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return ServerSideSession()
+        try:
+            session_uuid = self._serializer(app).loads(cookie)
+            loaded = self.store.load(session_uuid)
+        except BadSignature:
+            return ServerSideSession()
+        except Exception as e:
+            logging.error(f"Erro ao carregar sessão do servidor: {e}")
+            return ServerSideSession()
+        if loaded is None:
+            # Expirada, purgada ou gravada em outro container (o sqlite é local a cada um).
+            logging.info(f"Sessão {session_uuid} do cookie não existe no backend de sessões.")
+            return ServerSideSession()
+        state_blob, history_blobs = loaded
+        state = loads(state_blob)
+        state[HISTORY_KEY] = [loads(blob) for blob in history_blobs]
+        return ServerSideSession(state, session_uuid=session_uuid, state_blob=state_blob, history_len=len(history_blobs))
+
+    def persist(self, session):
+        """Grava no backend o delta da sessão desde a última leitura ou gravação."""
+        session_uuid = session.get("session_uuid")
+        if not session_uuid:
+            return
+        state = {k: v for k, v in session.items() if k != HISTORY_KEY}
+        history = session.get(HISTORY_KEY, [])
+        state_blob = dumps(state)
+
+        if session_uuid != session.loaded_uuid or len(history) < session.history_len:
+            if session.loaded_uuid and session.loaded_uuid != session_uuid:
+                self.store.delete(session.loaded_uuid)
+            self.store.replace(session_uuid, state_blob, [dumps(entry) for entry in history])
+        else:
+            new_entries = history[session.history_len:]
+            if state_blob != session.state_blob or new_entries:
+                appended = self.store.append(session_uuid, state_blob if state_blob != session.state_blob else None,
+                                             [dumps(entry) for entry in new_entries])
+                if not appended:
+                    # A sessão saiu do backend (descartada ou expirada) durante a conversa: regrava inteira.
+                    self.store.replace(session_uuid, state_blob, [dumps(entry) for entry in history])
+        session.loaded_uuid, session.state_blob, session.history_len = session_uuid, state_blob, len(history)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session.get("session_uuid"):
+            if session.loaded_uuid:
+                self.store.delete(session.loaded_uuid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        previous_uuid = session.loaded_uuid
+        try:
+            self.persist(session)
+        except Exception as e:
+            logging.error(f"Erro ao salvar sessão {session.get('session_uuid')} no servidor: {e}")
+            return
+
+        if session["session_uuid"] != previous_uuid:
+            response.vary.add("Cookie")
+            response.set_cookie(
+                name,
+                self._serializer(app).dumps(session["session_uuid"]),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
@@ -0,0 +1,131 @@
+import string
+
+_SIMPLE_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+def _hex4(digits):
+    """Valor de 4 dígitos hexadecimais, ou None se não forem exatamente 4 dígitos válidos."""
+    if len(digits) != 4 or not all(c in string.hexdigits for c in digits):
+        return None
+    return int(digits, 16)
+
+
+def _partial_unicode_escape(text):
+    """Se `text` ainda pode virar um \\uXXXX completo com mais dados."""
+    return len(text) < 6 and "\\u".startswith(text[:2]) and all(c in string.hexdigits for c in text[2:])
+
+
+class RespostaStreamExtractor:
+    """Extrai incrementalmente o campo "resposta" do JSON estruturado enquanto os tokens chegam.
+
+    `feed(chunk)` devolve apenas o texto novo de "resposta" decodificado a partir
+    daquele pedaço; o texto bruto completo fica em `text` para ser aplicado à
+    sessão quando `closed` for verdadeiro. Qualquer texto antes do primeiro '{'
+    (preâmbulo, cerca de código) é ignorado.
+    """
+
+    def __init__(self, field="resposta"):
+        self.field = field
+        self.text = ""
+        self.closed = False
+        self.found = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_buf = []
+        self._last_string = None
+        self._state = "scan"  # scan | before_value | value
+
+    def feed(self, chunk):
+        self.text += chunk
+        text = self.text
+        out = []
+        while self._pos < len(text) and not self.closed:
+            if self._state == "value":
+                if not self._consume_value(text, out):
+                    break
+            elif self._state == "before_value":
+                ch = text[self._pos]
+                self._pos += 1
+                if ch == '"':
+                    self._state = "value"
+                elif not ch.isspace():
+                    # "resposta" não é uma string: volta a varrer normalmente.
+                    self._state = "scan"
+                    self._pos -= 1
+                    self._last_string = None
+            else:
+                self._consume_scan(text[self._pos])
+                self._pos += 1
+        return "".join(out)
+
+    def _consume_scan(self, ch):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == '\\':
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                self._last_string = "".join(self._string_buf)
+            else:
+                self._string_buf.append(ch)
+        elif ch == '"':
+            if self._depth > 0:
+                self._in_string = True
+                self._string_buf = []
+        elif ch == '{':
+            self._depth += 1
+        elif ch == '}':
+            if self._depth > 0:
+                self._depth -= 1
+                self.closed = self._depth == 0
+        elif ch == ':' and self._depth == 1 and not self.found and self._last_string == self.field:
+            self._state = "before_value"
+        elif ch == ',':
+            self._last_string = None
+
+    def _consume_value(self, text, out):
+        """Decodifica um caractere do valor de "resposta"; retorna False se precisar de mais dados."""
+        ch = text[self._pos]
+        if ch == '"':
+            self._pos += 1
+            self._state = "scan"
+            self._last_string = None
+            self.found = True
+        elif ch != '\\':
+            self._pos += 1
+            out.append(ch)
+        else:
+            if self._pos + 1 >= len(text):
+                return False
+            code = text[self._pos + 1]
+            if code != 'u':
+                out.append(_SIMPLE_ESCAPES.get(code, code))
+                self._pos += 2
+                return True
+            escape = text[self._pos:self._pos + 6]
+            if _partial_unicode_escape(escape):
+                return False
+            code_point = _hex4(escape[2:])
+            if code_point is None or 0xDC00 <= code_point <= 0xDFFF:
+                # \u malformado (ou metade baixa solta): segue como texto, sem derrubar o stream.
+                out.append(escape[:2] if code_point is None else escape)
+                self._pos += 2 if code_point is None else 6
+                return True
+            if 0xD800 <= code_point <= 0xDBFF:
+                # Par substituto (ex.: emoji): espera a segunda metade antes de decodificar.
+                low = text[self._pos + 6:self._pos + 12]
+                if _partial_unicode_escape(low):
+                    return False
+                low_point = _hex4(low[2:]) if low.startswith("\\u") else None
+                if low_point is None or not 0xDC00 <= low_point <= 0xDFFF:
+                    out.append(escape)
+                    self._pos += 6
+                    return True
+                code_point = 0x10000 + ((code_point - 0xD800) << 10) + (low_point - 0xDC00)
+                self._pos += 6
+            out.append(chr(code_point))
+            self._pos += 6
+        return True
@@ -0,0 +1,153 @@
+import contextvars
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from utils import metrics
+from utils.constants import (
+    TRACING_EXPORTER, TRACE_SLOW_TURN_SECONDS,
+    PROFILER_SAMPLE_RATE, PROFILER_OUTPUT_DIR, LOG_SESSION_DUMP
+)
+
+# Tempo por etapa do turno em andamento (catalog, prompt, llm, parse, save...), para o log de turnos lentos.
+_turn_stages = contextvars.ContextVar("turn_stages", default=None)
+_tracer = None
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _get_tracer():
+    """Tracer do OpenTelemetry se TRACING_EXPORTER=otel e o pacote estiver instalado; senão None (no-op).
+
+    A configuração do exportador (OTLP, console...) fica por conta do SDK, ex.: `opentelemetry-instrument`.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = False
+        if TRACING_EXPORTER == "otel":
+            try:
+                from opentelemetry import trace
+                _tracer = trace.get_tracer("chat-marketplace")
+            except ImportError:
+                logging.warning("TRACING_EXPORTER=otel, mas o pacote opentelemetry-api não está instalado; spans desativados.")
+    return _tracer or None
+
+
+@contextmanager
+def _otel_span(name, attributes):
+    tracer = _get_tracer()
+    if tracer is None:
+        yield _NOOP_SPAN
+    else:
+        with tracer.start_as_current_span(name, attributes=attributes) as otel_span:
+            yield otel_span
+
+
+@contextmanager
+def span(name, **attributes):
+    """Mede uma etapa do pipeline: histograma `chat_stage_seconds{stage=name}` e, se ativo, um span OpenTelemetry."""
+    start = time.perf_counter()
+    try:
+        with _otel_span(name, attributes) as current:
+            yield current
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("chat_stage_seconds", elapsed, stage=name)
+        stages = _turn_stages.get()
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def traced(name):
+    """Decorador equivalente a `with span(name)` em volta da função."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _maybe_profile(route):
+    if not PROFILER_SAMPLE_RATE or random.random() >= PROFILER_SAMPLE_RATE:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        os.makedirs(PROFILER_OUTPUT_DIR, exist_ok=True)
+        path = os.path.join(PROFILER_OUTPUT_DIR, f"{route}-{int(time.time() * 1000)}-{elapsed_ms:.0f}ms.prof")
+        profiler.dump_stats(path)
+        logging.info(f"Perfil do turno salvo em {path} (abrir com `python -m pstats` ou snakeviz).")
+
+
+def trace_turn(route):
+    """Decorador das rotas de chat: histograma `chat_turn_seconds`, span raiz, log de turnos lentos e profiler por amostragem.
+
+    Aceita views síncronas (Flask) e assíncronas (Quart).
+    """
+    def start():
+        return _turn_stages.set({}), time.perf_counter()
+
+    def finish(token, started):
+        elapsed = time.perf_counter() - started
+        stages = _turn_stages.get()
+        _turn_stages.reset(token)
+        metrics.observe("chat_turn_seconds", elapsed, route=route)
+        if TRACE_SLOW_TURN_SECONDS and elapsed >= TRACE_SLOW_TURN_SECONDS:
+            breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in stages.items())
+            logging.warning(f"Turno lento em /{route}: {elapsed * 1000:.0f}ms ({breakdown})")
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                token, started = start()
+                try:
+                    with _maybe_profile(route), _otel_span(route, {"http.route": f"/{route}"}):
+                        return await view(*args, **kwargs)
+                finally:
+                    finish(token, started)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token, started = start()
+            try:
+                with _maybe_profile(route), _otel_span(route, {"http.route": f"/{route}"}):
+                    return view(*args, **kwargs)
+            finally:
+                finish(token, started)
+        return wrapper
+    return decorator
+
+
+def log_turn(session_data):
+    """Resumo de uma linha do turno no lugar do dump completo da sessão (LOG_SESSION_DUMP=true o reativa em DEBUG)."""
+    if LOG_SESSION_DUMP:
+        logging.debug(f"Sessão completa: {dict(session_data)}")
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        stages = _turn_stages.get() or {}
+        timings = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in stages.items())
+        logging.info(
+            f"turno session={session_data.get('session_uuid')} state={session_data.get('chat_state')} "
+            f"cart_items={len(session_data.get('customer_data', {}).get('cart') or [])} total={session_data.get('total_value')} "
+            f"history={len(session_data.get('chat_history_for_llm') or [])} prompt_tokens={session_data.get('last_prompt_tokens')} {timings}".rstrip()
+        )
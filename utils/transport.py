@@ -0,0 +1,200 @@
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+from utils import metrics
+from utils.constants import (
+    LLM_POOL_CONNECTIONS, LLM_POOL_MAXSIZE,
+    LLM_MAX_RETRIES, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS, LLM_RETRY_AFTER_MAX_SECONDS,
+    LLM_REQUEST_DEADLINE_SECONDS,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS
+)
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Sessão HTTP do processo, com pool de conexões keep-alive para os provedores de LLM.
+
+    Recriada após um fork (ex.: gunicorn com preload) para não compartilhar sockets entre workers.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=LLM_POOL_CONNECTIONS, pool_maxsize=LLM_POOL_MAXSIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """O circuito do provedor está aberto: a chamada falha imediatamente, sem ir à rede."""
+
+
+class CircuitBreaker:
+    """Circuit breaker por provedor: abre após N falhas seguidas e testa de novo após um intervalo.
+
+    No estado meio aberto só uma chamada de teste passa; se ela não registrar resultado em
+    `reset_seconds` (ex.: a thread morreu), uma nova chamada de teste é liberada.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if (self.state == "open" and now - self._opened_at >= self.reset_seconds) or \
+                    (self.state == "half_open" and now - self._trial_started_at >= self.reset_seconds):
+                # Meio aberto: deixa passar uma chamada de teste.
+                self.state = "half_open"
+                self._trial_started_at = now
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logging.info(f"Circuito do provedor {self.name} fechado novamente.")
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logging.warning(f"Circuito do provedor {self.name} aberto após {self._failures} falhas.")
+                    metrics.increment("llm_circuit_opened_total", provider=self.name)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+_breakers = {}
+
+
+def get_circuit_breaker(provider):
+    if provider not in _breakers:
+        _breakers.setdefault(provider, CircuitBreaker(provider))
+    return _breakers[provider]
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return max(0.0, seconds)
+
+
+def backoff_delay(attempt, response=None):
+    """Atraso antes da próxima tentativa: respeita Retry-After (limitado) ou usa backoff exponencial com jitter total."""
+    retry_after = _retry_after_seconds(response)
+    if retry_after is not None:
+        return min(retry_after, LLM_RETRY_AFTER_MAX_SECONDS)
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def post_with_retry(provider, model, url, max_retries=LLM_MAX_RETRIES, deadline=None, **kwargs):
+    """POST com pool de conexões, retentativas para 429/5xx/erros de rede e circuit breaker.
+
+    Todas as tentativas e esperas cabem em `deadline` segundos (padrão LLM_REQUEST_DEADLINE_SECONDS):
+    o `timeout` de cada tentativa é limitado ao que resta do prazo, e a próxima tentativa só sai
+    se a espera antes dela couber. Retorna a resposta já validada (`raise_for_status`). Lança
+    `CircuitOpenError` se o circuito do provedor estiver aberto, ou a última exceção quando as
+    tentativas (ou o prazo) acabam.
+    """
+    breaker = get_circuit_breaker(provider)
+    session = get_http_session()
+    deadline_at = time.monotonic() + (LLM_REQUEST_DEADLINE_SECONDS if deadline is None else deadline)
+    timeout = kwargs.pop("timeout", None)
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            metrics.increment("llm_requests_total", provider=provider, model=model, outcome="circuit_open")
+            raise CircuitOpenError(f"Circuito aberto para o provedor {provider}")
+
+        start = time.perf_counter()
+        response = None
+        reachable = False
+        remaining = max(0.001, deadline_at - time.monotonic())
+        try:
+            response = session.post(url, timeout=remaining if timeout is None else min(timeout, remaining), **kwargs)
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                error = requests.exceptions.HTTPError(f"{response.status_code} do provedor {provider}", response=response)
+            else:
+                # 2xx ou 4xx não recuperável: o provedor está respondendo.
+                reachable = True
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        finally:
+            # Toda tentativa registra um resultado, inclusive quando termina com uma exceção inesperada;
+            # senão a chamada de teste do circuito meio aberto ficaria sem resposta.
+            if reachable:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+
+        if reachable:
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                metrics.increment("llm_requests_total", provider=provider, model=model, outcome="client_error")
+                raise
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, provider=provider, model=model)
+            metrics.increment("llm_requests_total", provider=provider, model=model, outcome="success")
+            return response
+
+        metrics.observe("llm_request_seconds", time.perf_counter() - start, provider=provider, model=model)
+        delay = backoff_delay(attempt, response)
+        if attempt >= max_retries or time.monotonic() + delay >= deadline_at:
+            if attempt < max_retries:
+                metrics.increment("llm_deadline_exceeded_total", provider=provider, model=model)
+                logging.warning(f"Falha ao chamar {provider} ({error}); sem nova tentativa: o prazo da chamada acabou.")
+            metrics.increment("llm_requests_total", provider=provider, model=model, outcome="failed")
+            raise error
+        metrics.increment("llm_retries_total", provider=provider, model=model)
+        logging.warning(f"Falha ao chamar {provider} ({error}); nova tentativa em {delay:.2f}s.")
+        if response is not None:
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def get_transport_stats():
+    stats = {"circuits": {name: breaker.state for name, breaker in _breakers.items()}, "latency": {}}
+    for name, labels, histogram in metrics.iter_histograms():
+        if name == "llm_request_seconds":
+            key = f"{labels['provider']}/{labels['model']}"
+            stats["latency"][key] = {
+                "count": histogram.count,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+            }
+    return stats
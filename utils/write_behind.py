@@ -0,0 +1,163 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from utils import metrics
+from utils.constants import (
+    WRITE_BEHIND_ENABLED, WRITE_BEHIND_FLUSH_INTERVAL_SECONDS, WRITE_BEHIND_MAX_PENDING
+)
+from utils.firebase import build_session_record, save_session_to_firestore, write_session_records
+
+# Operações por sessão no pior caso: documento da sessão + -1/+1 nos contadores + índice de modelos.
+_MAX_OPS_PER_SESSION = 4
+_MAX_OPS_PER_BATCH = 500
+# Estados que encerram a venda e não devem esperar o próximo ciclo de gravação.
+FLUSH_IMMEDIATELY_STATES = frozenset({"proposta_final", "FINALIZED"})
+
+
+class SessionWriteBehindQueue:
+    """Fila de gravação tardia de 'sessions', coalescendo as atualizações de cada sessão.
+
+    `enqueue` só guarda o último registro de cada sessão; uma thread em segundo
+    plano grava os pendentes em transações quando o intervalo expira, quando a
+    fila atinge `max_pending` ou quando uma sessão chega a um estado final.
+
+    Cada worker tem a sua fila, mas a sessão é compartilhada: um registro antigo que
+    ainda estava pendente em outro worker é descartado na gravação (`turn_seq`).
+    """
+
+    def __init__(self, db, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL_SECONDS, max_pending=WRITE_BEHIND_MAX_PENDING):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="session-write-behind", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, session_data):
+        if not session_data.get("session_uuid"):
+            return
+        record = build_session_record(session_data)
+        session_uuid = record["session_uuid"]
+        with self._lock:
+            if session_uuid in self._pending:
+                metrics.increment("session_writes_coalesced_total")
+            self._pending[session_uuid] = record
+            depth = len(self._pending)
+        metrics.increment("session_writes_enqueued_total")
+        metrics.set_gauge("session_write_queue_depth", depth)
+        if depth >= self.max_pending or record["final_state"] in FLUSH_IMMEDIATELY_STATES:
+            self._wakeup.set()
+
+    def flush(self):
+        """Grava todos os registros pendentes; retorna quantas sessões foram gravadas."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            metrics.set_gauge("session_write_queue_depth", 0)
+            if not pending:
+                return 0
+
+            start = time.perf_counter()
+            items = list(pending.items())
+            per_batch = _MAX_OPS_PER_BATCH // _MAX_OPS_PER_SESSION
+            written = 0
+            for offset in range(0, len(items), per_batch):
+                chunk = items[offset:offset + per_batch]
+                try:
+                    written += write_session_records(self.db, [record for _, record in chunk])
+                except Exception as e:
+                    logging.error(f"Erro ao gravar lote de {len(chunk)} sessões no Firestore: {e}")
+                    metrics.increment("session_write_batch_errors_total")
+                    self._requeue(chunk)
+            elapsed = time.perf_counter() - start
+            metrics.observe("session_write_flush_seconds", elapsed)
+            metrics.increment("session_writes_flushed_total", written)
+            logging.info(f"{written} sessões gravadas no Firestore em {elapsed * 1000:.1f} ms.")
+            return written
+
+    def _requeue(self, chunk):
+        with self._lock:
+            for session_uuid, record in chunk:
+                # Se um registro mais novo já chegou, ele substitui o que falhou.
+                self._pending.setdefault(session_uuid, record)
+            metrics.set_gauge("session_write_queue_depth", len(self._pending))
+
+    def depth(self):
+        return len(self._pending)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Erro inesperado na gravação tardia de sessões: {e}")
+
+    def close(self):
+        """Para a thread e grava o que estiver pendente (chamado no encerramento do processo)."""
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+_queue = None
+_queue_pid = None
+_queue_lock = threading.Lock()
+
+
+def get_write_behind_queue(db):
+    """Fila do processo atual (recriada após fork, já que threads não sobrevivem a um fork)."""
+    global _queue, _queue_pid
+    if _queue is None or _queue_pid != os.getpid() or _queue.db is not db:
+        with _queue_lock:
+            if _queue is None or _queue_pid != os.getpid() or _queue.db is not db:
+                if _queue is not None and _queue_pid == os.getpid():
+                    _queue.close()
+                _queue, _queue_pid = SessionWriteBehindQueue(db), os.getpid()
+    return _queue
+
+
+def queue_session_save(db, session_data):
+    """Agenda a gravação da sessão (ou grava na hora se WRITE_BEHIND_ENABLED estiver desligado)."""
+    if not db or not session_data.get("session_uuid"):
+        return
+    if not WRITE_BEHIND_ENABLED:
+        save_session_to_firestore(db, session_data)
+        return
+    try:
+        get_write_behind_queue(db).enqueue(session_data)
+    except Exception as e:
+        logging.error(f"Erro ao enfileirar sessão {session_data.get('session_uuid')}: {e}")
+        save_session_to_firestore(db, session_data)
+
+
+def flush_session_writes():
+    """Grava o que estiver pendente e descarta a fila do processo; o próximo `queue_session_save` cria outra."""
+    global _queue, _queue_pid
+    with _queue_lock:
+        if _queue is not None and _queue_pid == os.getpid():
+            _queue.close()
+        _queue, _queue_pid = None, None
+
+
+def get_write_behind_stats():
+    flush_latency = metrics.get_histogram("session_write_flush_seconds")
+    return {
+        "queue_depth": _queue.depth() if _queue is not None else 0,
+        "enqueued": metrics.get_counter("session_writes_enqueued_total"),
+        "coalesced": metrics.get_counter("session_writes_coalesced_total"),
+        "flushed": metrics.get_counter("session_writes_flushed_total"),
+        "flushes": flush_latency.count,
+        "flush_p95_seconds": flush_latency.quantile(0.95),
+    }
+
+
+atexit.register(flush_session_writes)